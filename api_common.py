@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Общие части синхронного (timeweb_api_simple.py) и асинхронного
+(timeweb_api_async.py) API: настройки, курсоры страниц, ETag, разбор /bulk
+и SQL для сборки JSON в PostgreSQL. Без Flask и без обращений к БД.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+
+# Версия API (входит в ETag: при изменении формата ответов кеш клиентов сбрасывается)
+API_VERSION = '1.0.0'
+
+def api_config_from_env():
+    """
+    Настройки списков и /bulk из переменных окружения (вызывать после load_dotenv):
+
+    - default_page_size/max_page_size: размер страницы, если клиент не передал limit, и предел limit
+    - json_passthrough: списки собираются в JSON на стороне PostgreSQL (json_build_object)
+      и отдаются без разбора в Python; 0 - старый путь через dict и app.json
+    - bulk_max_items: максимум элементов в одном запросе к /bulk эндпоинтам
+    - event_type_max_length: максимальная длина event_type в /api/user_events
+    """
+    return {
+        'default_page_size': int(os.getenv('API_DEFAULT_PAGE_SIZE', '100')),
+        'max_page_size': int(os.getenv('API_MAX_PAGE_SIZE', '500')),
+        'json_passthrough': os.getenv('API_JSON_PASSTHROUGH', '1') not in ('0', 'false', 'no'),
+        'bulk_max_items': int(os.getenv('API_BULK_MAX_ITEMS', '500')),
+        'event_type_max_length': int(os.getenv('API_EVENT_TYPE_MAX_LENGTH', '100')),
+    }
+
+
+# Сортировки /api/admin/users_list: выражение (есть индекс в user_activity)
+# и разбор значения из курсора. NULL-даты сортируются как epoch.
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+USER_LIST_SORTS = {
+    'created_at': ("COALESCE(ua.created_at, 'epoch'::timestamptz)", datetime.fromisoformat),
+    'last_activity': ("COALESCE(ua.last_activity, 'epoch'::timestamptz)", datetime.fromisoformat),
+    'strategies_count': ("ua.strategies_count", int),
+    'analyses_count': ("ua.analyses_count", int),
+}
+
+# Версии данных пользователя в user_activity (timeweb-user-activity.sql).
+# Увеличиваются триггерами при любом изменении стратегий/анализов.
+DATA_VERSION_COLUMNS = {
+    'strategies': ('strategies_version', 'strategies_changed_at'),
+    'analyses': ('analyses_version', 'analyses_changed_at'),
+}
+
+# Политики чтения по эндпоинтам (db_router.py), остальные запросы идут в primary.
+# replica - реплика, если она уже получила изменения пользователя,
+# analytics - тяжелые админ-запросы, допускающие большее отставание
+READ_POLICIES = {
+    'get_strategies': 'replica',
+    'get_analyses': 'replica',
+    'get_user_stats': 'replica',
+    'admin_users_by_date': 'analytics',
+    'admin_daily': 'analytics',
+    'admin_cohorts': 'analytics',
+    'admin_users_list': 'analytics',
+    'admin_user_details': 'analytics',
+    'admin_check_duplicates': 'analytics',
+}
+
+# Эндпоинты записи, после которых чтения пользователя временно идут в primary
+STICKY_WRITE_ENDPOINTS = (
+    'create_strategy', 'create_strategies_bulk', 'create_analysis',
+    'create_analyses_bulk', 'create_user',
+)
+
+# Классы эндпоинтов для ограничения запросов (rate_limit.py): admin - тяжелые
+# админ-запросы, exempt - без ограничений. Остальные: GET/HEAD - read, иначе write
+RATE_CLASSES = {
+    'admin_stats_reconcile': 'admin',
+    'admin_rollups_refresh': 'admin',
+    'admin_users_by_date': 'admin',
+    'admin_daily': 'admin',
+    'admin_cohorts': 'admin',
+    'admin_users_list': 'admin',
+    'admin_user_details': 'admin',
+    'admin_check_duplicates': 'admin',
+    'health_check': 'exempt',
+    'health_live': 'exempt',
+    'health_ready': 'exempt',
+    'api_info': 'exempt',
+    'api_metrics': 'exempt',
+}
+
+# Эндпоинты, обработчики которых не обращаются к БД (не ограничиваются
+# по числу одновременных запросов)
+NO_DB_ENDPOINTS = (
+    'create_user_event', 'admin_user_cache_stats', 'admin_user_cache_invalidate',
+    'admin_replicas_stats', 'admin_slow_queries', 'admin_profiles', 'admin_profile',
+    'admin_events_stats', 'admin_rate_limits',
+)
+
+API_ENDPOINTS = {
+    'GET /api/strategies': 'Получение стратегий пользователя (limit, cursor)',
+    'POST /api/strategies': 'Создание новой стратегии',
+    'POST /api/strategies/bulk': 'Создание нескольких стратегий (массив или {items})',
+    'PUT /api/strategies/<id>': 'Обновление стратегии',
+    'DELETE /api/strategies/<id>': 'Удаление стратегии',
+    'GET /api/analysis_results': 'Получение анализов пользователя (limit, cursor)',
+    'POST /api/analysis_results': 'Создание нового анализа',
+    'POST /api/analysis_results/bulk': 'Создание нескольких анализов (массив или {items})',
+    'DELETE /api/analysis_results/<id>': 'Удаление анализа',
+    'POST /api/user_events': 'Событие аналитики (202, запись пачками)',
+    'GET /api/users/stats/<telegram_id>': 'Статистика пользователя',
+    'GET /api/health': 'Проверка здоровья API'
+}
+
+def api_info_data():
+    """Тело ответа /api/info"""
+    return {
+        'name': 'TradeAnalyzer API',
+        'version': API_VERSION,
+        'description': 'API для работы с торговыми стратегиями и анализами',
+        'endpoints': API_ENDPOINTS
+    }
+
+def written_telegram_ids(data):
+    """telegram_id пользователей из тела запроса записи (объект, массив или {"items": [...]})"""
+    ids = set()
+    if isinstance(data, dict):
+        ids.add(data.get('telegram_user_id') or data.get('telegram_id'))
+        data = data.get('items')
+    if isinstance(data, list):
+        ids.update(item.get('telegram_user_id') for item in data if isinstance(item, dict))
+    return {str(telegram_id) for telegram_id in ids if telegram_id}
+
+# ============================================================================
+# СТРАНИЦЫ И КУРСОРЫ
+# ============================================================================
+
+def encode_cursor(value, row_id):
+    """Курсор страницы из (ключ сортировки, id) последней строки"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, str(row_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, parse_value=datetime.fromisoformat):
+    """(ключ сортировки, id) из курсора страницы"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, row_id = json.loads(raw)
+        return parse_value(value), str(uuid.UUID(row_id))
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def parse_page_args(args, default_size=100, max_size=500):
+    """limit и курсор из query-параметров (request.args)"""
+    limit = args.get('limit', default_size)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    limit = min(limit, max_size)
+
+    cursor = args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+    return limit, after
+
+def page_validators_from_row(kind, user_id, row, limit, cursor=None):
+    """
+    (etag, last_modified) страницы списка по строке версии из user_activity
+    ({'version', 'changed_at'}). last_modified - точное changed_at: по нему
+    же выбирается реплика, в заголовок оно уходит с точностью до секунды.
+    """
+    key = f"{API_VERSION}:{kind}:{user_id}:{row['version']}:{limit}:{cursor or ''}"
+    etag = hashlib.sha1(key.encode()).hexdigest()[:24]
+    return etag, row['changed_at']
+
+def modified_since(last_modified, if_modified_since):
+    """
+    Изменились ли данные после If-Modified-Since.
+
+    HTTP-дата хранит только секунды: две записи в одну секунду дают один
+    Last-Modified, поэтому при дробной части changed_at 304 по дате не
+    отдается (остается только сравнение ETag).
+    """
+    if last_modified is None or if_modified_since is None or last_modified.microsecond:
+        return True
+    return last_modified > if_modified_since
+
+# ============================================================================
+# JSON НА СТОРОНЕ POSTGRESQL
+# ============================================================================
+
+# Дата в формате HTTP, как ее отдает Flask ("Sun, 18 Oct 2026 13:27:00 GMT")
+HTTP_DATE_SQL = "to_char({} AT TIME ZONE 'UTC', 'Dy, DD Mon YYYY HH24:MI:SS \"GMT\"')"
+
+def json_object_sql(columns, dates=()):
+    """
+    json_build_object(...) строки в формате ответа Flask.
+
+    Ключи идут по алфавиту (sort_keys у Flask), колонки из dates
+    форматируются как HTTP-дата.
+    """
+    parts = []
+    for column in sorted(columns):
+        expr = HTTP_DATE_SQL.format(column) if column in dates else column
+        parts.append(f"'{column}', {expr}")
+    return f"json_build_object({', '.join(parts)})"
+
+def row_json_sql(sql, columns, dates=(), order_by=''):
+    """Запрос, возвращающий каждую строку sql готовым JSON (для stream_query(..., raw=True))"""
+    return f"SELECT {json_object_sql(columns, dates)}::text FROM ({sql}) AS t {order_by}"
+
+# ============================================================================
+# АНАЛИЗЫ И /BULK
+# ============================================================================
+
+def analysis_results_json(data):
+    """Колонка results анализа из факторов запроса"""
+    return {
+        'positive': data.get('positive_factors', []),
+        'negative': data.get('negative_factors', []),
+        'neutral': data.get('neutral_factors', [])
+    }
+
+def add_analysis_factors(analysis):
+    """positive/negative/neutral_factors в ответе (совместимость со старым форматом)"""
+    results = analysis.get('results') or {}
+    analysis['positive_factors'] = results.get('positive', [])
+    analysis['negative_factors'] = results.get('negative', [])
+    analysis['neutral_factors'] = results.get('neutral', [])
+    return analysis
+
+def parse_bulk_items(data, max_items=500):
+    """
+    Тело запроса /bulk: массив элементов или {"items": [...], "telegram_user_id", "user_data"}.
+
+    Возвращает (valid, results): valid - список (index, telegram_id, item, user_data)
+    для вставки, results - заготовка ответа по элементам (ошибки валидации уже заполнены).
+    """
+    defaults = {}
+    if isinstance(data, dict):
+        defaults, data = data, data.get('items')
+    if not isinstance(data, list):
+        raise ValueError('JSON array or {"items": [...]} expected')
+    if len(data) > max_items:
+        raise ValueError(f'Too many items: {len(data)} > {max_items}')
+
+    valid = []
+    results = [None] * len(data)
+    for index, item in enumerate(data):
+        if not isinstance(item, dict):
+            results[index] = {'index': index, 'status': 'error', 'error': 'JSON object expected'}
+            continue
+        telegram_id = item.get('telegram_user_id') or defaults.get('telegram_user_id')
+        if not telegram_id:
+            results[index] = {'index': index, 'status': 'error', 'error': 'telegram_user_id is required'}
+            continue
+        user_data = item.get('user_data') or defaults.get('user_data') or {}
+        valid.append((index, str(telegram_id), item, user_data))
+    return valid, results
+
+def contains_nul(value):
+    """Есть ли символ \\u0000 в строках значения (text и jsonb в PostgreSQL его не хранят)"""
+    if isinstance(value, str):
+        return '\x00' in value
+    if isinstance(value, dict):
+        return any(contains_nul(key) or contains_nul(item) for key, item in value.items())
+    if isinstance(value, list):
+        return any(contains_nul(item) for item in value)
+    return False
+
+def parse_user_event(data, max_type_length=100):
+    """
+    Тело запроса /api/user_events: (telegram_user_id, event_type, event_data, user_data).
+
+    События пишутся пачками, поэтому все, что БД не примет, отклоняется здесь
+    (ValueError), а не при записи пачки.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('JSON object expected')
+
+    telegram_user_id = data.get('telegram_user_id')
+    event_type = data.get('event_type')
+    if not telegram_user_id or not event_type:
+        raise ValueError('telegram_user_id and event_type are required')
+    if not isinstance(telegram_user_id, (str, int)):
+        raise ValueError('telegram_user_id must be a string or a number')
+    if not isinstance(event_type, str) or len(event_type) > max_type_length:
+        raise ValueError(f'event_type must be a string of at most {max_type_length} characters')
+
+    user_data = data.get('user_data') or {}
+    if not isinstance(user_data, dict) or not all(
+            isinstance(user_data.get(key), (str, type(None))) for key in ('username', 'first_name', 'last_name')):
+        raise ValueError('user_data must be an object with string username, first_name, last_name')
+
+    if contains_nul(data):
+        raise ValueError('Strings must not contain \\u0000')
+    return str(telegram_user_id), event_type, data.get('event_data', {}), user_data
+
+def bulk_users(valid):
+    """{telegram_id: user_data} для resolve_user_ids (непустые user_data в приоритете)"""
+    users = {}
+    for _, telegram_id, _, user_data in valid:
+        if user_data or telegram_id not in users:
+            users[telegram_id] = user_data
+    return users
+
+def fill_bulk_results(valid, results, row_ids, inserted, errors):
+    """Результат по элементам: inserted - {id: строка}, errors - {позиция в valid: текст ошибки}"""
+    for pos, (index, _, _, _) in enumerate(valid):
+        row = inserted.get(row_ids[pos])
+        if row is not None:
+            results[index] = {'index': index, 'status': 'created', 'data': row}
+        else:
+            results[index] = {'index': index, 'status': 'error', 'error': errors.get(pos, 'Not inserted')}
+    return results
+
+def bulk_summary(results, transform=None):
+    """Итоговый ответ /bulk: {"data": [результат по элементам], "created", "failed"}"""
+    created = 0
+    for result in results:
+        if result['status'] == 'created':
+            created += 1
+            if transform:
+                transform(result['data'])
+
+    return {
+        'data': results,
+        'error': None,
+        'created': created,
+        'failed': len(results) - created
+    }
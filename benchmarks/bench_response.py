@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк слоя ответов (response_layer.py)
+Время кодирования JSON и размер ответа до/после сжатия на типичных списках
+стратегий (fields) и анализов (answers)
+
+Запуск из корня проекта:
+    python3 benchmarks/bench_response.py
+    python3 benchmarks/bench_response.py --rows 500 --repeat 50
+"""
+
+import argparse
+import gzip
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import response_layer
+
+INPUT_TYPES = ['text', 'number', 'select', 'boolean']
+LABELS = ['Символ актива', 'Тайм-фрейм', 'Уровень поддержки', 'Текущий объем',
+          'Объем относительно среднего', 'Значение RSI', 'Зона RSI', 'Новостной фон']
+OPTIONS = ['1m', '5m', '15m', '1h', '4h', '1d', 'Выше среднего', 'Средний', 'Ниже среднего']
+
+
+def make_strategy(rng, now):
+    """Стратегия как в app.js: несколько карточек с полями ввода"""
+    return {
+        'id': uuid.uuid4(),
+        'name': f'Стратегия {rng.randint(1, 999)}',
+        'description': 'Комплексная стратегия технического анализа',
+        'fields': [
+            {
+                'name': f'Анализ {i + 1}',
+                'description': 'Определение уровней поддержки и сопротивления',
+                'inputs': [
+                    {
+                        'type': rng.choice(INPUT_TYPES),
+                        'label': rng.choice(LABELS),
+                        'options': rng.sample(OPTIONS, 3),
+                        'required': rng.random() < 0.5,
+                    }
+                    for _ in range(rng.randint(2, 4))
+                ],
+            }
+            for i in range(rng.randint(3, 6))
+        ],
+        'created_at': now - timedelta(minutes=rng.randint(0, 100000)),
+        'updated_at': now,
+    }
+
+
+def make_analysis(rng, now):
+    """Анализ как его сохраняет app.js: ответы по карточкам и факторы"""
+    answers = [
+        {
+            'rating': rng.choice(['positive', 'negative', 'neutral']),
+            'fieldValues': [rng.choice(OPTIONS) for _ in range(3)],
+            'answers': [{'label': rng.choice(LABELS), 'value': rng.choice(OPTIONS)} for _ in range(3)],
+        }
+        for _ in range(rng.randint(3, 6))
+    ]
+    factors = [{'name': rng.choice(LABELS), 'answers': [rng.choice(OPTIONS)]} for _ in range(2)]
+    return {
+        'id': uuid.uuid4(),
+        'user_id': uuid.uuid4(),
+        'strategy_id': uuid.uuid4(),
+        'coin': rng.choice(['BTC', 'ETH', 'SOL', 'TON']),
+        'answers': answers,
+        'positive_factors': factors,
+        'negative_factors': factors[:1],
+        'neutral_factors': [],
+        'recommendation': 'Рекомендуется открыть позицию',
+        'created_at': now - timedelta(minutes=rng.randint(0, 100000)),
+    }
+
+
+def timeit(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_payload(name, payload, providers, repeat):
+    print(f"\n{name}")
+    print(f"  {'encoder':<10} {'encode, ms':>11} {'raw, KB':>9} {'gzip, KB':>9} {'br, KB':>8}")
+    baseline = None
+    for label, provider in providers:
+        encode = lambda: provider.dumps(payload, separators=(',', ':')) if label == 'flask' else provider.dumps(payload)
+        elapsed = timeit(encode, repeat)
+        body = encode().encode()
+        gz = len(gzip.compress(body, compresslevel=6))
+        br = len(response_layer.brotli.compress(body, quality=5)) if response_layer.brotli else None
+        if baseline is None:
+            baseline = elapsed
+        speedup = f"  x{baseline / elapsed:.1f}" if elapsed and label != 'flask' else ''
+        print(f"  {label:<10} {elapsed * 1000:>11.2f} {len(body) / 1024:>9.1f} {gz / 1024:>9.1f} "
+              f"{(br / 1024 if br else float('nan')):>8.1f}{speedup}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк JSON-кодирования и сжатия ответов')
+    parser.add_argument('--rows', type=int, default=100, help='строк в списке')
+    parser.add_argument('--repeat', type=int, default=20, help='повторов (берется лучшее время)')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    now = datetime.now(timezone.utc)
+    app = Flask(__name__)
+
+    providers = [('flask', DefaultJSONProvider(app))]
+    if response_layer.orjson is not None:
+        providers.append(('orjson', response_layer.FastJSONProvider(app)))
+    else:
+        print("orjson не установлен: сравнивается только стандартный json")
+
+    strategies = {'data': [make_strategy(rng, now) for _ in range(args.rows)], 'error': None}
+    analyses = {'data': [make_analysis(rng, now) for _ in range(args.rows)], 'error': None}
+
+    bench_payload(f"GET /api/strategies ({args.rows} rows)", strategies, providers, args.repeat)
+    bench_payload(f"GET /api/analysis_results ({args.rows} rows)", analyses, providers, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
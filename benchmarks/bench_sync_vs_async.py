@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Сравнение синхронного (gunicorn + timeweb_api_simple.py) и асинхронного
+(uvicorn + timeweb_api_async.py) API под нагрузкой на локальном PostgreSQL
+
+Оба сервера запускаются этим скриптом с одинаковым числом воркеров и
+одинаковым DB_POOL_MAX_SIZE, база берется из DB_* переменных окружения.
+Нагрузка: N одновременных клиентов с keep-alive, смесь запросов
+70% GET /api/strategies, 20% GET /api/analysis_results, 10% POST /api/user_events.
+
+Запуск из корня проекта:
+    python3 benchmarks/bench_sync_vs_async.py
+    python3 benchmarks/bench_sync_vs_async.py --clients 50,100,200,500 --duration 20 --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'sync': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}',
+        '--log-level', 'warning', 'timeweb_api_simple:app'
+    ],
+    'async': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', '--workers', str(workers), '--host', '127.0.0.1',
+        '--port', str(port), '--log-level', 'warning', '--no-access-log', 'timeweb_api_async:app'
+    ],
+}
+
+
+# ============================================================================
+# HTTP-КЛИЕНТ
+# ============================================================================
+
+class HttpConnection:
+    """Минимальный HTTP/1.1 клиент с keep-alive (переподключается, если сервер закрыл соединение)"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None):
+        """Возвращает статус ответа; тело читается и отбрасывается"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b''
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n")
+        try:
+            self.writer.write(head.encode() + payload)
+            await self.writer.drain()
+
+            raw = await self.reader.readuntil(b'\r\n\r\n')
+            lines = raw.decode('latin-1').split('\r\n')
+            status = int(lines[0].split()[1])
+            headers = {}
+            for line in lines[1:]:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+
+            if headers.get('transfer-encoding') == 'chunked':
+                while True:
+                    size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                    await self.reader.readexactly(size + 2)
+                    if size == 0:
+                        break
+            elif 'content-length' in headers:
+                await self.reader.readexactly(int(headers['content-length']))
+            else:
+                await self.reader.read()
+                headers['connection'] = 'close'
+        except BaseException:
+            self.close()
+            raise
+
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+# ============================================================================
+# НАГРУЗКА
+# ============================================================================
+
+def make_mix(telegram_ids):
+    """Случайный запрос из смеси (метод, путь, тело)"""
+    def next_request(rng):
+        telegram_id = rng.choice(telegram_ids)
+        roll = rng.random()
+        if roll < 0.7:
+            return 'GET', f'/api/strategies?telegram_user_id={telegram_id}&limit=20', None
+        if roll < 0.9:
+            return 'GET', f'/api/analysis_results?telegram_user_id={telegram_id}&limit=20', None
+        return 'POST', '/api/user_events', {
+            'telegram_user_id': telegram_id,
+            'event_type': 'bench',
+            'event_data': {'n': rng.randint(1, 1000)}
+        }
+    return next_request
+
+
+async def client(port, next_request, deadline, seed, latencies, counters):
+    rng = random.Random(seed)
+    conn = HttpConnection('127.0.0.1', port)
+    try:
+        while time.monotonic() < deadline:
+            method, path, body = next_request(rng)
+            started = time.monotonic()
+            try:
+                status = await asyncio.wait_for(conn.request(method, path, body), 30)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                counters['errors'] += 1
+                await asyncio.sleep(0.05)
+                continue
+            latencies.append(time.monotonic() - started)
+            key = 'ok' if status < 400 else f'http_{status}'
+            counters[key] = counters.get(key, 0) + 1
+    finally:
+        conn.close()
+
+
+async def run_level(port, clients, duration, next_request):
+    latencies = []
+    counters = {'errors': 0}
+    started = time.monotonic()
+    deadline = started + duration
+    await asyncio.gather(*(
+        client(port, next_request, deadline, seed, latencies, counters) for seed in range(clients)
+    ))
+    elapsed = time.monotonic() - started
+    return summarize(clients, elapsed, latencies, counters)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(clients, elapsed, latencies, counters):
+    latencies.sort()
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 1) if latencies else None,
+        **counters,
+    }
+
+
+# ============================================================================
+# СЕРВЕРЫ И ДАННЫЕ
+# ============================================================================
+
+def http_json(port, method, path, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(f'http://127.0.0.1:{port}{path}', data=data, method=method,
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def start_server(kind, port, workers, env):
+    process = subprocess.Popen(SERVERS[kind](port, workers), cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{kind} server exited with code {process.returncode}")
+        try:
+            if http_json(port, 'GET', '/api/health')['status'] == 'healthy':
+                return process
+        except OSError:
+            pass
+        time.sleep(0.3)
+    process.terminate()
+    raise RuntimeError(f"{kind} server did not become healthy in 30s")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def seed(port, users, strategies, analyses):
+    """Пользователи bench_* со стратегиями и анализами (через /bulk)"""
+    telegram_ids = [f'bench_{i}' for i in range(users)]
+    for telegram_id in telegram_ids:
+        existing = http_json(port, 'GET', f'/api/strategies?telegram_user_id={telegram_id}&limit=1')
+        if existing['data']:
+            continue
+        http_json(port, 'POST', '/api/strategies/bulk', {
+            'telegram_user_id': telegram_id,
+            'items': [{'name': f'Стратегия {n}', 'fields': [{'name': 'RSI', 'inputs': [{'type': 'number'}]}]}
+                      for n in range(strategies)]
+        })
+        http_json(port, 'POST', '/api/analysis_results/bulk', {
+            'telegram_user_id': telegram_id,
+            'items': [{'coin': 'BTC', 'answers': [{'rating': 'positive'}], 'positive_factors': ['RSI']}
+                      for _ in range(analyses)]
+        })
+    return telegram_ids
+
+
+def print_table(kind, results):
+    print(f"\n{kind}")
+    print(f"  {'clients':>7} {'rps':>8} {'p50, ms':>8} {'p95, ms':>8} {'p99, ms':>8} {'errors':>7} {'non-2xx':>8}")
+    for r in results:
+        non_ok = sum(v for k, v in r.items() if k.startswith('http_'))
+        print(f"  {r['clients']:>7} {r['rps']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+              f"{r['p99_ms']:>8} {r['errors']:>7} {non_ok:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Синхронный и асинхронный API под одинаковой нагрузкой')
+    parser.add_argument('--clients', default='50,100,200,500', help='уровни одновременных клиентов')
+    parser.add_argument('--duration', type=float, default=15, help='секунд на каждый уровень')
+    parser.add_argument('--workers', type=int, default=4, help='воркеров у каждого сервера')
+    parser.add_argument('--servers', default='sync,async', help='какие серверы сравнивать')
+    parser.add_argument('--users', type=int, default=50, help='пользователей в тестовых данных')
+    parser.add_argument('--strategies', type=int, default=20, help='стратегий на пользователя')
+    parser.add_argument('--analyses', type=int, default=40, help='анализов на пользователя')
+    parser.add_argument('--port', type=int, default=5100, help='первый порт для серверов')
+    parser.add_argument('--json', help='сохранить результаты в файл')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.clients.split(',')]
+    env = dict(os.environ)
+    env.setdefault('DB_POOL_MAX_SIZE', '10')
+    # Измеряется пропускная способность, а не лимиты запросов (rate_limit.py)
+    env.setdefault('RATE_LIMIT_ENABLED', '0')
+
+    report = {'workers': args.workers, 'pool_max_size': int(env['DB_POOL_MAX_SIZE']), 'results': {}}
+    for offset, kind in enumerate(args.servers.split(',')):
+        port = args.port + offset
+        process = start_server(kind, port, args.workers, env)
+        try:
+            telegram_ids = seed(port, args.users, args.strategies, args.analyses)
+            next_request = make_mix(telegram_ids)
+            # Прогрев: пулы, кеш пользователей, планы запросов
+            asyncio.run(run_level(port, 10, 2, next_request))
+            results = []
+            for clients in levels:
+                results.append(asyncio.run(run_level(port, clients, args.duration, next_request)))
+                print(f"[bench] {kind} {clients} clients: {results[-1]['rps']} rps, "
+                      f"p99 {results[-1]['p99_ms']} ms")
+            report['results'][kind] = results
+        finally:
+            stop_server(process)
+
+    for kind, results in report['results'].items():
+        print_table(kind, results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест webhook-режима бота (bot.py) без Telegram
+
+1. Поднимается локальная заглушка Bot API: отвечает на getMe/setWebhook и
+   считает sendMessage (с задержкой --api-latency мс, как у api.telegram.org)
+2. bot.py запускается в режиме webhook с BOT_API_BASE_URL на заглушку
+3. --clients отправителей постят --updates синтетических обновлений /start
+   на webhook; обновление считается обработанным, когда бот ответил в чат
+4. Результат по каждому уровню BOT_CONCURRENT_UPDATES (--concurrency):
+   обработанных обновлений в секунду и задержка от POST до ответа
+
+Заглушка и отправители работают на той же машине, что и бот: на 1-2 ядрах
+рост после насыщения процессора - не предел бота, а конкуренция за CPU.
+
+Запуск из корня проекта:
+    python3 benchmarks/bot_webhook_load.py
+    python3 benchmarks/bot_webhook_load.py --concurrency 1,64 --updates 5000 --api-latency 100
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench_sync_vs_async import ROOT, HttpConnection, percentile, stop_server
+
+TOKEN = '123456:LOADTEST'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'LoadTest', 'username': 'loadtest_bot'}
+FIRST_CHAT_ID = 1_000_000
+
+
+# ============================================================================
+# ЗАГЛУШКА BOT API
+# ============================================================================
+
+class FakeBotApi:
+    """
+    Bot API в отдельном потоке: фиксирует время ответа бота в каждый чат.
+    Может отвечать как Telegram при превышении лимитов (benchmarks/broadcast_load.py):
+
+    - max_rate: больше sendMessage за последнюю секунду - 429 с retry_after
+    - chat_interval: чаще в один чат - 429
+    - blocked_every: чаты с chat_id, кратным этому числу, - 403 (бот заблокирован)
+    """
+
+    def __init__(self, port, latency, max_rate=0, chat_interval=0.0, blocked_every=0):
+        self.latency = latency
+        self.max_rate = max_rate
+        self.chat_interval = chat_interval
+        self.blocked_every = blocked_every
+        self.lock = threading.Lock()
+        self.answered = {}  # chat_id -> monotonic время sendMessage
+        self.deliveries = {}  # chat_id -> доставлено сообщений
+        self.flood_errors = 0
+        self._recent = deque()  # время принятых sendMessage за последнюю секунду
+        self.webhook_set = threading.Event()
+        ThreadingHTTPServer.request_queue_size = 1024  # бот открывает до BOT_CONCURRENT_UPDATES соединений разом
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.answered.clear()
+            self.deliveries.clear()
+            self.flood_errors = 0
+        self.webhook_set.clear()
+
+    def count(self):
+        with self.lock:
+            return len(self.answered)
+
+    def accept(self, chat_id):
+        """None - сообщение доставлено, иначе (код, ответ Bot API)"""
+        if self.blocked_every and chat_id % self.blocked_every == 0:
+            return 403, {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}
+        now = time.monotonic()
+        with self.lock:
+            while self._recent and self._recent[0] < now - 1:
+                self._recent.popleft()
+            last = self.answered.get(chat_id)
+            if ((self.max_rate and len(self._recent) >= self.max_rate)
+                    or (self.chat_interval and last is not None and now - last < self.chat_interval)):
+                self.flood_errors += 1
+                return 429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                             'parameters': {'retry_after': 1}}
+            self._recent.append(now)
+            self.answered[chat_id] = now if last is None else last
+            self.deliveries[chat_id] = self.deliveries.get(chat_id, 0) + 1
+        return None
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True  # заголовки и тело пишутся отдельно
+
+            def do_POST(self):
+                method = self.path.rsplit('/', 1)[-1]
+                length = int(self.headers.get('Content-Length') or 0)
+                params = parse_params(self.rfile.read(length), self.headers.get('Content-Type', ''))
+                status = 200
+                if method == 'getMe':
+                    result = BOT_USER
+                elif method == 'sendMessage':
+                    time.sleep(api.latency)
+                    chat_id = int(params['chat_id'])
+                    result = {'message_id': 1, 'date': int(time.time()), 'text': params.get('text', ''),
+                              'chat': {'id': chat_id, 'type': 'private'}, 'from': BOT_USER}
+                    error = api.accept(chat_id)
+                    if error is not None:
+                        status, result = error
+                elif method == 'setWebhook':
+                    api.webhook_set.set()
+                    result = True
+                else:
+                    result = True
+                body = json.dumps({'ok': True, 'result': result} if status == 200 else result).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def parse_params(raw, content_type):
+    """Параметры запроса Bot API (JSON или form-urlencoded)"""
+    if not raw:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(raw)
+    from urllib.parse import parse_qsl
+    return dict(parse_qsl(raw.decode()))
+
+
+# ============================================================================
+# НАГРУЗКА
+# ============================================================================
+
+def make_update(n):
+    """Обновление с командой /start от пользователя с отдельным чатом"""
+    chat_id = FIRST_CHAT_ID + n
+    return {
+        'update_id': n + 1,
+        'message': {
+            'message_id': n + 1,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': '/start',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        },
+    }
+
+
+async def sender(port, path, queue, sent_at, counters):
+    conn = HttpConnection('127.0.0.1', port)
+    try:
+        while queue:
+            n = queue.pop()
+            sent_at[FIRST_CHAT_ID + n] = time.monotonic()
+            try:
+                status = await asyncio.wait_for(conn.request('POST', path, make_update(n)), 30)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                counters['errors'] += 1
+                continue
+            key = 'ok' if status < 400 else f'http_{status}'
+            counters[key] = counters.get(key, 0) + 1
+    finally:
+        conn.close()
+
+
+async def run_level(api, port, path, updates, clients, timeout):
+    queue = list(range(updates - 1, -1, -1))
+    sent_at = {}
+    counters = {'errors': 0}
+    started = time.monotonic()
+    await asyncio.gather(*(sender(port, path, queue, sent_at, counters) for _ in range(clients)))
+    posted = time.monotonic() - started
+
+    deadline = time.monotonic() + timeout
+    while api.count() < counters.get('ok', 0) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    with api.lock:
+        answered = dict(api.answered)
+    elapsed = (max(answered.values()) - started) if answered else float('nan')
+
+    latencies = sorted(answered[chat_id] - sent_at[chat_id] for chat_id in answered if chat_id in sent_at)
+    return {
+        'updates': updates,
+        'posted_per_sec': round(updates / posted, 1),
+        'handled': len(answered),
+        'handled_per_sec': round(len(answered) / elapsed, 1) if answered else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'webhook': counters,
+    }
+
+
+# ============================================================================
+# ЗАПУСК
+# ============================================================================
+
+def wait_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"bot exited with code {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"bot webhook did not start in {timeout}s")
+
+
+def start_bot(concurrency, port, api_port, path):
+    env = dict(os.environ)
+    env.update({
+        'BOT_MODE': 'webhook',
+        'BOT_TOKEN': TOKEN,
+        'BOT_API_BASE_URL': f'http://127.0.0.1:{api_port}/bot',
+        'BOT_WEBHOOK_URL': f'http://127.0.0.1:{port}/{path}',
+        'BOT_WEBHOOK_PORT': str(port),
+        'BOT_WEBHOOK_PATH': path,
+        'BOT_CONCURRENT_UPDATES': str(concurrency),
+    })
+    env.pop('BOT_WEBHOOK_SECRET', None)
+    return subprocess.Popen([sys.executable, 'bot.py'], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def print_table(results):
+    print(f"{'concurrency':>11} {'handled/s':>10} {'posted/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'handled':>8}")
+    for concurrency, row in results.items():
+        print(f"{concurrency:>11} {row['handled_per_sec']:>10} {row['posted_per_sec']:>9} {row['p50_ms']:>8} "
+              f"{row['p95_ms']:>8} {row['p99_ms']:>8} {row['handled']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест webhook-режима bot.py')
+    parser.add_argument('--concurrency', default='1,4,16,32', help='уровни BOT_CONCURRENT_UPDATES')
+    parser.add_argument('--updates', type=int, default=2000, help='обновлений на уровень')
+    parser.add_argument('--clients', type=int, default=40, help='одновременных POST (как max_connections у Telegram)')
+    parser.add_argument('--api-latency', type=float, default=50, help='задержка ответа Bot API, мс')
+    parser.add_argument('--port', type=int, default=8543, help='порт webhook бота')
+    parser.add_argument('--api-port', type=int, default=8544, help='порт заглушки Bot API')
+    parser.add_argument('--timeout', type=float, default=120, help='сколько ждать обработки, сек')
+    parser.add_argument('--json', help='сохранить результаты в файл')
+    args = parser.parse_args()
+
+    path = 'telegram'
+    api = FakeBotApi(args.api_port, args.api_latency / 1000)
+    api.start()
+    results = {}
+    try:
+        for concurrency in (int(level) for level in args.concurrency.split(',')):
+            api.reset()
+            process = start_bot(concurrency, args.port, args.api_port, path)
+            try:
+                wait_port(args.port, process)
+                if not api.webhook_set.wait(10):
+                    raise RuntimeError("bot did not call setWebhook")
+                results[concurrency] = asyncio.run(
+                    run_level(api, args.port, f'/{path}', args.updates, args.clients, args.timeout))
+            finally:
+                stop_server(process)
+            print(f"concurrency={concurrency}: {results[concurrency]['handled_per_sec']} updates/s")
+    finally:
+        api.stop()
+
+    print()
+    print_table(results)
+    if args.json:
+        report = {'api_latency_ms': args.api_latency, 'clients': args.clients, 'results': results}
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Проверка рассылки (broadcast.py) на заглушке Bot API
+
+1. В локальный PostgreSQL (DB_* переменные окружения) добавляются --users
+   пользователей с числовыми telegram_id (после теста удаляются)
+2. Заглушка Bot API (FakeBotApi из bot_webhook_load.py) ведет себя как Telegram:
+   больше --api-max-rate сообщений в секунду или чаще раза в секунду в чат -
+   429 с retry_after, каждый --blocked-every чат - 403
+3. broadcast.py запускается отдельным процессом; с --crash-after процесс
+   убивается (SIGKILL) через столько секунд и запускается снова
+4. Результат: темп доставки, число 429, и главное - сколько чатов получили
+   сообщение дважды (после падения - не больше BROADCAST_CONCURRENCY)
+
+--resume-check - остановка продолженной рассылки в том же процессе: курсор на
+10-м получателе, 40 завершенных после него разбросаны по страницам (так бывает,
+когда одно сообщение долго повторяется из-за сетевых ошибок). Рассылка
+останавливается через --stop-after мс, до того как чтение дошло до всех них;
+сохраненный done должен по-прежнему их содержать, и сообщения им не уходят.
+
+Запуск из корня проекта:
+    python3 benchmarks/broadcast_load.py
+    python3 benchmarks/broadcast_load.py --users 5000 --rate 40 --crash-after 5
+    python3 benchmarks/broadcast_load.py --resume-check
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', '123456:LOADTEST')
+
+import asyncpg
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+import broadcast
+from bot_webhook_load import TOKEN, FakeBotApi
+from bench_sync_vs_async import ROOT
+from loadtest import db_config_from_env
+
+NAME = 'loadtest-broadcast'
+FIRST_TELEGRAM_ID = 990_000_000
+
+
+def seed_users(conn, users):
+    telegram_ids = [str(FIRST_TELEGRAM_ID + n) for n in range(users)]
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM broadcasts WHERE name = %s", (NAME,))
+        cur.execute(
+            "INSERT INTO users (telegram_id, first_name) SELECT t, 'Broadcast' FROM unnest(%s::text[]) t "
+            "ON CONFLICT (telegram_id) DO NOTHING",
+            (telegram_ids,)
+        )
+        cur.execute("SELECT telegram_id::bigint FROM users WHERE telegram_id ~ '^[0-9]+$'")
+        recipients = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    return telegram_ids, recipients
+
+
+def run_broadcast(env, args, crash_after=None):
+    """Процесс broadcast.py; с crash_after - убивается через столько секунд"""
+    command = [sys.executable, 'broadcast.py', '--name', NAME]
+    if args is not None:
+        command += args
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    try:
+        process.wait(crash_after)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        print(f"-- broadcast killed after {crash_after}s")
+        return False
+    if process.returncode:
+        raise RuntimeError(f"broadcast.py exited with code {process.returncode}")
+    return True
+
+
+async def check_resume(args):
+    """Остановка продолженной рассылки не теряет done прошлого запуска"""
+    pool = await asyncpg.create_pool(**broadcast.db_config_from_env(), min_size=1, max_size=2)
+    bot = Bot(TOKEN, base_url=f'http://127.0.0.1:{args.api_port}/bot',
+              request=HTTPXRequest(connection_pool_size=args.concurrency))
+    try:
+        rows = await pool.fetch(broadcast.RECIPIENTS_SQL, None, args.users * 10)
+        after = rows[10:]
+        step = max(1, len(after) // 40)
+        done = {str(row['id']): broadcast.SENT for row in after[::step][:40]}
+        done_chats = {int(row['telegram_id']) for row in after[::step][:40]}
+        await pool.execute(
+            "INSERT INTO broadcasts (name, text, cursor_id, done) VALUES ($1, $2, $3, $4::jsonb)",
+            NAME, 'Проверка продолжения рассылки', rows[9]['id'], json.dumps(done)
+        )
+
+        async with bot:
+            stopped = broadcast.Broadcast(pool, bot, NAME, rate=args.rate, concurrency=args.concurrency,
+                                          page_size=20)
+            await stopped.load()
+            task = asyncio.create_task(stopped.run())
+            await asyncio.sleep(args.stop_after / 1000)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        saved = await pool.fetchrow("SELECT cursor_id, done FROM broadcasts WHERE name = $1", NAME)
+        saved_done = json.loads(saved['done'])
+        # Потерян - не за курсором и не в done: следующий запуск отправит ему повтор
+        lost = [user_id for user_id in done if user_id not in saved_done and user_id > str(saved['cursor_id'])]
+        return len(done), lost, done_chats
+    finally:
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Рассылка на заглушке Bot API')
+    parser.add_argument('--users', type=int, default=1000, help='получателей')
+    parser.add_argument('--rate', type=float, default=25, help='BROADCAST_RATE')
+    parser.add_argument('--concurrency', type=int, default=20, help='BROADCAST_CONCURRENCY')
+    parser.add_argument('--api-max-rate', type=int, default=30, help='лимит заглушки, сообщений в секунду')
+    parser.add_argument('--api-latency', type=float, default=50, help='задержка ответа Bot API, мс')
+    parser.add_argument('--blocked-every', type=int, default=50, help='каждый N-й чат заблокировал бота')
+    parser.add_argument('--crash-after', type=float, help='убить рассылку через столько секунд и продолжить')
+    parser.add_argument('--api-port', type=int, default=8545, help='порт заглушки Bot API')
+    parser.add_argument('--keep-users', action='store_true', help='не удалять тестовых пользователей')
+    parser.add_argument('--resume-check', action='store_true', help='проверка остановки продолженной рассылки')
+    parser.add_argument('--stop-after', type=float, default=50, help='остановка в --resume-check, мс')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**db_config_from_env())
+    telegram_ids, recipients = seed_users(conn, args.users)
+    api = FakeBotApi(args.api_port, args.api_latency / 1000, max_rate=args.api_max_rate,
+                     chat_interval=1.0, blocked_every=args.blocked_every)
+    api.start()
+
+    env = dict(os.environ)
+    env.update({
+        'BOT_TOKEN': TOKEN,
+        'BOT_API_BASE_URL': f'http://127.0.0.1:{args.api_port}/bot',
+        'BROADCAST_RATE': str(args.rate),
+        'BROADCAST_CONCURRENCY': str(args.concurrency),
+    })
+    text = ['--text', 'Нагрузочный тест рассылки', '--button']
+    try:
+        if args.resume_check:
+            total, lost, done_chats = asyncio.run(check_resume(args))
+            with api.lock:
+                resent = sum(api.deliveries.get(chat_id, 0) for chat_id in done_chats)
+            print()
+            print(f"done before stop: {total}")
+            print(f"lost from done:   {len(lost)}")
+            print(f"resent to done:   {resent}")
+            return
+        started = time.monotonic()
+        restarts = 0
+        finished = run_broadcast(env, text, args.crash_after)
+        while not finished:
+            restarts += 1
+            finished = run_broadcast(env, None)
+        elapsed = time.monotonic() - started
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT status, sent, blocked, failed FROM broadcasts WHERE name = %s", (NAME,))
+            status, sent, blocked, failed = cur.fetchone()
+        with api.lock:
+            deliveries = dict(api.deliveries)
+            flood_errors = api.flood_errors
+    finally:
+        api.stop()
+        if not args.keep_users:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM users WHERE telegram_id = ANY(%s)", (telegram_ids,))
+                cur.execute("DELETE FROM broadcasts WHERE name = %s", (NAME,))
+            conn.commit()
+        conn.close()
+
+    expected_blocked = sum(1 for chat_id in recipients if chat_id % args.blocked_every == 0) if args.blocked_every else 0
+    missing = [chat_id for chat_id in recipients
+               if chat_id not in deliveries and not (args.blocked_every and chat_id % args.blocked_every == 0)]
+    duplicates = sum(count - 1 for count in deliveries.values() if count > 1)
+    print()
+    print(f"recipients:     {len(recipients)} (restarts: {restarts})")
+    print(f"status:         {status}, sent {sent}, blocked {blocked}, failed {failed}")
+    print(f"delivered:      {len(deliveries)} chats, {round(len(deliveries) / elapsed, 1)} msg/s in {round(elapsed, 1)}s")
+    print(f"blocked:        {blocked} (expected {expected_blocked})")
+    print(f"429 responses:  {flood_errors}")
+    print(f"missing:        {len(missing)}")
+    print(f"duplicates:     {duplicates}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест API с воспроизводимыми данными и отчетом для сравнения коммитов
+
+1. В локальный PostgreSQL (DB_* переменные окружения) записывается синтетический
+   набор: пользователи load_*, стратегии с JSONB fields, анализы, события
+   (повторный запуск с теми же параметрами данные не пересоздает)
+2. Запускается сервер (gunicorn/uvicorn) или берется уже запущенный (--url)
+3. На каждом уровне одновременных клиентов смесь запросов (--mix) идет
+   --duration секунд; клиенты выбирают пользователей с перекосом (--skew),
+   последовательность запросов задается --seed
+4. Результат - пропускная способность и p50/p95/p99 по эндпоинтам,
+   в JSON (--output), и сравнение с прошлым отчетом (--compare)
+
+Запуск из корня проекта:
+    python3 benchmarks/loadtest.py --output bench-main.json
+    python3 benchmarks/loadtest.py --concurrency 10,50,100 --compare bench-main.json --output bench-new.json
+    python3 benchmarks/loadtest.py --url http://127.0.0.1:5000 --mix strategies=80,stats=20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+import psycopg2
+import psycopg2.extras
+
+from bench_response import make_analysis, make_strategy
+from bench_sync_vs_async import ROOT, HttpConnection, percentile, start_server, stop_server
+
+REPORT_VERSION = 1
+TELEGRAM_PREFIX = 'load_'
+EVENT_TYPES = ['app_open', 'strategy_view', 'analysis_start', 'analysis_complete', 'settings_open']
+
+# Смесь запросов по умолчанию: эндпоинт=вес
+DEFAULT_MIX = 'strategies=45,analyses=10,analysis_create=10,events=15,stats=15,admin_stats=5'
+
+
+# ============================================================================
+# ДАННЫЕ
+# ============================================================================
+
+def db_config_from_env():
+    """База как у timeweb_api_simple.py"""
+    return {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': os.getenv('DB_PORT', '5432'),
+        'database': os.getenv('DB_NAME', 'tradeanalyzer'),
+        'user': os.getenv('DB_USER', 'tradeanalyzer_app'),
+        'password': os.getenv('DB_PASSWORD', 'SECURE_PASSWORD_2024!')
+    }
+
+
+def dataset_summary(cur):
+    """Объем тестовых данных (попадает в отчет)"""
+    cur.execute("""
+        SELECT count(*) AS users,
+               (SELECT count(*) FROM strategies s JOIN users u ON u.id = s.user_id
+                 WHERE u.telegram_id LIKE %(prefix)s) AS strategies,
+               (SELECT count(*) FROM analyses a JOIN users u ON u.id = a.user_id
+                 WHERE u.telegram_id LIKE %(prefix)s) AS analyses,
+               (SELECT count(*) FROM user_events e JOIN users u ON u.id = e.user_id
+                 WHERE u.telegram_id LIKE %(prefix)s) AS events
+        FROM users WHERE telegram_id LIKE %(prefix)s
+    """, {'prefix': TELEGRAM_PREFIX.replace('_', r'\_') + '%'})
+    return dict(zip(('users', 'strategies', 'analyses', 'events'), cur.fetchone()))
+
+
+def random_uuid(rng):
+    """UUID из rng - при том же seed те же id"""
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def seed_database(users, strategies, analyses, events, seed, reseed=False):
+    """
+    Пользователи load_0..load_{users-1} со своими данными.
+
+    Число стратегий, анализов и событий у пользователя случайно (среднее -
+    параметр), поэтому есть и пустые, и очень активные пользователи.
+    Данные пишутся напрямую в таблицы (триггеры user_activity и счетчиков работают).
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    Json = psycopg2.extras.Json
+
+    conn = psycopg2.connect(**db_config_from_env())
+    try:
+        with conn.cursor() as cur:
+            summary = dataset_summary(cur)
+            if summary['users'] == users and not reseed:
+                print(f"[loadtest] dataset already seeded: {summary}")
+                return summary
+            if summary['users']:
+                cur.execute("DELETE FROM users WHERE telegram_id LIKE %s",
+                            (TELEGRAM_PREFIX.replace('_', r'\_') + '%',))
+
+            started = time.monotonic()
+            for start in range(0, users, 500):
+                user_rows, strategy_rows, analysis_rows, event_rows = [], [], [], []
+                for i in range(start, min(start + 500, users)):
+                    telegram_id = f'{TELEGRAM_PREFIX}{i}'
+                    user_id = random_uuid(rng)
+                    registered = now - timedelta(minutes=rng.randint(0, 180 * 24 * 60))
+                    user_rows.append((user_id, telegram_id, f'user{i}', 'Load', f'User {i}', registered))
+
+                    strategy_ids = []
+                    for _ in range(int(rng.expovariate(1 / strategies)) if strategies else 0):
+                        strategy = dict(make_strategy(rng, now), id=random_uuid(rng))
+                        strategy_ids.append((str(strategy['id']), strategy['name']))
+                        strategy_rows.append((str(strategy['id']), user_id, telegram_id, strategy['name'],
+                                              strategy['description'], Json(strategy['fields']),
+                                              max(registered, strategy['created_at']), now))
+                    for _ in range(int(rng.expovariate(1 / analyses)) if analyses else 0):
+                        analysis = dict(make_analysis(rng, now), id=random_uuid(rng))
+                        strategy_id, strategy_name = rng.choice(strategy_ids) if strategy_ids else (None, None)
+                        analysis_rows.append((str(analysis['id']), user_id, telegram_id, strategy_id, strategy_name,
+                                              analysis['coin'], Json(analysis['answers']),
+                                              Json(analysis['positive_factors']), Json(analysis['negative_factors']),
+                                              Json(analysis['neutral_factors']), analysis['recommendation'],
+                                              max(registered, analysis['created_at'])))
+                    for _ in range(int(rng.expovariate(1 / events)) if events else 0):
+                        event_rows.append((user_id, telegram_id, rng.choice(EVENT_TYPES),
+                                           Json({'screen': rng.choice(['main', 'strategies', 'analysis'])}),
+                                           now - timedelta(minutes=rng.randint(0, 30 * 24 * 60))))
+
+                psycopg2.extras.execute_values(cur, """
+                    INSERT INTO users (id, telegram_id, username, first_name, last_name, created_at) VALUES %s
+                """, user_rows, page_size=1000)
+                psycopg2.extras.execute_values(cur, """
+                    INSERT INTO strategies (id, user_id, telegram_user_id, name, description, fields,
+                                            created_at, updated_at) VALUES %s
+                """, strategy_rows, page_size=1000)
+                psycopg2.extras.execute_values(cur, """
+                    INSERT INTO analyses (id, user_id, telegram_user_id, strategy_id, strategy_name, coin, answers,
+                                          positive_factors, negative_factors, neutral_factors, recommendation,
+                                          created_at) VALUES %s
+                """, analysis_rows, page_size=1000)
+                psycopg2.extras.execute_values(cur, """
+                    INSERT INTO user_events (user_id, telegram_user_id, event_type, event_data, created_at) VALUES %s
+                """, event_rows, page_size=1000)
+            conn.commit()
+            cur.execute("ANALYZE users, strategies, analyses, user_events")
+            conn.commit()
+            summary = dataset_summary(cur)
+            print(f"[loadtest] seeded in {time.monotonic() - started:.1f}s: {summary}")
+            return summary
+    finally:
+        conn.close()
+
+
+# ============================================================================
+# СМЕСЬ ЗАПРОСОВ
+# ============================================================================
+
+def analysis_body(rng, telegram_id):
+    analysis = make_analysis(rng, datetime.now(timezone.utc))
+    return {
+        'telegram_user_id': telegram_id,
+        'coin': analysis['coin'],
+        'answers': analysis['answers'],
+        'positive_factors': analysis['positive_factors'],
+        'negative_factors': analysis['negative_factors'],
+        'neutral_factors': analysis['neutral_factors'],
+        'recommendation': analysis['recommendation'],
+    }
+
+
+# Эндпоинт смеси -> (rng, telegram_id) -> (метод, путь, тело)
+ENDPOINTS = {
+    'strategies': lambda rng, tid: ('GET', f'/api/strategies?telegram_user_id={tid}&limit=20', None),
+    'analyses': lambda rng, tid: ('GET', f'/api/analysis_results?telegram_user_id={tid}&limit=20', None),
+    'analysis_create': lambda rng, tid: ('POST', '/api/analysis_results', analysis_body(rng, tid)),
+    'strategy_create': lambda rng, tid: ('POST', '/api/strategies', {
+        'telegram_user_id': tid, 'name': f'Стратегия {rng.randint(1, 999)}',
+        'description': 'loadtest', 'fields': make_strategy(rng, datetime.now(timezone.utc))['fields'],
+    }),
+    'events': lambda rng, tid: ('POST', '/api/user_events', {
+        'telegram_user_id': tid, 'event_type': rng.choice(EVENT_TYPES), 'event_data': {'n': rng.randint(1, 1000)},
+    }),
+    'stats': lambda rng, tid: ('GET', f'/api/users/stats/{tid}', None),
+    'admin_stats': lambda rng, tid: ('GET', '/api/admin/stats', None),
+    'users_list': lambda rng, tid: ('GET', '/api/admin/users_list?limit=50', None),
+    'users_by_date': lambda rng, tid: ('GET', '/api/admin/users_by_date', None),
+}
+
+
+def parse_mix(value):
+    """'strategies=45,stats=15' -> {'strategies': 45.0, 'stats': 15.0}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.strip().partition('=')
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}, available: {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Traffic:
+    """Генератор запросов: эндпоинт по весам смеси, пользователь по закону Ципфа (skew)"""
+
+    def __init__(self, mix, users, skew):
+        self.names = list(mix)
+        self.cum_mix = list(_cumulative(mix.values()))
+        self.telegram_ids = [f'{TELEGRAM_PREFIX}{i}' for i in range(users)]
+        self.cum_users = list(_cumulative(1 / (rank + 1) ** skew for rank in range(users)))
+
+    def next(self, rng):
+        name = rng.choices(self.names, cum_weights=self.cum_mix)[0]
+        telegram_id = rng.choices(self.telegram_ids, cum_weights=self.cum_users)[0]
+        return (name,) + ENDPOINTS[name](rng, telegram_id)
+
+
+def _cumulative(weights):
+    total = 0.0
+    for weight in weights:
+        total += weight
+        yield total
+
+
+# ============================================================================
+# НАГРУЗКА
+# ============================================================================
+
+async def client(host, port, traffic, deadline, rng, samples):
+    conn = HttpConnection(host, port)
+    try:
+        while time.monotonic() < deadline:
+            name, method, path, body = traffic.next(rng)
+            result = samples.setdefault(name, {'latencies': [], 'statuses': {}, 'errors': 0})
+            started = time.monotonic()
+            try:
+                status = await asyncio.wait_for(conn.request(method, path, body), 30)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                result['errors'] += 1
+                await asyncio.sleep(0.05)
+                continue
+            result['latencies'].append(time.monotonic() - started)
+            result['statuses'][str(status)] = result['statuses'].get(str(status), 0) + 1
+    finally:
+        conn.close()
+
+
+async def run_level(host, port, traffic, concurrency, duration, seed):
+    samples = {}
+    started = time.monotonic()
+    deadline = started + duration
+    await asyncio.gather(*(
+        client(host, port, traffic, deadline, random.Random(f'{seed}:{concurrency}:{n}'), samples)
+        for n in range(concurrency)
+    ))
+    elapsed = time.monotonic() - started
+
+    endpoints = {name: summarize(elapsed, result['latencies'], result['statuses'], result['errors'])
+                 for name, result in sorted(samples.items())}
+    total = summarize(
+        elapsed,
+        [latency for result in samples.values() for latency in result['latencies']],
+        {},
+        sum(result['errors'] for result in samples.values()),
+    )
+    total['non_2xx'] = sum(summary['non_2xx'] for summary in endpoints.values())
+    return {'concurrency': concurrency, 'elapsed': round(elapsed, 2), 'total': total, 'endpoints': endpoints}
+
+
+def summarize(elapsed, latencies, statuses, errors):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+        'errors': errors,
+        'non_2xx': sum(count for status, count in statuses.items() if not status.startswith('2')),
+        'statuses': statuses,
+    }
+
+
+# ============================================================================
+# ОТЧЕТ
+# ============================================================================
+
+def git_state():
+    """Коммит и наличие незакоммиченных изменений (для сравнения отчетов)"""
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    try:
+        return {'commit': git('rev-parse', 'HEAD') or None, 'subject': git('log', '-1', '--format=%s') or None,
+                'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+    except OSError:
+        return {'commit': None, 'subject': None, 'dirty': None}
+
+
+def print_level(level):
+    print(f"\n{level['concurrency']} clients, {level['elapsed']}s")
+    print(f"  {'endpoint':<16} {'requests':>8} {'rps':>8} {'p50, ms':>8} {'p95, ms':>8} {'p99, ms':>8} "
+          f"{'errors':>7} {'non-2xx':>8}")
+    rows = list(level['endpoints'].items()) + [('TOTAL', level['total'])]
+    for name, r in rows:
+        print(f"  {name:<16} {r['requests']:>8} {r['rps']:>8} {r['p50_ms']!s:>8} {r['p95_ms']!s:>8} "
+              f"{r['p99_ms']!s:>8} {r['errors']:>7} {r['non_2xx']:>8}")
+
+
+def change(new, old):
+    if not new or not old:
+        return '     n/a'
+    return f"{(new - old) * 100 / old:+7.1f}%"
+
+
+def print_comparison(report, baseline):
+    """Изменение rps и перцентилей относительно baseline по совпадающим уровням и эндпоинтам"""
+    old_commit = (baseline.get('git') or {}).get('commit') or '?'
+    new_commit = (report.get('git') or {}).get('commit') or '?'
+    print(f"\ncompared to {old_commit[:10]} (this run: {new_commit[:10]}); rps: + is better, latency: - is better")
+    old_levels = {level['concurrency']: level for level in baseline.get('levels', [])}
+    for level in report['levels']:
+        old = old_levels.get(level['concurrency'])
+        if old is None:
+            continue
+        print(f"\n{level['concurrency']} clients")
+        print(f"  {'endpoint':<16} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+        rows = list(level['endpoints'].items()) + [('TOTAL', level['total'])]
+        for name, r in rows:
+            o = old['total'] if name == 'TOTAL' else old['endpoints'].get(name)
+            if o is None:
+                continue
+            print(f"  {name:<16} {change(r['rps'], o['rps'])} {change(r['p50_ms'], o['p50_ms'])} "
+                  f"{change(r['p95_ms'], o['p95_ms'])} {change(r['p99_ms'], o['p99_ms'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест API со сравнением между коммитами')
+    parser.add_argument('--server', choices=['sync', 'async'], default='sync', help='какой сервер запускать')
+    parser.add_argument('--url', help='нагружать уже запущенный сервер (данные все равно готовятся в DB_*)')
+    parser.add_argument('--workers', type=int, default=4, help='воркеров у сервера')
+    parser.add_argument('--port', type=int, default=5200, help='порт запускаемого сервера')
+    parser.add_argument('--concurrency', default='10,50,100', help='уровни одновременных клиентов')
+    parser.add_argument('--duration', type=float, default=20, help='секунд на каждый уровень')
+    parser.add_argument('--warmup', type=float, default=3, help='секунд прогрева перед уровнями')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'эндпоинты и веса (по умолчанию {DEFAULT_MIX}; есть также '
+                             f'strategy_create, users_list, users_by_date)')
+    parser.add_argument('--skew', type=float, default=1.0, help='перекос выбора пользователей (0 - равномерно)')
+    parser.add_argument('--users', type=int, default=2000, help='пользователей в тестовых данных')
+    parser.add_argument('--strategies', type=float, default=5, help='стратегий на пользователя в среднем')
+    parser.add_argument('--analyses', type=float, default=15, help='анализов на пользователя в среднем')
+    parser.add_argument('--events', type=float, default=30, help='событий на пользователя в среднем')
+    parser.add_argument('--seed', type=int, default=42, help='seed данных и последовательности запросов')
+    parser.add_argument('--reseed', action='store_true', help='пересоздать тестовые данные')
+    parser.add_argument('--output', help='сохранить отчет в JSON')
+    parser.add_argument('--compare', help='отчет JSON прошлого запуска для сравнения')
+    args = parser.parse_args()
+
+    dataset = seed_database(args.users, args.strategies, args.analyses, args.events, args.seed, args.reseed)
+
+    env = dict(os.environ)
+    env.setdefault('DB_POOL_MAX_SIZE', '10')
+    # Измеряется пропускная способность, а не лимиты запросов (rate_limit.py)
+    env.setdefault('RATE_LIMIT_ENABLED', '0')
+    process = None
+    if args.url:
+        parsed = urlparse(args.url)
+        host, port = parsed.hostname, parsed.port or 80
+    else:
+        host, port = '127.0.0.1', args.port
+        process = start_server(args.server, port, args.workers, env)
+
+    report = {
+        'version': REPORT_VERSION,
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git': git_state(),
+        'python': platform.python_version(),
+        'server': args.url or args.server,
+        'workers': None if args.url else args.workers,
+        'pool_max_size': int(env['DB_POOL_MAX_SIZE']),
+        'seed': args.seed,
+        'skew': args.skew,
+        'mix': args.mix,
+        'duration': args.duration,
+        'dataset': dataset,
+        'levels': [],
+    }
+    try:
+        traffic = Traffic(args.mix, args.users, args.skew)
+        if args.warmup:
+            # Прогрев: пулы, кеш пользователей, подготовленные запросы
+            asyncio.run(run_level(host, port, traffic, 10, args.warmup, f'warmup:{args.seed}'))
+        for concurrency in [int(level) for level in args.concurrency.split(',')]:
+            level = asyncio.run(run_level(host, port, traffic, concurrency, args.duration, args.seed))
+            report['levels'].append(level)
+            print(f"[loadtest] {concurrency} clients: {level['total']['rps']} rps, "
+                  f"p95 {level['total']['p95_ms']} ms, p99 {level['total']['p99_ms']} ms")
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    for level in report['levels']:
+        print_level(level)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n[loadtest] report saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,20 @@
 #!/usr/bin/env python3
+"""
+Telegram-бот TradeAnalyzer: на /start отправляет кнопку с Web App
+
+Режимы (BOT_MODE):
+- polling (по умолчанию) - бот сам забирает обновления у Telegram
+- webhook - Telegram присылает обновления на BOT_WEBHOOK_URL (через Nginx
+  на BOT_WEBHOOK_LISTEN:BOT_WEBHOOK_PORT), без задержки на опрос
+
+В обоих режимах обновления обрабатываются параллельно (до
+BOT_CONCURRENT_UPDATES одновременно) и запрашиваются только нужные типы.
+Нагрузочный тест webhook - benchmarks/bot_webhook_load.py.
+"""
+
 import logging
+import os
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, WebAppInfo
 from telegram.ext import Application, CommandHandler, ContextTypes
 
@@ -8,42 +23,89 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
+# httpx пишет INFO на каждый запрос к Bot API
+logging.getLogger('httpx').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # Токен и URL
-TOKEN = "8235902798:AAEUBXf6Y2OWIKSOTciSC-qdOktApNA3d1A"
+TOKEN = os.getenv('BOT_TOKEN', "8235902798:AAEUBXf6Y2OWIKSOTciSC-qdOktApNA3d1A")
 # Используем GitHub Pages (уже опубликовано)
-WEB_APP_URL = "https://moscowfactory-tech.github.io/checkyourtrade/"
+WEB_APP_URL = os.getenv('BOT_WEB_APP_URL', "https://moscowfactory-tech.github.io/checkyourtrade/")
 # WEB_APP_URL = "http://localhost:8000"  # Для локального тестирования
 
+# Бот обрабатывает только команды в сообщениях - остальные обновления не запрашиваем
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+# Клавиатура одинакова для всех - собирается один раз
+START_TEXT = "Привет! Теперь ты можешь торговать системно:"
+START_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("Открыть сайт", web_app=WebAppInfo(url=WEB_APP_URL))]])
+
+
+def bot_config_from_env():
+    """Параметры запуска бота из переменных окружения"""
+    return {
+        'mode': os.getenv('BOT_MODE', 'polling'),
+        'concurrent_updates': int(os.getenv('BOT_CONCURRENT_UPDATES', '16')),
+        'webhook_url': os.getenv('BOT_WEBHOOK_URL'),
+        'listen': os.getenv('BOT_WEBHOOK_LISTEN', '127.0.0.1'),
+        'port': int(os.getenv('BOT_WEBHOOK_PORT', '8443')),
+        'url_path': os.getenv('BOT_WEBHOOK_PATH', 'telegram'),
+        'secret_token': os.getenv('BOT_WEBHOOK_SECRET'),
+        'max_connections': int(os.getenv('BOT_WEBHOOK_MAX_CONNECTIONS', '40')),
+        # Другой адрес Bot API (локальный сервер Bot API или нагрузочный тест)
+        'base_url': os.getenv('BOT_API_BASE_URL'),
+    }
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /start"""
-    keyboard = [[InlineKeyboardButton("Открыть сайт", web_app=WebAppInfo(url=WEB_APP_URL))]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(
-        "Привет! Теперь ты можешь торговать системно:",
-        reply_markup=reply_markup
-    )
+    await update.message.reply_text(START_TEXT, reply_markup=START_MARKUP)
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик ошибок"""
     logger.error(f"Произошла ошибка: {context.error}")
 
+def build_application(concurrent_updates=16, base_url=None):
+    """Приложение с обработчиками; HTTP-соединений с Bot API - по числу параллельных обновлений"""
+    builder = (Application.builder()
+               .token(TOKEN)
+               .concurrent_updates(concurrent_updates)
+               .connection_pool_size(max(concurrent_updates, 1))
+               .pool_timeout(5))
+    if base_url:
+        builder = builder.base_url(base_url)
+    app = builder.build()
+
+    # Добавляем обработчики
+    app.add_handler(CommandHandler("start", start))
+    app.add_error_handler(error_handler)
+    return app
+
 def main() -> None:
     """Запуск бота"""
     print("Запуск бота...")
-    
+    config = bot_config_from_env()
+
     # Создаем приложение
-    app = Application.builder().token(TOKEN).build()
-    
-    # Добавляем обработчики
-    app.add_handler(CommandHandler("start", start))
-    app.add_error_handler(error_handler)
-    
+    app = build_application(config['concurrent_updates'], config['base_url'])
+
     # Запускаем бота
-    print("Бот запущен! Нажмите Ctrl+C для остановки.")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    if config['mode'] == 'webhook':
+        if not config['webhook_url']:
+            raise SystemExit("BOT_WEBHOOK_URL is required in webhook mode")
+        print(f"Бот запущен (webhook {config['listen']}:{config['port']}/{config['url_path']})")
+        app.run_webhook(
+            listen=config['listen'],
+            port=config['port'],
+            url_path=config['url_path'],
+            webhook_url=config['webhook_url'],
+            secret_token=config['secret_token'],
+            max_connections=config['max_connections'],
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    else:
+        print("Бот запущен! Нажмите Ctrl+C для остановки.")
+        app.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Рассылка сообщений пользователям бота с учетом лимитов Telegram
+
+Получатели читаются из users постранично по id (keyset), сообщения уходят
+через очередь с BROADCAST_CONCURRENCY отправителями:
+
+- общий темп не выше BROADCAST_RATE сообщений в секунду (у Telegram ~30),
+  в один чат - не чаще раза в BROADCAST_CHAT_INTERVAL секунд
+- 429 (flood control) - все отправители ждут retry_after, сообщение
+  повторяется; сетевые ошибки - повтор с паузой, до BROADCAST_MAX_RETRIES
+- 403 (бот заблокирован) - blocked, остальные ошибки Bot API - failed
+
+Курсор в таблице broadcasts (timeweb-broadcasts.sql) сдвигается только через
+пользователей, по которым отправка завершена, а завершенные после курсора
+сохраняются вместе с ним (done). После падения повторно могут уйти лишь
+сообщения, которые отправлялись в момент падения.
+Пользователи с нечисловым telegram_id пропускаются.
+
+Запуск:
+    python3 broadcast.py --name feature-2026-10 --text "Новое в TradeAnalyzer: ..." --button
+    python3 broadcast.py --name feature-2026-10            # продолжить после остановки
+    python3 broadcast.py --name feature-2026-10 --status
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta
+
+import asyncpg
+from dotenv import load_dotenv
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
+
+# bot.py читает BOT_TOKEN и BOT_WEB_APP_URL при импорте - .env нужен до него
+load_dotenv()
+
+from bot import START_MARKUP, TOKEN
+from rate_limit import TokenBucket
+
+SENT = 'sent'
+BLOCKED = 'blocked'
+FAILED = 'failed'
+
+# Получатели: telegram_id - номер чата пользователя (только числовые)
+RECIPIENTS_SQL = """
+SELECT id, telegram_id
+FROM users
+WHERE ($1::uuid IS NULL OR id > $1) AND telegram_id ~ '^[0-9]+$'
+ORDER BY id
+LIMIT $2
+"""
+
+
+def db_config_from_env():
+    """Подключение к БД (те же DB_* переменные, что у API)"""
+    return {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': int(os.getenv('DB_PORT', '5432')),
+        'database': os.getenv('DB_NAME', 'tradeanalyzer'),
+        'user': os.getenv('DB_USER', 'tradeanalyzer_app'),
+        'password': os.getenv('DB_PASSWORD', 'SECURE_PASSWORD_2024!'),
+    }
+
+
+def broadcast_config_from_env():
+    """Параметры рассылки из переменных окружения"""
+    return {
+        'rate': float(os.getenv('BROADCAST_RATE', '25')),
+        'chat_interval': float(os.getenv('BROADCAST_CHAT_INTERVAL', '1')),
+        'concurrency': int(os.getenv('BROADCAST_CONCURRENCY', '20')),
+        'page_size': int(os.getenv('BROADCAST_PAGE_SIZE', '500')),
+        'max_retries': int(os.getenv('BROADCAST_MAX_RETRIES', '5')),
+    }
+
+
+def retry_seconds(error):
+    """retry_after из RetryAfter в секундах (int или timedelta по версии библиотеки)"""
+    value = error.retry_after
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class Broadcast:
+    """
+    Одна рассылка: чтение получателей, отправка и сохранение курсора.
+
+    - rate: сообщений в секунду на всю рассылку
+    - chat_interval: минимальный интервал между сообщениями в один чат, сек
+    - concurrency: одновременных запросов к Bot API
+    - page_size: получателей в одном запросе к users
+    - max_retries: повторов одного сообщения (429 и сетевые ошибки)
+    """
+
+    def __init__(self, pool, bot, name, rate=25.0, chat_interval=1.0, concurrency=20, page_size=500,
+                 max_retries=5):
+        self.pool = pool
+        self.bot = bot
+        self.name = name
+        self.chat_interval = chat_interval
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.max_retries = max_retries
+
+        self._bucket = TokenBucket(rate, max(1.0, rate / 10))  # без пиков больше 0.1 сек темпа
+        self._paused_until = 0.0         # monotonic: ожидание после 429
+        self._chat_sent = OrderedDict()  # chat_id -> monotonic время последней отправки
+        self._pending = deque()          # id получателей в порядке курсора
+        self._outcomes = {}              # id -> результат, пока курсор до него не дошел
+        self._skip = {}                  # id (строкой) -> результат из done прошлого запуска
+        self._dirty = asyncio.Event()
+        self.started = None
+        self.state = None
+        self.counters = {SENT: 0, BLOCKED: 0, FAILED: 0, 'retries': 0, 'flood_waits': 0}
+
+    # ------------------------------------------------------------------
+    # Состояние в БД
+    # ------------------------------------------------------------------
+
+    async def load(self, text=None, web_app_button=False):
+        """Состояние рассылки; с text - создается, если ее еще нет"""
+        async with self.pool.acquire() as conn:
+            if text is not None:
+                await conn.execute(
+                    "INSERT INTO broadcasts (name, text, web_app_button) VALUES ($1, $2, $3) "
+                    "ON CONFLICT (name) DO NOTHING",
+                    self.name, text, web_app_button
+                )
+            row = await conn.fetchrow("SELECT * FROM broadcasts WHERE name = $1", self.name)
+        self.state = dict(row) if row is not None else None
+        if self.state is not None:
+            self._skip = json.loads(self.state['done'])
+            if text is not None and self.state['text'] != text:
+                print(f"[broadcast] {self.name}: already exists, continuing with the saved text")
+        return self.state
+
+    async def save(self):
+        """Курсор, итоги по пользователям до курсора и завершенные после него"""
+        state = self.state
+        # Завершенные в прошлых запусках, до которых чтение еще не дошло, тоже
+        # остаются в done - иначе после следующей остановки им уйдет повтор
+        done = dict(self._skip)
+        done.update((str(user_id), outcome) for user_id, outcome in self._outcomes.items())
+        done = json.dumps(done)
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE broadcasts SET cursor_id = $2, sent = $3, blocked = $4, failed = $5, "
+                "status = $6, done = $7::jsonb, updated_at = NOW(), "
+                "finished_at = CASE WHEN $6 = 'finished' THEN NOW() END "
+                "WHERE name = $1",
+                self.name, state['cursor_id'], state['sent'], state['blocked'], state['failed'],
+                state['status'], done
+            )
+
+    # ------------------------------------------------------------------
+    # Рассылка
+    # ------------------------------------------------------------------
+
+    async def run(self, report_interval=10.0):
+        """Отправка всем оставшимся получателям; итоги - self.stats()"""
+        if self.state is None:
+            raise ValueError(f"Broadcast {self.name} not found")
+        if self.state['status'] == 'finished':
+            print(f"[broadcast] {self.name}: already finished")
+            return self.stats()
+
+        self.started = time.monotonic()
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        saver = asyncio.create_task(self._saver())
+        reporter = asyncio.create_task(self._reporter(report_interval))
+        try:
+            cursor = self.state['cursor_id']
+            while True:
+                async with self.pool.acquire() as conn:
+                    rows = await conn.fetch(RECIPIENTS_SQL, cursor, self.page_size)
+                for row in rows:
+                    self._pending.append(row['id'])
+                    outcome = self._skip.pop(str(row['id']), None)
+                    if outcome is not None:
+                        # Отправлено до остановки, курсор до него не дошел
+                        self._done(row['id'], outcome)
+                    else:
+                        await queue.put((row['id'], int(row['telegram_id'])))
+                if len(rows) < self.page_size:
+                    break
+                cursor = rows[-1]['id']
+            await queue.join()
+            self.state['status'] = 'finished'
+        finally:
+            for task in workers + [saver, reporter]:
+                task.cancel()
+            await asyncio.gather(*workers, saver, reporter, return_exceptions=True)
+            # Курсор - только по завершенным отправкам (в том числе при остановке)
+            await self.save()
+        print(f"[broadcast] {self.name}: {self.state['status']}, {self._progress()}")
+        return self.stats()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        handled = self.counters[SENT] + self.counters[BLOCKED] + self.counters[FAILED]
+        return {
+            'name': self.name,
+            'status': self.state['status'] if self.state else None,
+            'total': {key: self.state[key] for key in (SENT, BLOCKED, FAILED)} if self.state else None,
+            'run': dict(self.counters),
+            'elapsed': round(elapsed, 2),
+            'per_sec': round(handled / elapsed, 1) if elapsed else 0.0,
+        }
+
+    async def _worker(self, queue):
+        while True:
+            user_id, chat_id = await queue.get()
+            try:
+                outcome = await self.deliver(chat_id)
+            except Exception as e:
+                print(f"[broadcast] send error for chat {chat_id}: {e}")
+                outcome = FAILED
+            self.counters[outcome] += 1
+            self._done(user_id, outcome)
+            queue.task_done()
+
+    async def deliver(self, chat_id):
+        """Одно сообщение с повторами: sent, blocked или failed"""
+        for attempt in range(self.max_retries + 1):
+            await self._throttle(chat_id)
+            try:
+                await self.bot.send_message(
+                    chat_id, self.state['text'],
+                    reply_markup=START_MARKUP if self.state['web_app_button'] else None
+                )
+                return SENT
+            except RetryAfter as e:
+                # Flood control действует на весь бот - ждут все отправители
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_seconds(e))
+                self.counters['flood_waits'] += 1
+            except Forbidden:
+                return BLOCKED
+            except BadRequest:
+                return FAILED
+            except NetworkError:
+                # TimedOut тоже NetworkError: сообщение могло дойти, но без повтора не дойдет точно
+                await asyncio.sleep(min(2 ** attempt, 30))
+            self.counters['retries'] += 1
+        return FAILED
+
+    async def _throttle(self, chat_id):
+        while True:
+            now = time.monotonic()
+            last = self._chat_sent.get(chat_id)
+            wait = max(self._paused_until - now, (last + self.chat_interval - now) if last else 0.0)
+            if wait <= 0:
+                wait = self._bucket.take(now)
+                if not wait:
+                    break
+            await asyncio.sleep(wait)
+        self._chat_sent[chat_id] = now
+        self._chat_sent.move_to_end(chat_id)
+        # Старые отметки больше не ограничивают - не держим их в памяти
+        while self._chat_sent and next(iter(self._chat_sent.values())) < now - self.chat_interval:
+            self._chat_sent.popitem(last=False)
+
+    def _done(self, user_id, outcome):
+        """Результат получателя; курсор сдвигается через непрерывный префикс завершенных"""
+        self._outcomes[user_id] = outcome
+        while self._pending and self._pending[0] in self._outcomes:
+            done_id = self._pending.popleft()
+            self.state[self._outcomes.pop(done_id)] += 1
+            self.state['cursor_id'] = done_id
+        self._dirty.set()
+
+    async def _saver(self):
+        # Одна запись за раз: пока идет UPDATE, результаты накапливаются
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            try:
+                await self.save()
+            except Exception as e:
+                print(f"[broadcast] cursor save error: {e}")
+                await asyncio.sleep(1)
+                self._dirty.set()
+
+    async def _reporter(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            print(f"[broadcast] {self.name}: {self._progress()}")
+
+    def _progress(self):
+        stats = self.stats()
+        run = stats['run']
+        return (f"sent {run[SENT]}, blocked {run[BLOCKED]}, failed {run[FAILED]}, "
+                f"retries {run['retries']}, {stats['per_sec']} msg/s")
+
+
+# ============================================================================
+# ЗАПУСК
+# ============================================================================
+
+async def main_async(args):
+    config = broadcast_config_from_env()
+    pool = await asyncpg.create_pool(**db_config_from_env(), min_size=1, max_size=2)
+    # Соединений с Bot API - по числу одновременных отправок
+    request = HTTPXRequest(connection_pool_size=config['concurrency'], pool_timeout=10)
+    bot = Bot(TOKEN, base_url=os.getenv('BOT_API_BASE_URL') or 'https://api.telegram.org/bot', request=request)
+    try:
+        broadcast = Broadcast(pool, bot, args.name, **config)
+        text = args.text
+        if args.text_file:
+            with open(args.text_file, encoding='utf-8') as f:
+                text = f.read()
+        state = await broadcast.load(text, args.button)
+        if state is None:
+            raise SystemExit(f"Broadcast {args.name} not found: pass --text to create it")
+        if args.status:
+            print({key: state[key] for key in ('name', 'status', 'sent', 'blocked', 'failed', 'updated_at')})
+            return
+        async with bot:
+            await broadcast.run()
+    finally:
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Рассылка сообщения пользователям бота')
+    parser.add_argument('--name', required=True, help='имя рассылки (по нему продолжается после остановки)')
+    parser.add_argument('--text', help='текст сообщения (при создании рассылки)')
+    parser.add_argument('--text-file', help='текст сообщения из файла')
+    parser.add_argument('--button', action='store_true', help='кнопка "Открыть сайт" (Web App)')
+    parser.add_argument('--status', action='store_true', help='только показать состояние')
+    args = parser.parse_args()
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        print("[broadcast] stopped, run again with the same --name to continue")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Пул соединений PostgreSQL для API TradeAnalyzer
+Общий для timeweb_api_simple.py и timeweb-api.py
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolError(Exception):
+    """Не удалось получить соединение из пула"""
+
+
+class PoolTimeout(PoolError):
+    """Истекло время ожидания свободного соединения"""
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Соединение psycopg2 с метаданными пула"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+        # Подготовленные на этом соединении запросы (statements.py)
+        self.prepared = set()
+        self.deallocate_all = False
+
+
+def pool_config_from_env():
+    """Параметры пула из переменных окружения"""
+    return {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '1')),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', '5')),
+        'max_age': float(os.getenv('DB_POOL_MAX_AGE', '1800')),
+        'validate_after': float(os.getenv('DB_POOL_VALIDATE_AFTER', '30')),
+    }
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений.
+
+    - min_size/max_size: сколько соединений держать открытыми и сколько можно открыть всего
+      (до min_size пул дополняется в фоне при первом getconn() в процессе)
+    - timeout: сколько ждать свободного соединения, прежде чем вернуть PoolTimeout
+    - max_age: соединения старше этого возраста (сек) закрываются и пересоздаются
+    - validate_after: соединение, простаивавшее дольше (сек), проверяется SELECT 1 при выдаче
+    """
+
+    def __init__(self, db_config, min_size=1, max_size=10, timeout=5.0,
+                 max_age=1800.0, validate_after=30.0):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+
+        self.db_config = dict(db_config)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.validate_after = validate_after
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = deque()
+        self._size = 0          # открытые соединения (свободные + выданные)
+        self._waiting = 0
+        self._pid = os.getpid()
+        self._filled_pid = None   # процесс, в котором пул уже дополнялся до min_size
+        self._counters = {
+            'connects': 0,
+            'connect_errors': 0,
+            'checkouts': 0,
+            'timeouts': 0,
+            'validation_failures': 0,
+            'recycled': 0,
+            'discarded': 0,
+            'wait_time_total': 0.0,
+        }
+        # Необязательные обработчики для метрик (metrics.py): ожидание
+        # соединения (сек), открытие соединения (сек), истечение ожидания
+        self.on_checkout = None
+        self.on_connect = None
+        self.on_timeout = None
+
+    # ------------------------------------------------------------------
+    # Выдача и возврат соединений
+    # ------------------------------------------------------------------
+
+    def getconn(self):
+        """Получение соединения из пула"""
+        if self._filled_pid != os.getpid() and self.min_size > 0:
+            self._start_fill()
+        deadline = time.monotonic() + self.timeout
+        started = time.monotonic()
+
+        with self._cond:
+            self._check_fork()
+            while True:
+                conn = self._pop_idle()
+                if conn is not None:
+                    break
+
+                if self._size < self.max_size:
+                    # Резервируем место и подключаемся вне блокировки
+                    self._size += 1
+                    conn = None
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    if self.on_timeout is not None:
+                        self.on_timeout()
+                    raise PoolTimeout(
+                        f"No free connection in {self.timeout}s (max_size={self.max_size})"
+                    )
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        if conn is None:
+            conn = self._connect_reserved()
+        elif not self._validate(conn):
+            # Место в пуле остается за нами, меняем только само соединение
+            with self._cond:
+                self._counters['validation_failures'] += 1
+                self._counters['discarded'] += 1
+            self._close_quietly(conn)
+            conn = self._connect_reserved()
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self._counters['checkouts'] += 1
+            self._counters['wait_time_total'] += waited
+        if self.on_checkout is not None:
+            self.on_checkout(waited)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Возврат соединения в пул"""
+        if conn.closed or close:
+            self._discard(conn)
+            return
+
+        try:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                self._discard(conn)
+                return
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            self._discard(conn)
+            return
+
+        if time.monotonic() - conn.created_at > self.max_age:
+            with self._cond:
+                self._counters['recycled'] += 1
+            self._discard(conn)
+            return
+
+        conn.last_used_at = time.monotonic()
+        with self._cond:
+            if os.getpid() != self._pid:
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Соединение из пула на время блока with"""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    # ------------------------------------------------------------------
+    # Обслуживание
+    # ------------------------------------------------------------------
+
+    def fill(self):
+        """Открытие соединений до min_size"""
+        self._filled_pid = os.getpid()
+        while True:
+            with self._cond:
+                self._check_fork()
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            conn = self._connect_reserved()
+            self.putconn(conn)
+
+    def close(self):
+        """Закрытие всех свободных соединений"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        """Статистика пула"""
+        with self._cond:
+            in_use = self._size - len(self._idle)
+            stats = dict(self._counters)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': in_use,
+                'waiting': self._waiting,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            })
+        stats['wait_time_total'] = round(stats['wait_time_total'], 6)
+        return stats
+
+    # ------------------------------------------------------------------
+    # Внутренние методы
+    # ------------------------------------------------------------------
+
+    def _check_fork(self):
+        # После fork (gunicorn --preload) соединения родителя использовать нельзя.
+        # Закрывать их тоже нельзя - это оборвет сессии родительского процесса.
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._idle.clear()
+            self._size = 0
+
+    def _start_fill(self):
+        # Под gunicorn fill() из __main__ не вызывается, а пул создается при импорте
+        # (в мастере с --preload) - воркер дополняет его сам при первом запросе,
+        # в фоне, чтобы этот запрос не ждал min_size подключений
+        with self._cond:
+            if self._filled_pid == os.getpid():
+                return
+            self._filled_pid = os.getpid()
+        threading.Thread(target=self._fill_quietly, name='db-pool-fill', daemon=True).start()
+
+    def _fill_quietly(self):
+        try:
+            self.fill()
+        except PoolError as e:
+            print(f"[db_pool] failed to open min_size={self.min_size} connections: {e}")
+
+    def _pop_idle(self):
+        # Берем самое свежее соединение, слишком старые закрываем
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.closed or time.monotonic() - conn.created_at > self.max_age:
+                self._counters['recycled'] += 1
+                self._size -= 1
+                self._close_quietly(conn)
+                continue
+            return conn
+        return None
+
+    def _validate(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used_at < self.validate_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _connect_reserved(self):
+        # Место под соединение уже зарезервировано в _size
+        started = time.monotonic()
+        try:
+            conn = psycopg2.connect(connection_factory=PooledConnection, **self.db_config)
+        except Exception as e:
+            with self._cond:
+                self._size -= 1
+                self._counters['connect_errors'] += 1
+                self._cond.notify()
+            raise PoolError(f"Database connection error: {e}") from e
+        with self._cond:
+            self._counters['connects'] += 1
+        if self.on_connect is not None:
+            self.on_connect(time.monotonic() - started)
+        return conn
+
+    def _discard(self, conn):
+        with self._cond:
+            if os.getpid() == self._pid:
+                self._size -= 1
+                self._counters['discarded'] += 1
+            self._cond.notify()
+        self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+"""
+Разделение чтения и записи между primary и репликами PostgreSQL
+Общий для timeweb_api_simple.py и timeweb_api_async.py
+
+Запись всегда идет в primary. Чтение - по политике эндпоинта:
+    primary   - только primary
+    replica   - реплика, если она отстает не больше DB_REPLICA_MAX_LAG и уже
+                получила последние изменения пользователя (read-your-writes)
+    analytics - тяжелые админ-запросы: реплика с отставанием до DB_ANALYTICS_MAX_LAG
+Если подходящей реплики нет (недоступна, отстает) - чтение идет в primary.
+
+Реплики:
+    DB_REPLICAS=10.0.0.2,10.0.0.3:5433   (база, пользователь и пароль - как у primary)
+"""
+
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import psycopg2
+
+from db_pool import PoolError, PoolTimeout
+
+PRIMARY = 'primary'
+REPLICA = 'replica'
+ANALYTICS = 'analytics'
+POLICIES = (PRIMARY, REPLICA, ANALYTICS)
+
+# Позиция WAL и время primary на момент проверки
+PRIMARY_POSITION_SQL = "SELECT pg_current_wal_lsn()::text AS lsn, now() AS now"
+
+# Состояние реплики: успела ли она воспроизвести WAL до позиции primary
+# и время последней воспроизведенной транзакции. Не реплика (pg_is_in_recovery()
+# = false) считается догнавшей - отставание у нее не измерить.
+REPLICA_STATE_SQL = """
+SELECT pg_is_in_recovery() AS in_recovery,
+       COALESCE(pg_last_wal_replay_lsn() >= %s::pg_lsn, NOT pg_is_in_recovery()) AS caught_up,
+       pg_last_xact_replay_timestamp() AS replayed_at
+"""
+
+
+def replica_configs_from_env(db_config):
+    """Конфигурации реплик из DB_REPLICAS (host[:port] через запятую)"""
+    configs = []
+    for item in os.getenv('DB_REPLICAS', '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(':')
+        config = dict(db_config, host=host, port=port or db_config.get('port', '5432'))
+        # Недоступная реплика не должна надолго задерживать запрос
+        config.setdefault('connect_timeout', int(os.getenv('DB_REPLICA_CONNECT_TIMEOUT', '2')))
+        configs.append(config)
+    return configs
+
+
+def router_config_from_env():
+    """Параметры роутера из переменных окружения"""
+    return {
+        'max_lag': float(os.getenv('DB_REPLICA_MAX_LAG', '5')),
+        'analytics_max_lag': float(os.getenv('DB_ANALYTICS_MAX_LAG', '300')),
+        'sticky_for': float(os.getenv('DB_READ_YOUR_WRITES', '10')),
+        'check_interval': float(os.getenv('DB_REPLICA_CHECK_INTERVAL', '2')),
+    }
+
+
+def read_policies_from_env(defaults):
+    """
+    Политики чтения по эндпоинтам: defaults, переопределенные через
+    DB_READ_POLICIES=admin_users_list=primary,get_user_stats=replica
+    """
+    policies = dict(defaults)
+    for item in os.getenv('DB_READ_POLICIES', '').split(','):
+        endpoint, _, policy = item.strip().partition('=')
+        if not endpoint:
+            continue
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown read policy for {endpoint}: {policy!r}")
+        policies[endpoint] = policy
+    return policies
+
+
+def replica_name(config):
+    """Имя реплики в статистике"""
+    return f"{config['host']}:{config['port']}"
+
+
+class ReplicaRouter:
+    """
+    Выбор пула для запроса.
+
+    - primary: пул primary (ConnectionPool), replicas: {имя: пул реплики}
+    - max_lag: допустимое отставание реплики (сек) для политики replica
+    - analytics_max_lag: то же для политики analytics
+    - sticky_for: сколько секунд после записи пользователя его чтения идут
+      в primary (в пределах процесса; 0 - выключено)
+    - check_interval: как часто проверять состояние и отставание реплик (сек)
+
+    Проверка выполняется фоновым потоком (запускается первым запросом в
+    процессе, как HealthMonitor), запросы используют последнее состояние.
+    Реплика, у которой просто заняты все соединения, недоступной не считается.
+    """
+
+    def __init__(self, primary, replicas=None, max_lag=5.0, analytics_max_lag=300.0,
+                 sticky_for=10.0, check_interval=2.0, sticky_size=10000):
+        self.primary = primary
+        self.max_lag = max_lag
+        self.analytics_max_lag = analytics_max_lag
+        self.sticky_for = sticky_for
+        self.check_interval = check_interval
+        self.sticky_size = sticky_size
+
+        self._replicas = [
+            {
+                'name': name,
+                'pool': pool,
+                'healthy': False,       # до первой проверки реплика не используется
+                'in_recovery': None,
+                'lag': None,
+                'fresh_until': None,    # время primary, до которого все изменения уже на реплике
+                'checked_at': None,
+                'error': None,
+                'reads': 0,
+            }
+            for name, pool in (replicas or {}).items()
+        ]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._round_robin = itertools.count()
+        self._sticky = OrderedDict()
+        self._counters = {
+            'primary': 0,       # политика primary или реплик нет
+            'replica': 0,
+            'sticky': 0,        # в primary после недавней записи пользователя
+            'fallback': 0,      # нет подходящей реплики
+            'checks': 0,
+            'check_errors': 0,
+            'check_busy': 0,    # проверка не дождалась соединения из занятого пула
+        }
+
+    # ------------------------------------------------------------------
+    # Выбор пула
+    # ------------------------------------------------------------------
+
+    def route(self, policy, key=None, written_at=None):
+        """
+        Пул для чтения по политике.
+
+        key - пользователь (telegram_id) для read-your-writes в пределах процесса,
+        written_at - время последнего изменения читаемых данных по часам primary
+        (например, changed_at из user_activity): реплика подходит, только если
+        она уже воспроизвела изменения до этого момента.
+        """
+        if self._replicas:
+            self._ensure_started()
+        pool = self._choose(policy, key, written_at)
+        return pool if pool is self.primary else RoutedPool(self, pool)
+
+    def mark_write(self, key):
+        """Запись пользователя key: его чтения sticky_for секунд идут в primary"""
+        if not self._replicas or self.sticky_for <= 0 or key is None:
+            return
+        key = str(key)
+        with self._lock:
+            self._sticky[key] = time.monotonic() + self.sticky_for
+            self._sticky.move_to_end(key)
+            while len(self._sticky) > self.sticky_size:
+                self._sticky.popitem(last=False)
+
+    def mark_down(self, pool, error):
+        """Реплика недоступна: не используется до следующей успешной проверки"""
+        for replica in self._replicas:
+            if replica['pool'] is pool:
+                with self._lock:
+                    was_healthy = replica['healthy']
+                    replica['healthy'] = False
+                    replica['error'] = str(error).strip()
+                if was_healthy:
+                    print(f"[db_router] replica {replica['name']} is down: {replica['error']}")
+
+    def stats(self):
+        """Состояние реплик и счетчики выбора"""
+        now = time.monotonic()
+        with self._lock:
+            counters = dict(self._counters)
+            sticky_keys = sum(1 for expires in self._sticky.values() if expires > now)
+            replicas = []
+            for replica in self._replicas:
+                info = {key: value for key, value in replica.items() if key != 'pool'}
+                if info['fresh_until'] is not None:
+                    info['fresh_until'] = info['fresh_until'].isoformat()
+                checked_at = info.pop('checked_at')
+                info['checked_ago'] = round(now - checked_at, 3) if checked_at is not None else None
+                if info['lag'] is not None:
+                    info['lag'] = round(info['lag'], 3)
+                replicas.append(info)
+        for info, replica in zip(replicas, self._replicas):
+            info['pool'] = self._pool_stats(replica['pool'])
+        return {
+            'replicas': replicas,
+            'max_lag': self.max_lag,
+            'analytics_max_lag': self.analytics_max_lag,
+            'sticky_for': self.sticky_for,
+            'sticky_keys': sticky_keys,
+            'counters': counters,
+        }
+
+    # ------------------------------------------------------------------
+    # Проверка реплик
+    # ------------------------------------------------------------------
+
+    def check(self):
+        """Проверка доступности и отставания реплик относительно позиции WAL primary"""
+        try:
+            with self.primary.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(PRIMARY_POSITION_SQL)
+                    lsn, primary_now = cur.fetchone()
+        except (PoolError, psycopg2.Error) as e:
+            # Без позиции primary отставание не измерить - состояние реплик не меняем
+            self._count('check_busy' if self._busy(self.primary, e) else 'check_errors')
+            print(f"[db_router] primary position check failed: {e}")
+            return
+
+        for replica in self._replicas:
+            try:
+                with replica['pool'].connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(REPLICA_STATE_SQL, [lsn])
+                        row = cur.fetchone()
+            except (PoolError, psycopg2.Error) as e:
+                self._check_failed(replica, e)
+                continue
+            self._update(replica, primary_now, *row)
+        self._count('checks')
+
+    def stop(self):
+        self._stop.set()
+
+    def _check_failed(self, replica, error):
+        if self._busy(replica['pool'], error):
+            # Реплика занята, но доступна: состояние не меняем. Отставание
+            # по-прежнему оценивается с учетом возраста последней проверки
+            self._count('check_busy')
+            return
+        self._count('check_errors')
+        self.mark_down(replica['pool'], error)
+
+    @staticmethod
+    def _busy(pool, error):
+        # Ошибка означает только, что заняты все соединения пула
+        return isinstance(error, PoolTimeout)
+
+    def _ensure_started(self):
+        # Поток запускается первым запросом, а не при импорте (gunicorn --preload, см. HealthMonitor)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='replica-checker', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:  # не даем потоку завершиться
+                print(f"[db_router] check error: {e}")
+            if self._stop.wait(self.check_interval):
+                return
+
+    def _update(self, replica, primary_now, in_recovery, caught_up, replayed_at):
+        # Догнала primary - на ней все, что было закоммичено до primary_now,
+        # иначе - все до последней воспроизведенной транзакции
+        fresh_until = primary_now if caught_up else replayed_at
+        lag = max(0.0, (primary_now - fresh_until).total_seconds()) if fresh_until else None
+        with self._lock:
+            was_healthy = replica['healthy']
+            replica.update(
+                healthy=True,
+                in_recovery=in_recovery,
+                lag=lag,
+                fresh_until=fresh_until,
+                checked_at=time.monotonic(),
+                error=None,
+            )
+        if not was_healthy:
+            print(f"[db_router] replica {replica['name']} is up (lag={lag})")
+
+    # ------------------------------------------------------------------
+    # Внутренние методы
+    # ------------------------------------------------------------------
+
+    def _choose(self, policy, key, written_at):
+        if policy not in (REPLICA, ANALYTICS) or not self._replicas:
+            self._count('primary')
+            return self.primary
+
+        now = time.monotonic()
+        with self._lock:
+            if policy == REPLICA and key is not None:
+                expires = self._sticky.get(str(key))
+                if expires is not None:
+                    if expires > now:
+                        self._counters['sticky'] += 1
+                        return self.primary
+                    del self._sticky[str(key)]
+
+            max_lag = self.max_lag if policy == REPLICA else self.analytics_max_lag
+            candidates = [
+                replica for replica in self._replicas
+                if replica['healthy'] and replica['lag'] is not None
+                # С момента проверки реплика могла отстать еще на столько же
+                and replica['lag'] + (now - replica['checked_at']) <= max_lag
+                and (written_at is None or replica['fresh_until'] >= written_at)
+            ]
+            if not candidates:
+                self._counters['fallback'] += 1
+                return self.primary
+
+            replica = candidates[next(self._round_robin) % len(candidates)]
+            replica['reads'] += 1
+            self._counters['replica'] += 1
+            return replica['pool']
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    @staticmethod
+    def _pool_stats(pool):
+        return pool.stats()
+
+
+class RoutedPool:
+    """
+    Пул реплики, выбранный для одного запроса (интерфейс ConnectionPool:
+    getconn/putconn/connection). Если к реплике не подключиться, соединение
+    берется из primary, а реплика помечается недоступной.
+    """
+
+    def __init__(self, router, pool):
+        self.router = router
+        self.pool = pool
+        self._owners = {}
+
+    def getconn(self):
+        pool = self.pool
+        if pool is not self.router.primary:
+            try:
+                conn = pool.getconn()
+                self._owners[id(conn)] = pool
+                return conn
+            except PoolError as e:
+                # Все соединения реплики заняты - это не отказ, просто читаем из primary
+                if not self.router._busy(pool, e):
+                    self.router.mark_down(pool, e)
+                self.router._count('fallback')
+                self.pool = pool = self.router.primary
+        conn = pool.getconn()
+        self._owners[id(conn)] = pool
+        return conn
+
+    def putconn(self, conn, close=False):
+        pool = self._owners.pop(id(conn), self.pool)
+        if (close or conn.closed) and pool is not self.router.primary:
+            # Соединение с репликой оборвалось - до следующей проверки читаем из primary
+            self.router.mark_down(pool, 'connection lost')
+        pool.putconn(conn, close=close)
+
+    @contextmanager
+    def connection(self):
+        """Соединение на время блока with (как ConnectionPool.connection)"""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+
+# ============================================================================
+# ASYNCPG
+# ============================================================================
+
+class AsyncReplicaRouter(ReplicaRouter):
+    """
+    ReplicaRouter для пулов asyncpg (timeweb_api_async.py): проверка идет
+    задачей в цикле событий, start() и stop() вызываются в lifespan.
+
+    - connect_errors: исключения подключения, после которых реплика
+      считается недоступной, а соединение берется из primary
+    - timeout: ожидание свободного соединения в пуле (сек)
+    """
+
+    def __init__(self, primary, replicas=None, connect_errors=(OSError,), timeout=None, **kwargs):
+        super().__init__(primary, replicas, **kwargs)
+        self.connect_errors = connect_errors
+        self.timeout = timeout
+        self._task = None
+
+    async def route(self, policy, key=None, written_at=None):
+        """Пул для чтения по политике (см. ReplicaRouter.route)"""
+        pool = self._choose(policy, key, written_at)
+        return pool if pool is self.primary else AsyncRoutedPool(self, pool)
+
+    async def start(self):
+        """Запуск фоновой проверки реплик (до первой проверки чтение идет в primary)"""
+        if self._replicas:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def check(self):
+        """Проверка доступности и отставания реплик относительно позиции WAL primary"""
+        try:
+            async with self.primary.acquire(timeout=self.timeout) as conn:
+                row = await conn.fetchrow(PRIMARY_POSITION_SQL)
+        except Exception as e:
+            self._count('check_busy' if self._busy(self.primary, e) else 'check_errors')
+            print(f"[db_router] primary position check failed: {e}")
+            return
+
+        for replica in self._replicas:
+            try:
+                async with replica['pool'].acquire(timeout=self.timeout) as conn:
+                    state = await conn.fetchrow(REPLICA_STATE_SQL.replace('%s', '$1::text'), row['lsn'])
+            except Exception as e:
+                self._check_failed(replica, e)
+                continue
+            self._update(replica, row['now'], state['in_recovery'], state['caught_up'], state['replayed_at'])
+        self._count('checks')
+
+    @staticmethod
+    def _busy(pool, error):
+        # Тайм-аут acquire при пуле, заполненном занятыми соединениями (а не при
+        # подключении к недоступной реплике) - как PoolTimeout у ConnectionPool
+        return (isinstance(error, asyncio.TimeoutError)
+                and pool.get_idle_size() == 0 and pool.get_size() >= pool.get_max_size())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"[db_router] check error: {e}")
+            await asyncio.sleep(self.check_interval)
+
+    @staticmethod
+    def _pool_stats(pool):
+        return {
+            'size': pool.get_size(),
+            'idle': pool.get_idle_size(),
+            'min_size': pool.get_min_size(),
+            'max_size': pool.get_max_size()
+        }
+
+
+class AsyncRoutedPool:
+    """
+    Пул реплики asyncpg для одного запроса (интерфейс asyncpg.Pool:
+    acquire/release). Если к реплике не подключиться - соединение из primary.
+    """
+
+    def __init__(self, router, pool):
+        self.router = router
+        self.pool = pool
+        self._owners = {}
+
+    def acquire(self, timeout=None):
+        return _AsyncAcquire(self, timeout)
+
+    async def release(self, conn):
+        await self._owners.pop(id(conn), self.pool).release(conn)
+
+    async def _acquire(self, timeout):
+        pool = self.pool
+        if pool is not self.router.primary:
+            try:
+                conn = await pool.acquire(timeout=timeout)
+                self._owners[id(conn)] = pool
+                return conn
+            except self.router.connect_errors as e:
+                # Все соединения реплики заняты - это не отказ, просто читаем из primary
+                if not self.router._busy(pool, e):
+                    self.router.mark_down(pool, e)
+                self.router._count('fallback')
+                self.pool = pool = self.router.primary
+        conn = await pool.acquire(timeout=timeout)
+        self._owners[id(conn)] = pool
+        return conn
+
+
+class _AsyncAcquire:
+    """Результат AsyncRoutedPool.acquire: await или async with, как у asyncpg"""
+
+    def __init__(self, routed, timeout):
+        self.routed = routed
+        self.timeout = timeout
+        self.conn = None
+
+    def __await__(self):
+        return self.routed._acquire(self.timeout).__await__()
+
+    async def __aenter__(self):
+        self.conn = await self.routed._acquire(self.timeout)
+        return self.conn
+
+    async def __aexit__(self, *exc_info):
+        await self.routed.release(self.conn)
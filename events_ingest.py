@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Буферизованная запись событий аналитики (user_events)
+Эндпоинт только кладет событие в очередь, фоновый поток пишет пачками
+"""
+
+import asyncio
+import atexit
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+import psycopg2.extras
+
+from db_pool import PoolError
+from user_cache import resolve_user_ids, resolve_user_ids_async
+
+
+def events_config_from_env():
+    """Параметры буфера событий из переменных окружения"""
+    return {
+        'max_size': int(os.getenv('EVENTS_BUFFER_SIZE', '10000')),
+        'batch_size': int(os.getenv('EVENTS_BATCH_SIZE', '500')),
+        'flush_interval': float(os.getenv('EVENTS_FLUSH_INTERVAL', '1')),
+    }
+
+
+# Ошибки, из-за которых события пишутся по одному; остальные (соединение,
+# пул) - повод повторить всю пачку
+ROW_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError, psycopg2.ProgrammingError)
+
+INSERT_EVENTS_SQL = """
+INSERT INTO user_events (id, user_id, telegram_user_id, event_type, event_data, created_at)
+VALUES %s
+"""
+
+# То же для asyncpg (executemany отправляет пачку без ожидания ответа на каждую строку)
+INSERT_EVENT_ASYNC_SQL = """
+INSERT INTO user_events (id, user_id, telegram_user_id, event_type, event_data, created_at)
+VALUES ($1, $2, $3, $4, $5::jsonb, $6)
+"""
+
+
+class EventBuffer:
+    """
+    Ограниченная очередь событий и фоновый поток записи.
+
+    - max_size: сколько событий держать в памяти; при переполнении submit() возвращает None
+    - batch_size: запись начинается, как только набралось столько событий
+    - flush_interval: или по таймеру (сек), если событий меньше
+    """
+
+    # Сколько раз повторять запись пачки, прежде чем отбросить ее
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, pool, user_cache=None, max_size=10000, batch_size=500, flush_interval=1.0):
+        if max_size < 1 or batch_size < 1:
+            raise ValueError(f"Invalid event buffer size: max={max_size}, batch={batch_size}")
+
+        self.pool = pool
+        self.user_cache = user_cache
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._cond = threading.Condition(threading.Lock())
+        self._queue = deque()
+        self._flush_lock = threading.Lock()   # одна запись в БД за раз
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._counters = {
+            'accepted': 0,
+            'dropped': 0,       # отклонены: буфер переполнен
+            'flushed': 0,
+            'failed': 0,        # потеряны после MAX_ATTEMPTS попыток записи
+            'rejected': 0,      # отклонены БД при записи по одному (остальные из пачки записаны)
+            'batches': 0,
+            'flush_errors': 0,
+            'flush_time_total': 0.0,
+        }
+
+    def submit(self, telegram_user_id, event_type, event_data=None, user_data=None):
+        """Постановка события в очередь. Возвращает {id, event_type, created_at} или None, если буфер полон"""
+        event = {
+            'id': str(uuid.uuid4()),
+            'telegram_user_id': str(telegram_user_id),
+            'event_type': event_type,
+            'event_data': event_data if event_data is not None else {},
+            'user_data': user_data or {},
+            'created_at': datetime.now(timezone.utc),
+        }
+
+        with self._cond:
+            if len(self._queue) >= self.max_size:
+                self._counters['dropped'] += 1
+                return None
+            self._queue.append(event)
+            self._counters['accepted'] += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+        self._ensure_started()
+        return {'id': event['id'], 'event_type': event_type, 'created_at': event['created_at']}
+
+    def flush(self):
+        """Синхронная запись всего, что накопилось в очереди. Возвращает число записанных событий"""
+        written = 0
+        while True:
+            batch = self._take(self.batch_size)
+            if not batch:
+                return written
+            written += self._write(batch)
+
+    def stop(self, timeout=10.0):
+        """Остановка фонового потока и запись остатка (вызывается при завершении процесса)"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join(timeout)
+        written = self.flush()
+        if written:
+            print(f"[analytics] flushed {written} events on shutdown")
+
+    def stats(self):
+        """Статистика буфера"""
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update({
+                'pending': len(self._queue),
+                'max_size': self.max_size,
+                'batch_size': self.batch_size,
+                'flush_interval': self.flush_interval,
+            })
+        stats['flush_time_total'] = round(stats['flush_time_total'], 6)
+        return stats
+
+    # ------------------------------------------------------------------
+    # Внутренние методы
+    # ------------------------------------------------------------------
+
+    def _ensure_started(self):
+        # Поток запускается при первом событии, а не при импорте: с gunicorn --preload
+        # модуль импортируется в мастере, а потоки через fork не наследуются
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid() or self._stopping:
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='events-flusher', daemon=True)
+            self._thread.start()
+
+    def _take(self, limit):
+        with self._cond:
+            count = min(limit, len(self._queue))
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                # Поток записи не должен умирать ни при каких ошибках
+                print(f"[analytics] flusher error: {e}")
+
+    def _write(self, batch):
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            started = time.monotonic()
+            try:
+                with self._flush_lock:
+                    rejected = self._insert(batch, use_cache=attempt == 1)
+            except (PoolError, psycopg2.Error) as e:
+                with self._cond:
+                    self._counters['flush_errors'] += 1
+                print(f"[analytics] failed to write {len(batch)} events (attempt {attempt}): {e}")
+                if attempt < self.MAX_ATTEMPTS and not self._stopping:
+                    time.sleep(0.5 * attempt)
+                continue
+
+            return self._written(batch, rejected, started)
+
+        with self._cond:
+            self._counters['failed'] += len(batch)
+        return 0
+
+    def _written(self, batch, rejected, started):
+        with self._cond:
+            self._counters['flushed'] += len(batch) - rejected
+            self._counters['rejected'] += rejected
+            self._counters['batches'] += 1
+            self._counters['flush_time_total'] += time.monotonic() - started
+        return len(batch) - rejected
+
+    @staticmethod
+    def _rejected(event, error):
+        print(f"[analytics] dropped event {event['id']} ({event['event_type']!r}): "
+              f"{str(error).strip().splitlines()[0]}")
+
+    def _insert(self, batch, use_cache=True):
+        """
+        Запись пачки в одной транзакции: пользователи одним UPSERT, события одним INSERT.
+        Если пачка не прошла, события пишутся по одному под SAVEPOINT (как в
+        bulk_insert), и теряются только те, что не приняла БД. Возвращает их число.
+        """
+        users = {}
+        for event in batch:
+            users.setdefault(event['telegram_user_id'], event['user_data'])
+        cache = self.user_cache if use_cache else None
+
+        def rows_for(user_ids):
+            return [
+                (
+                    event['id'],
+                    user_ids[event['telegram_user_id']],
+                    event['telegram_user_id'],
+                    event['event_type'],
+                    psycopg2.extras.Json(event['event_data']),
+                    event['created_at'],
+                )
+                for event in batch
+            ]
+
+        rejected = 0
+        with self.pool.connection() as conn:
+            user_ids, resolved = resolve_user_ids(conn, users, cache)
+            with conn.cursor() as cur:
+                cur.execute("SAVEPOINT events_batch")
+                try:
+                    psycopg2.extras.execute_values(cur, INSERT_EVENTS_SQL, rows_for(user_ids), page_size=len(batch))
+                except ROW_ERRORS as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT events_batch")
+                    print(f"[analytics] batch of {len(batch)} events failed, writing one by one: {e}")
+
+                    # Кеш мог устареть (пользователь удален) - находим всех заново
+                    user_ids, resolved = resolve_user_ids(conn, users)
+                    for event, row in zip(batch, rows_for(user_ids)):
+                        cur.execute("SAVEPOINT events_item")
+                        try:
+                            psycopg2.extras.execute_values(cur, INSERT_EVENTS_SQL, [row])
+                            cur.execute("RELEASE SAVEPOINT events_item")
+                        except ROW_ERRORS as item_error:
+                            cur.execute("ROLLBACK TO SAVEPOINT events_item")
+                            self._rejected(event, item_error)
+                            rejected += 1
+            conn.commit()
+
+        if self.user_cache is not None:
+            for telegram_id, user_id in resolved.items():
+                self.user_cache.set(telegram_id, user_id)
+        return rejected
+
+
+class AsyncEventBuffer(EventBuffer):
+    """
+    EventBuffer для asyncio (timeweb_api_async.py): запись идет задачей
+    в цикле событий через пул asyncpg, а не отдельным потоком.
+
+    submit() и stats() те же, flush() и stop() - корутины.
+    """
+
+    def __init__(self, pool, user_cache=None, max_size=10000, batch_size=500, flush_interval=1.0):
+        super().__init__(pool, user_cache, max_size, batch_size, flush_interval)
+        self._task = None
+        self._wakeup = None
+        self._write_lock = None
+
+    def submit(self, telegram_user_id, event_type, event_data=None, user_data=None):
+        event = super().submit(telegram_user_id, event_type, event_data, user_data)
+        if event is not None and self._wakeup is not None and len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+        return event
+
+    async def flush(self):
+        """Запись всего, что накопилось в очереди. Возвращает число записанных событий"""
+        written = 0
+        while True:
+            batch = self._take(self.batch_size)
+            if not batch:
+                return written
+            written += await self._write(batch)
+
+    async def stop(self):
+        """Остановка задачи записи и запись остатка (вызывается при остановке приложения)"""
+        self._stopping = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        written = await self.flush()
+        if written:
+            print(f"[analytics] flushed {written} events on shutdown")
+
+    def _ensure_started(self):
+        # Задача создается при первом событии внутри работающего цикла событий
+        if self._task is not None or self._stopping:
+            return
+        self._wakeup = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[analytics] flusher error: {e}")
+
+    async def _write(self, batch):
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            started = time.monotonic()
+            try:
+                async with self._write_lock:
+                    rejected = await self._insert(batch, use_cache=attempt == 1)
+            except Exception as e:
+                with self._cond:
+                    self._counters['flush_errors'] += 1
+                print(f"[analytics] failed to write {len(batch)} events (attempt {attempt}): {e}")
+                if attempt < self.MAX_ATTEMPTS and not self._stopping:
+                    await asyncio.sleep(0.5 * attempt)
+                continue
+
+            return self._written(batch, rejected, started)
+
+        with self._cond:
+            self._counters['failed'] += len(batch)
+        return 0
+
+    async def _insert(self, batch, use_cache=True):
+        import asyncpg  # только в асинхронной версии (requirements-async.txt)
+
+        users = {}
+        for event in batch:
+            users.setdefault(event['telegram_user_id'], event['user_data'])
+        cache = self.user_cache if use_cache else None
+
+        def rows_for(user_ids):
+            return [
+                (
+                    event['id'],
+                    user_ids[event['telegram_user_id']],
+                    event['telegram_user_id'],
+                    event['event_type'],
+                    event['event_data'],
+                    event['created_at'],
+                )
+                for event in batch
+            ]
+
+        rejected = 0
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                user_ids, resolved = await resolve_user_ids_async(conn, users, cache)
+                try:
+                    async with conn.transaction():
+                        await conn.executemany(INSERT_EVENT_ASYNC_SQL, rows_for(user_ids))
+                except asyncpg.PostgresError as e:
+                    print(f"[analytics] batch of {len(batch)} events failed, writing one by one: {e}")
+
+                    user_ids, resolved = await resolve_user_ids_async(conn, users)
+                    for event, row in zip(batch, rows_for(user_ids)):
+                        try:
+                            async with conn.transaction():
+                                await conn.execute(INSERT_EVENT_ASYNC_SQL, *row)
+                        except asyncpg.PostgresError as item_error:
+                            self._rejected(event, item_error)
+                            rejected += 1
+
+        if self.user_cache is not None:
+            for telegram_id, user_id in resolved.items():
+                self.user_cache.set(telegram_id, user_id)
+        return rejected
+
+
+def create_event_buffer(pool, user_cache=None):
+    """Буфер с настройками из окружения; остаток очереди записывается при выходе процесса"""
+    buffer = EventBuffer(pool, user_cache, **events_config_from_env())
+    atexit.register(buffer.stop)
+    return buffer
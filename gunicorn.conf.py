@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Настройки gunicorn для timeweb_api_simple.py
+
+Запуск:
+    gunicorn -c gunicorn.conf.py timeweb_api_simple:app
+
+Метрики Prometheus (/api/metrics) собираются со всех воркеров: каждый пишет
+значения в каталог PROMETHEUS_MULTIPROC_DIR, при старте gunicorn каталог
+очищается, значения завершившихся воркеров для gauge убираются.
+"""
+
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+threads = int(os.getenv('GUNICORN_THREADS', '1'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+
+# Должен быть задан до импорта prometheus_client (здесь и в воркерах)
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/tradeanalyzer-metrics')
+
+try:
+    from prometheus_client import multiprocess
+except ImportError:  # метрики выключены - metrics.py работает без prometheus_client
+    multiprocess = None
+
+
+def on_starting(server):
+    """Значения прошлого запуска не нужны: счетчики начинаются с нуля"""
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith('.db'):
+            os.remove(os.path.join(path, name))
+
+
+def child_exit(server, worker):
+    """Воркер завершился: его in-flight больше не учитывается"""
+    if multiprocess is not None:
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Проверки здоровья API без обращения к БД на каждую проверку
+Фоновый поток (HealthMonitor) или задача asyncio (AsyncHealthMonitor) раз в
+HEALTH_CHECK_INTERVAL секунд делает SELECT 1 через пул и запоминает результат;
+эндпоинты отдают запомненное состояние и текущую загрузку пула.
+
+- /api/health/live  - процесс отвечает (БД не учитывается)
+- /api/health/ready - можно направлять трафик: 503, если БД недоступна
+  HEALTH_FAILURE_THRESHOLD проверок подряд или результат устарел
+- /api/health       - полное состояние (как раньше, статус healthy/degraded/unhealthy)
+
+degraded (трафик принимается): медленный ответ БД, пул почти заполнен или
+есть ожидающие соединения, последняя проверка не прошла, проверки не
+дожидаются соединения из занятого пула.
+starting (трафик не принимается): первая проверка после старта еще не прошла.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from db_pool import PoolTimeout
+
+HEALTHY = 'healthy'
+DEGRADED = 'degraded'
+UNHEALTHY = 'unhealthy'
+STARTING = 'starting'
+
+
+def health_config_from_env():
+    """Параметры проверок здоровья из переменных окружения"""
+    return {
+        'interval': float(os.getenv('HEALTH_CHECK_INTERVAL', '5')),
+        'slow_ms': float(os.getenv('HEALTH_SLOW_MS', '200')),
+        'saturation': float(os.getenv('HEALTH_POOL_SATURATION', '0.9')),
+        'failure_threshold': int(os.getenv('HEALTH_FAILURE_THRESHOLD', '2')),
+        'stale_after': float(os.getenv('HEALTH_STALE_AFTER', '30')),
+    }
+
+
+def describe(error):
+    """Первая строка текста ошибки (у ошибок подключения psycopg2 их несколько)"""
+    text = str(error).strip()
+    return text.splitlines()[0] if text else type(error).__name__
+
+
+class HealthMonitor:
+    """
+    Состояние БД и пула для проверок здоровья.
+
+    - interval: пауза между проверками БД (сек)
+    - slow_ms: ответ БД дольше - degraded
+    - saturation: доля занятых соединений пула, начиная с которой - degraded
+    - failure_threshold: столько неудачных проверок подряд - unhealthy
+    - stale_after: нет успешной проверки дольше (сек) - unhealthy
+    """
+
+    def __init__(self, pool, interval=5.0, slow_ms=200, saturation=0.9, failure_threshold=2, stale_after=30.0):
+        self.pool = pool
+        self.interval = interval
+        self.slow = slow_ms / 1000
+        self.saturation = saturation
+        self.failure_threshold = failure_threshold
+        self.stale_after = stale_after
+        self.started_at = time.monotonic()
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._last = {
+            'checked_at': None,      # monotonic время последней проверки
+            'ok_at': None,           # monotonic время последней успешной проверки
+            'latency': None,         # сек, последний успешный SELECT 1 (с ожиданием пула)
+            'failures': 0,           # неудачных проверок подряд
+            'error': None,
+            'pool_exhausted': False, # проверка не дождалась соединения
+        }
+        self._counters = {'probes': 0, 'probe_errors': 0}
+
+    # ------------------------------------------------------------------
+    # Состояние (без обращения к БД)
+    # ------------------------------------------------------------------
+
+    def status(self):
+        """Текущее состояние: status, reasons, database, pool"""
+        self._ensure_started()
+        with self._lock:
+            last = dict(self._last)
+            counters = dict(self._counters)
+        pool = self.pool_stats()
+        now = time.monotonic()
+
+        reasons = []
+        if last['checked_at'] is None:
+            status = STARTING
+            reasons.append('no database check yet')
+        elif last['failures'] >= self.failure_threshold:
+            status = UNHEALTHY
+            reasons.append(f"database check failed {last['failures']} times: {last['error']}")
+        elif last['pool_exhausted'] and (last['ok_at'] is None or now - last['ok_at'] > self.stale_after):
+            # Проверки не дожидаются соединения: пул занят запросами, это не отказ БД
+            status = DEGRADED
+            reasons.append('database check timed out waiting for a pooled connection')
+            if pool['saturation'] >= self.saturation:
+                reasons.append(f"pool saturated: {pool['in_use']}/{pool['max_size']} in use")
+        elif last['ok_at'] is None or now - last['ok_at'] > self.stale_after:
+            status = UNHEALTHY
+            reasons.append(f'no successful database check in {self.stale_after}s')
+        else:
+            status = HEALTHY
+            if last['failures']:
+                reasons.append(f"last database check failed: {last['error']}")
+            if last['pool_exhausted']:
+                reasons.append('database check timed out waiting for a pooled connection')
+            if last['latency'] is not None and last['latency'] > self.slow:
+                reasons.append(f"slow database: {round(last['latency'] * 1000, 1)}ms")
+            if pool['saturation'] >= self.saturation:
+                reasons.append(f"pool saturated: {pool['in_use']}/{pool['max_size']} in use")
+            if pool.get('waiting'):
+                reasons.append(f"{pool['waiting']} requests waiting for a connection")
+            if reasons:
+                status = DEGRADED
+
+        return {
+            'status': status,
+            'reasons': reasons,
+            'database': {
+                'latency_ms': round(last['latency'] * 1000, 2) if last['latency'] is not None else None,
+                'checked_ago': round(now - last['checked_at'], 3) if last['checked_at'] is not None else None,
+                'last_ok_ago': round(now - last['ok_at'], 3) if last['ok_at'] is not None else None,
+                'failures': last['failures'],
+                'error': last['error'],
+                **counters,
+            },
+            'pool': pool,
+        }
+
+    def ready(self, status=None):
+        """Можно ли направлять трафик в воркер"""
+        status = status or self.status()
+        return status['status'] in (HEALTHY, DEGRADED)
+
+    def live(self):
+        """Живость процесса (БД не учитывается)"""
+        return {'status': 'alive', 'pid': os.getpid(), 'uptime': round(time.monotonic() - self.started_at, 1)}
+
+    def pool_stats(self):
+        stats = self.pool.stats()
+        stats['saturation'] = round(stats['in_use'] / stats['max_size'], 3) if stats['max_size'] else 0.0
+        return stats
+
+    # ------------------------------------------------------------------
+    # Проверка БД
+    # ------------------------------------------------------------------
+
+    def probe(self):
+        """Одна проверка: SELECT 1 через пул"""
+        started = time.perf_counter()
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                    cur.fetchone()
+                conn.rollback()
+        except PoolTimeout as e:
+            # БД может быть в порядке - заняты все соединения
+            self._record(error=str(e), pool_exhausted=True)
+        except Exception as e:
+            self._record(error=describe(e))
+        else:
+            self._record(latency=time.perf_counter() - started)
+
+    def stop(self):
+        self._stop.set()
+
+    def _record(self, latency=None, error=None, pool_exhausted=False):
+        now = time.monotonic()
+        with self._lock:
+            last = self._last
+            last['checked_at'] = now
+            last['pool_exhausted'] = pool_exhausted
+            self._counters['probes'] += 1
+            if error is None:
+                last.update(ok_at=now, latency=latency, failures=0, error=None)
+            elif pool_exhausted:
+                # Пул занят - это не отказ БД, счетчик отказов не растет
+                last['error'] = error
+            else:
+                self._counters['probe_errors'] += 1
+                last['failures'] += 1
+                last['error'] = error
+                if last['failures'] == self.failure_threshold:
+                    print(f"[health] database is unhealthy: {error}")
+
+    def _ensure_started(self):
+        # Поток запускается при первой проверке, а не при импорте (gunicorn --preload, см. EventBuffer)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='health-prober', daemon=True)
+            self._thread.start()
+        # Первую проверку не ждем: до нее status() отдает starting
+
+    def _run(self):
+        while True:
+            try:
+                self.probe()
+            except Exception as e:  # не даем потоку завершиться
+                print(f"[health] probe error: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+
+class AsyncHealthMonitor(HealthMonitor):
+    """
+    HealthMonitor для asyncio (timeweb_api_async.py): проверка идет задачей
+    в цикле событий через пул asyncpg. start() и stop() вызываются в lifespan.
+    """
+
+    def __init__(self, pool, timeout=30.0, **config):
+        super().__init__(pool, **config)
+        self.timeout = timeout
+        self._task = None
+
+    def pool_stats(self):
+        size, idle, max_size = self.pool.get_size(), self.pool.get_idle_size(), self.pool.get_max_size()
+        return {
+            'size': size,
+            'idle': idle,
+            'in_use': size - idle,
+            'min_size': self.pool.get_min_size(),
+            'max_size': max_size,
+            'saturation': round((size - idle) / max_size, 3) if max_size else 0.0,
+        }
+
+    def _ensure_started(self):
+        # Задачу запускает start() в lifespan, обработчик не ждет проверку
+        pass
+
+    async def start(self):
+        """Запуск фоновой задачи (первая проверка - в ней же, до нее status() отдает starting)"""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def probe(self):
+        started = time.perf_counter()
+        try:
+            conn = await self.pool.acquire(timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # Как PoolTimeout у синхронного пула: заняты все соединения
+            self._record(error=f"No free connection in {self.timeout}s", pool_exhausted=True)
+            return
+        except Exception as e:
+            self._record(error=describe(e))
+            return
+        try:
+            await conn.fetchval("SELECT 1", timeout=self.timeout)
+        except Exception as e:
+            self._record(error=describe(e))
+        else:
+            self._record(latency=time.perf_counter() - started)
+        finally:
+            await self.pool.release(conn)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.probe()
+            except Exception as e:
+                print(f"[health] probe error: {e}")
+            await asyncio.sleep(self.interval)
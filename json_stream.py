@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Потоковая отдача JSON из серверного курсора PostgreSQL
+Строки читаются пачками и сразу пишутся в ответ, весь список в памяти не собирается
+"""
+
+import os
+import uuid
+
+import psycopg2.extras
+
+
+def stream_config_from_env():
+    """Параметры потоковой отдачи из переменных окружения (batch_size - строк за один FETCH)"""
+    return {
+        'batch_size': int(os.getenv('STREAM_BATCH_SIZE', '500')),
+    }
+
+
+class JsonRowStream:
+    """
+    Ответ вида {"data": [...]} поверх именованного (серверного) курсора.
+
+    open() выполняет запрос и читает первую пачку, поэтому ошибки SQL
+    возникают до отправки первого байта и их можно вернуть обычным 500.
+    Итерация отдает JSON кусками и возвращает соединение в пул в конце.
+    Тело может и не читаться (HEAD, клиент оборвал соединение до первого
+    куска) - тогда генератор не запускается, поэтому ответ должен вызвать
+    close() при закрытии (response.call_on_close); повторный close() ничего не делает.
+    """
+
+    def __init__(self, pool, sql, params=None, dumps=None, batch_size=500, key='data',
+                 limit=None, cursor_fn=None, raw=False):
+        self.pool = pool
+        self.sql = sql
+        self.params = params or []
+        self.dumps = dumps
+        self.batch_size = batch_size
+        self.key = key
+        # Постраничный режим: запрос выбирает limit + 1 строк, лишняя строка
+        # означает, что есть следующая страница, и в ответ добавляется
+        # "next_cursor": cursor_fn(последняя отданная строка)
+        self.limit = limit
+        self.cursor_fn = cursor_fn
+        # raw: запрос возвращает одну колонку с готовым JSON строки (json_build_object::text),
+        # она пишется в ответ как есть, без разбора и повторной сериализации
+        self.raw = raw
+        self.rows_sent = 0
+        self._conn = None
+        self._cur = None
+        self._first = None
+
+    def open(self):
+        """Выполнение запроса и чтение первой пачки"""
+        self._conn = self.pool.getconn()
+        try:
+            self._cur = self._conn.cursor(
+                name=f"stream_{uuid.uuid4().hex}",
+                cursor_factory=None if self.raw else psycopg2.extras.RealDictCursor
+            )
+            self._cur.itersize = self.batch_size
+            self._cur.execute(self.sql, self.params)
+            self._first = self._cur.fetchmany(self.batch_size)
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def close(self):
+        """Закрытие курсора и возврат соединения в пул"""
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        broken = False
+        try:
+            if self._cur is not None and not conn.closed:
+                self._cur.close()
+        except Exception:
+            broken = True
+        self._cur = None
+        # Транзакция только читающая - пул откатит ее при возврате
+        self.pool.putconn(conn, close=broken)
+
+    def __iter__(self):
+        try:
+            yield '{"%s": [' % self.key
+            batch = self._first
+            self._first = None
+            separator = ''
+            last_row = None
+            has_more = False
+            while batch:
+                fetched = len(batch)
+                if self.limit is not None and self.rows_sent + fetched > self.limit:
+                    batch = batch[:self.limit - self.rows_sent]
+                    has_more = True
+                if batch:
+                    if self.raw:
+                        chunk = ','.join(row[0] for row in batch)
+                    else:
+                        chunk = ','.join(self.dumps(dict(row)) for row in batch)
+                    yield separator + chunk
+                    separator = ','
+                    self.rows_sent += len(batch)
+                    last_row = batch[-1]
+                if has_more or fetched < self.batch_size:
+                    break
+                batch = self._cur.fetchmany(self.batch_size)
+            yield ']'
+            if self.limit is not None:
+                next_cursor = self.cursor_fn(last_row) if has_more and last_row else None
+                yield ', "next_cursor": ' + self.dumps(next_cursor)
+            yield '}'
+        finally:
+            self.close()
+
+
+class AsyncJsonRowStream(JsonRowStream):
+    """
+    JsonRowStream для пула asyncpg (timeweb_api_async.py).
+
+    Запрос выполняется курсором в читающей транзакции, open() и close() -
+    корутины, итерация асинхронная (для StreamingResponse). close() вызывает
+    ответ после отправки (RowStreamResponse в timeweb_api_async.py).
+    """
+
+    def __init__(self, pool, sql, params=None, dumps=None, batch_size=500, key='data',
+                 limit=None, cursor_fn=None, raw=False, timeout=None):
+        super().__init__(pool, sql, params, dumps, batch_size, key, limit, cursor_fn, raw)
+        self.timeout = timeout
+        self._tx = None
+
+    async def open(self):
+        """Выполнение запроса и чтение первой пачки"""
+        self._conn = await self.pool.acquire(timeout=self.timeout)
+        try:
+            self._tx = self._conn.transaction(readonly=True)
+            await self._tx.start()
+            self._cur = await self._conn.cursor(self.sql, *self.params)
+            self._first = await self._cur.fetch(self.batch_size)
+        except BaseException:
+            await self.close()
+            raise
+        return self
+
+    async def close(self):
+        """Завершение транзакции и возврат соединения в пул"""
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        tx, self._tx = self._tx, None
+        self._cur = None
+        try:
+            if tx is not None and not conn.is_closed():
+                await tx.rollback()
+        except Exception:
+            # Соединение в неизвестном состоянии - пул закроет его при release
+            conn.terminate()
+        await self.pool.release(conn)
+
+    async def __aiter__(self):
+        try:
+            yield '{"%s": [' % self.key
+            batch = self._first
+            self._first = None
+            separator = ''
+            last_row = None
+            has_more = False
+            while batch:
+                fetched = len(batch)
+                if self.limit is not None and self.rows_sent + fetched > self.limit:
+                    batch = batch[:self.limit - self.rows_sent]
+                    has_more = True
+                if batch:
+                    if self.raw:
+                        chunk = ','.join(row[0] for row in batch)
+                    else:
+                        chunk = ','.join(self.dumps(dict(row)) for row in batch)
+                    yield separator + chunk
+                    separator = ','
+                    self.rows_sent += len(batch)
+                    last_row = batch[-1]
+                if has_more or fetched < self.batch_size:
+                    break
+                batch = await self._cur.fetch(self.batch_size)
+            yield ']'
+            if self.limit is not None:
+                next_cursor = self.cursor_fn(last_row) if has_more and last_row else None
+                yield ', "next_cursor": ' + self.dumps(next_cursor)
+            yield '}'
+        finally:
+            await self.close()
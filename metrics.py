@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Метрики API в формате Prometheus (GET /api/metrics)
+Общий для timeweb_api_simple.py (init_app) и timeweb_api_async.py (MetricsMiddleware)
+
+- запросы по маршрутам: число, время, ошибки (5xx), выполняющиеся сейчас
+- время запросов к БД по имени запроса (подготовленного или эндпоинта)
+- ожидание свободного соединения пула и время открытия нового
+
+prometheus_client необязателен: без него запись метрик ничего не делает,
+а /api/metrics отвечает 503. Для нескольких воркеров gunicorn значения
+пишутся в каталог PROMETHEUS_MULTIPROC_DIR и суммируются при чтении
+(каталог задает и очищает gunicorn.conf.py).
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # pragma: no cover - зависит от окружения
+    prometheus_client = None
+
+PREFIX = 'tradeanalyzer'
+
+# Границы гистограмм (сек)
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+POOL_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def metrics_config_from_env():
+    """Параметры метрик из переменных окружения"""
+    return {
+        'enabled': os.getenv('METRICS_ENABLED', '1') not in ('0', 'false', 'no'),
+    }
+
+
+def multiprocess_dir():
+    """Каталог значений воркеров или None (один процесс)"""
+    return os.getenv('PROMETHEUS_MULTIPROC_DIR') or None
+
+
+class Metrics:
+    """
+    Метрики процесса.
+
+    - enabled: False (или нет prometheus_client) - методы записи ничего не делают
+    Метрики регистрируются в собственном реестре, поэтому несколько экземпляров
+    в одном процессе не конфликтуют.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled and prometheus_client is not None
+        if not self.enabled:
+            return
+
+        from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+        self.registry = CollectorRegistry(auto_describe=True)
+        registry = self.registry
+
+        self.requests = Counter(
+            f'{PREFIX}_http_requests_total', 'HTTP requests',
+            ['method', 'route', 'status'], registry=registry)
+        self.request_time = Histogram(
+            f'{PREFIX}_http_request_duration_seconds', 'HTTP request duration including streamed body',
+            ['method', 'route'], buckets=HTTP_BUCKETS, registry=registry)
+        self.errors = Counter(
+            f'{PREFIX}_http_errors_total', 'HTTP responses with status 5xx',
+            ['method', 'route'], registry=registry)
+        self.in_flight = Gauge(
+            f'{PREFIX}_http_requests_in_flight', 'Requests being processed',
+            registry=registry, multiprocess_mode='livesum')
+
+        self.query_time = Histogram(
+            f'{PREFIX}_db_query_duration_seconds', 'Database query time (without waiting for a connection)',
+            ['query'], buckets=DB_BUCKETS, registry=registry)
+        self.query_errors = Counter(
+            f'{PREFIX}_db_query_errors_total', 'Failed database queries',
+            ['query'], registry=registry)
+
+        self.acquire_time = Histogram(
+            f'{PREFIX}_db_pool_acquire_seconds', 'Wait for a pooled connection',
+            ['pool'], buckets=POOL_BUCKETS, registry=registry)
+        self.acquire_timeouts = Counter(
+            f'{PREFIX}_db_pool_timeouts_total', 'No free pooled connection in time',
+            ['pool'], registry=registry)
+        self.connect_time = Histogram(
+            f'{PREFIX}_db_connect_seconds', 'Opening a new database connection',
+            ['pool'], buckets=POOL_BUCKETS, registry=registry)
+
+    # ------------------------------------------------------------------
+    # Запись
+    # ------------------------------------------------------------------
+
+    def request_started(self):
+        if self.enabled:
+            self.in_flight.inc()
+
+    def request_finished(self, method, route, status, seconds):
+        if not self.enabled:
+            return
+        self.in_flight.dec()
+        self.requests.labels(method, route, str(status)).inc()
+        self.request_time.labels(method, route).observe(seconds)
+        if status >= 500:
+            self.errors.labels(method, route).inc()
+
+    def observe_query(self, name, seconds, error=False):
+        if not self.enabled:
+            return
+        self.query_time.labels(name).observe(seconds)
+        if error:
+            self.query_errors.labels(name).inc()
+
+    @contextmanager
+    def query_timer(self, name):
+        """Время запроса name на блок with (исключение считается ошибкой запроса)"""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe_query(name, time.perf_counter() - started, error=True)
+            raise
+        self.observe_query(name, time.perf_counter() - started)
+
+    def instrument_pool(self, pool, name):
+        """Ожидание и открытие соединений ConnectionPool (db_pool.py) под именем name"""
+        if not self.enabled:
+            return
+        pool.on_checkout = self.acquire_time.labels(name).observe
+        pool.on_connect = self.connect_time.labels(name).observe
+        pool.on_timeout = self.acquire_timeouts.labels(name).inc
+
+    # ------------------------------------------------------------------
+    # Чтение
+    # ------------------------------------------------------------------
+
+    def render(self):
+        """Тело ответа /api/metrics и его Content-Type (со всех воркеров)"""
+        if not self.enabled:
+            return None, None
+        registry = self.registry
+        if multiprocess_dir():
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+# ============================================================================
+# ПОДКЛЮЧЕНИЕ
+# ============================================================================
+
+def init_app(app, metrics):
+    """
+    Метрики запросов приложения Flask.
+
+    Время и статус записываются при закрытии ответа, поэтому у потоковых
+    ответов (stream_query) учитывается и передача тела.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        metrics.request_started()
+
+    @app.after_request
+    def finish_request_metrics(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            method = request.method
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            status = response.status_code
+            response.call_on_close(
+                lambda: metrics.request_finished(method, route, status, time.perf_counter() - started)
+            )
+        return response
+
+    @app.teardown_request
+    def abort_request_metrics(exc=None):
+        # after_request не вызывался (ошибка при формировании ответа)
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.request_finished(request.method, route, 500, time.perf_counter() - started)
+
+    app.extensions['metrics'] = metrics
+    return metrics
+
+
+class MetricsMiddleware:
+    """ASGI-middleware метрик запросов (маршруты в формате Flask: /api/strategies/<strategy_id>)"""
+
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        self.metrics.request_started()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            path = route.path.replace('{', '<').replace('}', '>') if route is not None else 'unmatched'
+            self.metrics.request_finished(scope['method'], path, status, time.perf_counter() - started)
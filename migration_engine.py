@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Импорт экспорта Supabase (supabase-export.js) в PostgreSQL на Timeweb
+Файл разбирается потоково, строки грузятся через COPY во временные таблицы
+и переносятся в users/strategies/analyses одним INSERT ... ON CONFLICT DO NOTHING
+
+Запуск из командной строки:
+    python3 migration_engine.py supabase-export-2025-10-28.json
+    python3 migration_engine.py export.json --dry-run
+"""
+
+import argparse
+import codecs
+import io
+import json
+import os
+import sys
+import time
+
+import psycopg2
+
+# Сколько строк отправлять одним COPY
+MIGRATE_BATCH_SIZE = int(os.getenv('MIGRATE_BATCH_SIZE', '5000'))
+
+# Сколько байт читать из файла/запроса за раз
+READ_CHUNK_SIZE = 64 * 1024
+
+# Максимальный размер одного объекта экспорта (защита от некорректного файла)
+MAX_VALUE_SIZE = 16 * 1024 * 1024
+
+# Колонки, которые берутся из экспорта (порядок = порядок в COPY).
+# Таблицы переносятся в этом порядке из-за внешних ключей.
+TABLE_COLUMNS = {
+    'users': ['id', 'telegram_id', 'username', 'first_name', 'last_name', 'created_at', 'updated_at'],
+    'strategies': ['id', 'user_id', 'name', 'description', 'fields', 'is_public', 'created_at', 'updated_at'],
+    'analyses': ['id', 'user_id', 'strategy_id', 'coin', 'answers', 'positive_factors',
+                 'negative_factors', 'neutral_factors', 'recommendation', 'created_at'],
+}
+
+# Перенос из временных таблиц. user_id стратегий и анализов сопоставляется
+# через telegram_id: если пользователь уже был в базе под другим id, строки
+# привязываются к существующему. Строки без пользователя пропускаются,
+# ссылка на отсутствующую стратегию обнуляется (как ON DELETE SET NULL).
+MERGE_SQL = {
+    'users': """
+        INSERT INTO users (id, telegram_id, username, first_name, last_name, created_at, updated_at)
+        SELECT id, telegram_id, username, first_name, last_name,
+               COALESCE(created_at, NOW()), COALESCE(updated_at, created_at, NOW())
+        FROM migrate_users
+        WHERE id IS NOT NULL AND telegram_id IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """,
+    'strategies': """
+        INSERT INTO strategies (id, user_id, telegram_user_id, name, description, fields,
+                                is_public, created_at, updated_at)
+        SELECT s.id, COALESCE(by_tg.id, by_id.id), COALESCE(by_tg.telegram_id, by_id.telegram_id),
+               s.name, s.description, s.fields, COALESCE(s.is_public, FALSE),
+               COALESCE(s.created_at, NOW()), COALESCE(s.updated_at, s.created_at, NOW())
+        FROM migrate_strategies s
+        LEFT JOIN (SELECT DISTINCT id, telegram_id FROM migrate_users) mu ON mu.id = s.user_id
+        LEFT JOIN users by_tg ON by_tg.telegram_id = mu.telegram_id
+        LEFT JOIN users by_id ON by_id.id = s.user_id
+        WHERE s.id IS NOT NULL AND s.name IS NOT NULL
+          AND COALESCE(by_tg.id, by_id.id) IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """,
+    'analyses': """
+        INSERT INTO analyses (id, user_id, telegram_user_id, strategy_id, coin, answers,
+                              positive_factors, negative_factors, neutral_factors,
+                              recommendation, created_at)
+        SELECT a.id, COALESCE(by_tg.id, by_id.id), COALESCE(by_tg.telegram_id, by_id.telegram_id),
+               st.id, a.coin, a.answers,
+               a.positive_factors, a.negative_factors, a.neutral_factors,
+               a.recommendation, COALESCE(a.created_at, NOW())
+        FROM migrate_analyses a
+        LEFT JOIN (SELECT DISTINCT id, telegram_id FROM migrate_users) mu ON mu.id = a.user_id
+        LEFT JOIN users by_tg ON by_tg.telegram_id = mu.telegram_id
+        LEFT JOIN users by_id ON by_id.id = a.user_id
+        LEFT JOIN strategies st ON st.id = a.strategy_id
+        WHERE a.id IS NOT NULL
+          AND COALESCE(by_tg.id, by_id.id) IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """,
+}
+
+
+class MigrationError(Exception):
+    """Некорректный файл экспорта"""
+
+
+# ============================================================================
+# ПОТОКОВЫЙ РАЗБОР JSON
+# ============================================================================
+
+def iter_export(chunks, tables=TABLE_COLUMNS, seen=None):
+    """
+    Потоковый разбор экспорта {"users": [...], "strategies": [...], ...}.
+
+    chunks - итератор строк (куски файла). Отдает пары (таблица, объект)
+    по мере чтения; в памяти держится только текущий кусок и один объект.
+    Остальные ключи (exportDate, version) отдаются как ('meta', {key: value}).
+    В seen (если передан) добавляются встреченные ключи таблиц.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    eof = False
+
+    def more():
+        # Дочитывает следующий кусок; False - данных больше нет
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        for chunk in chunks:
+            if chunk:
+                buf = buf[pos:] + chunk
+                pos = 0
+                return True
+        eof = True
+        return False
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buf) or not more():
+                return
+
+    def peek():
+        skip_ws()
+        if pos >= len(buf):
+            raise MigrationError('Unexpected end of export file')
+        return buf[pos]
+
+    def expect(char):
+        nonlocal pos
+        if peek() != char:
+            raise MigrationError(f"Expected '{char}' at offset {pos}, got '{buf[pos]}'")
+        pos += 1
+
+    def value():
+        # Разбор одного значения; если оно обрезано концом куска - дочитываем
+        nonlocal pos
+        skip_ws()
+        while True:
+            if len(buf) - pos > MAX_VALUE_SIZE:
+                raise MigrationError(f'Export value at offset {pos} is larger than {MAX_VALUE_SIZE} bytes')
+            try:
+                result, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if more():
+                    continue
+                raise MigrationError(f'Invalid JSON in export file: {e}') from e
+            # Число или литерал у конца куска может продолжаться в следующем
+            # ("12" + "3.5"), поэтому такие значения разбираем после дочитывания
+            if len(buf) - end < 32 and more():
+                continue
+            pos = end
+            return result
+
+    expect('{')
+    if peek() == '}':
+        return
+    while True:
+        key = value()
+        if not isinstance(key, str):
+            raise MigrationError('Invalid JSON in export file: object key expected')
+        expect(':')
+
+        if key in tables and peek() == '[':
+            if seen is not None:
+                seen.add(key)
+            pos += 1
+            if peek() == ']':
+                pos += 1
+            else:
+                while True:
+                    item = value()
+                    if isinstance(item, dict):
+                        yield key, item
+                    if peek() == ',':
+                        pos += 1
+                        continue
+                    expect(']')
+                    break
+        else:
+            yield 'meta', {key: value()}
+
+        if peek() == ',':
+            pos += 1
+            continue
+        expect('}')
+        return
+
+
+def iter_text_chunks(stream, chunk_size=READ_CHUNK_SIZE):
+    """Куски текста из бинарного потока (файл, request.stream) с корректной обработкой UTF-8"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                yield tail
+            return
+        yield decoder.decode(data)
+
+
+# ============================================================================
+# ЗАГРУЗКА
+# ============================================================================
+
+def copy_value(value):
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    else:
+        value = str(value)
+    return (value.replace('\\', '\\\\')
+                 .replace('\t', '\\t')
+                 .replace('\n', '\\n')
+                 .replace('\r', '\\r'))
+
+
+class MigrationEngine:
+    """
+    Импорт экспорта на одном соединении в одной транзакции.
+
+    run() разбирает поток, складывает строки пачками по batch_size через COPY
+    во временные таблицы migrate_*, затем переносит их в рабочие таблицы
+    и делает COMMIT (или ROLLBACK при dry_run). progress(stats) вызывается
+    после каждой пачки и после переноса каждой таблицы.
+    """
+
+    def __init__(self, conn, batch_size=None, progress=None, tables=TABLE_COLUMNS):
+        self.conn = conn
+        self.batch_size = batch_size or MIGRATE_BATCH_SIZE
+        self.progress = progress or print_progress
+        self.tables = tables
+        self.meta = {}
+        self.stats = {
+            'bytes': 0,
+            'elapsed': 0.0,
+            'staged': {table: 0 for table in tables},
+            'migrated': {table: 0 for table in tables},
+            'skipped': {table: 0 for table in tables},
+        }
+        self._pending = {table: [] for table in tables}
+        self._seen = set()
+        self._started = None
+
+    def run(self, chunks, dry_run=False):
+        """Полный импорт. Возвращает stats"""
+        self._started = time.monotonic()
+        try:
+            with self.conn.cursor() as cur:
+                self._create_staging(cur)
+
+                for table, item in iter_export(self._count_bytes(chunks), self.tables, self._seen):
+                    if table == 'meta':
+                        self.meta.update(item)
+                        continue
+                    pending = self._pending[table]
+                    pending.append(item)
+                    if len(pending) >= self.batch_size:
+                        self._copy(cur, table)
+
+                for table in self.tables:
+                    self._copy(cur, table)
+
+                if 'users' not in self._seen:
+                    raise MigrationError('Invalid migration data')
+
+                for table in self.tables:
+                    cur.execute(f"ANALYZE migrate_{table}")
+                    cur.execute(MERGE_SQL[table])
+                    self.stats['migrated'][table] = cur.rowcount
+                    self.stats['skipped'][table] = self.stats['staged'][table] - cur.rowcount
+                    self._report('merged', table)
+
+            if dry_run:
+                self.conn.rollback()
+            else:
+                self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        self.stats['elapsed'] = round(time.monotonic() - self._started, 3)
+        return self.stats
+
+    # ------------------------------------------------------------------
+    # Внутренние методы
+    # ------------------------------------------------------------------
+
+    def _count_bytes(self, chunks):
+        for chunk in chunks:
+            self.stats['bytes'] += len(chunk)
+            yield chunk
+
+    def _create_staging(self, cur):
+        # Типы колонок берутся из рабочих таблиц, ограничения (NOT NULL, ключи) - нет
+        for table, columns in self.tables.items():
+            cur.execute(
+                f"CREATE TEMP TABLE migrate_{table} ON COMMIT DROP AS "
+                f"SELECT {', '.join(columns)} FROM {table} WITH NO DATA"
+            )
+
+    def _copy(self, cur, table):
+        pending = self._pending[table]
+        if not pending:
+            return
+        columns = self.tables[table]
+        buf = io.BytesIO()
+        for item in pending:
+            line = '\t'.join(copy_value(item.get(column)) for column in columns) + '\n'
+            buf.write(line.encode('utf-8'))
+        buf.seek(0)
+        # Данные передаются байтами в UTF-8 независимо от client_encoding соединения
+        cur.copy_expert(
+            f"COPY migrate_{table} ({', '.join(columns)}) FROM STDIN WITH (ENCODING 'UTF8')", buf
+        )
+        self.stats['staged'][table] += len(pending)
+        pending.clear()
+        self._report('staged', table)
+
+    def _report(self, phase, table):
+        elapsed = time.monotonic() - self._started
+        staged = sum(self.stats['staged'].values())
+        self.progress({
+            'phase': phase,
+            'table': table,
+            'staged': dict(self.stats['staged']),
+            'migrated': dict(self.stats['migrated']),
+            'bytes': self.stats['bytes'],
+            'elapsed': round(elapsed, 3),
+            'rows_per_sec': round(staged / elapsed) if elapsed > 0 else 0,
+            'mb_per_sec': round(self.stats['bytes'] / 1048576 / elapsed, 2) if elapsed > 0 else 0,
+        })
+
+
+def print_progress(progress):
+    """Вывод прогресса в лог"""
+    table = progress['table']
+    if progress['phase'] == 'staged':
+        print(f"[migrate] {table}: {progress['staged'][table]} rows staged, "
+              f"{progress['bytes'] / 1048576:.1f} MB read, "
+              f"{progress['rows_per_sec']} rows/s ({progress['mb_per_sec']} MB/s)")
+    else:
+        print(f"[migrate] {table}: {progress['migrated'][table]} of "
+              f"{progress['staged'][table]} rows migrated ({progress['elapsed']}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Импорт экспорта Supabase в PostgreSQL')
+    parser.add_argument('dump', help='JSON файл экспорта (supabase-export.js), "-" - stdin')
+    parser.add_argument('--batch-size', type=int, default=None, help='строк в одном COPY')
+    parser.add_argument('--dry-run', action='store_true', help='загрузить и откатить транзакцию')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        port=os.getenv('DB_PORT', '5432'),
+        database=os.getenv('DB_NAME', 'tradeanalyzer'),
+        user=os.getenv('DB_USER', 'tradeanalyzer_app'),
+        password=os.getenv('DB_PASSWORD', 'SECURE_PASSWORD_HERE')
+    )
+    stream = sys.stdin.buffer if args.dump == '-' else open(args.dump, 'rb')
+    try:
+        engine = MigrationEngine(conn, batch_size=args.batch_size)
+        stats = engine.run(iter_text_chunks(stream), dry_run=args.dry_run)
+    except MigrationError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        stream.close()
+        conn.close()
+
+    print(f"{'🧪 Dry run' if args.dry_run else '✅ Migration complete'}: "
+          f"{json.dumps(stats['migrated'])} in {stats['elapsed']}s")
+
+
+if __name__ == '__main__':
+    main()
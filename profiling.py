@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+Журнал медленных запросов и профилирование отдельных запросов API
+Общий для timeweb_api_simple.py (init_app) и timeweb_api_async.py (ProfilingMiddleware)
+
+- запрос к БД дольше SLOW_QUERY_MS пишется в лог с отпечатком SQL
+  (литералы и параметры заменены на ?, значения параметров не выводятся)
+- запрос API дольше SLOW_REQUEST_MS пишется в лог с разбивкой по фазам:
+  ожидание пула, подключение к БД, запросы, ensure_user, JSON, сжатие
+- заголовок X-Profile: <PROFILE_TOKEN> (или ?profile=<PROFILE_TOKEN>) включает
+  семплирующий профилировщик только для этого запроса; ответ получает
+  Server-Timing и X-Profile-Id, профиль - GET /api/admin/profiles/<id>
+
+Фазы считаются "чистым" временем: время вложенной фазы (запрос внутри
+ensure_user) не входит в родительскую.
+"""
+
+import collections
+import hashlib
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import lru_cache
+from urllib.parse import parse_qs
+
+
+def slow_log_config_from_env():
+    """Пороги журнала медленных запросов из переменных окружения"""
+    return {
+        'slow_query_ms': float(os.getenv('SLOW_QUERY_MS', '200')),
+        'slow_request_ms': float(os.getenv('SLOW_REQUEST_MS', '1000')),
+    }
+
+
+def profiler_config_from_env():
+    """Параметры профилировщика из переменных окружения"""
+    return {
+        'token': os.getenv('PROFILE_TOKEN') or None,
+        'directory': os.getenv('PROFILE_DIR') or None,
+        'interval_ms': float(os.getenv('PROFILE_INTERVAL_MS', '5')),
+    }
+
+
+# ============================================================================
+# ОТПЕЧАТКИ SQL
+# ============================================================================
+
+_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDERS = re.compile(r'%s|%\(\w+\)s|\$\d+')
+_NUMBERS = re.compile(r'(?<![\w$.])-?\d+(?:\.\d+)?\b')
+_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """
+    Отпечаток SQL: (id, текст) - литералы и параметры заменены на ?,
+    списки (?, ?, ?) свернуты, пробелы схлопнуты. Одинаковые запросы с
+    разными значениями дают один отпечаток.
+    """
+    text = _COMMENTS.sub(' ', sql)
+    text = _STRINGS.sub('?', text)
+    text = _PLACEHOLDERS.sub('?', text)
+    text = _NUMBERS.sub('?', text)
+    text = _LISTS.sub('(...)', text)
+    text = _SPACES.sub(' ', text).strip()
+    return hashlib.md5(text.encode()).hexdigest()[:8], text
+
+
+def redact(params):
+    """Параметры запроса без значений: только типы ([str, int, None])"""
+    if params is None:
+        return '[]'
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{key}: {_type_name(value)}' for key, value in params.items()) + '}'
+    return '[' + ', '.join(_type_name(value) for value in params) + ']'
+
+
+def _type_name(value):
+    if value is None:
+        return 'None'
+    if isinstance(value, (list, tuple)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+# ============================================================================
+# ФАЗЫ ЗАПРОСА
+# ============================================================================
+
+class RequestTimings:
+    """Время запроса API по фазам (чистое время, без вложенных фаз)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.queries = 0
+        self.connect_pending = 0.0
+        self._nested = [0.0]
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.add(name, elapsed - self._nested.pop())
+
+    def add(self, name, seconds):
+        """Время, измеренное снаружи (ожидание пула); вычитается из текущей фазы"""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        self._nested[-1] += seconds
+
+    def breakdown(self, total=None):
+        """Фазы в миллисекундах, остаток - other"""
+        if total is None:
+            total = time.perf_counter() - self.started
+        result = {name: round(seconds * 1000, 2) for name, seconds in self.phases.items()}
+        result['other'] = round(max(0.0, total - sum(self.phases.values())) * 1000, 2)
+        result['total'] = round(total * 1000, 2)
+        return result
+
+    def server_timing(self, total=None):
+        """Значение заголовка Server-Timing"""
+        return ', '.join(f'{name};dur={ms}' for name, ms in self.breakdown(total).items())
+
+
+_current = ContextVar('request_timings', default=None)
+
+
+def begin_request():
+    """Новый учет фаз для текущего запроса (поток Flask или задача asyncio)"""
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def end_request():
+    _current.set(None)
+
+
+def current_timings():
+    return _current.get()
+
+
+def phase(name):
+    """Учет блока with как фазы name текущего запроса (вне запроса - ничего)"""
+    timings = _current.get()
+    if timings is None:
+        return nullcontext()
+    return timings.phase(name)
+
+
+def _on_connect(seconds):
+    timings = _current.get()
+    if timings is not None:
+        timings.add('connect', seconds)
+        timings.connect_pending += seconds
+
+
+def _on_checkout(waited):
+    # waited включает подключение нового соединения - оно уже учтено в connect
+    timings = _current.get()
+    if timings is not None:
+        timings.add('pool_wait', max(0.0, waited - timings.connect_pending))
+        timings.connect_pending = 0.0
+
+
+def _chain(first, second):
+    if first is None:
+        return second
+
+    def hook(*args):
+        first(*args)
+        second(*args)
+    return hook
+
+
+def instrument_pool(pool):
+    """Фазы pool_wait и connect из хуков ConnectionPool (db_pool.py); хуки метрик сохраняются"""
+    pool.on_connect = _chain(pool.on_connect, _on_connect)
+    pool.on_checkout = _chain(pool.on_checkout, _on_checkout)
+
+
+# ============================================================================
+# ЖУРНАЛ МЕДЛЕННЫХ ЗАПРОСОВ
+# ============================================================================
+
+class SlowLog:
+    """
+    Журнал медленных запросов к БД и запросов API.
+
+    - slow_query_ms / slow_request_ms: порог в мс (0 - не писать)
+    - keep: сколько последних записей хранить для /api/admin/slow_queries
+    """
+
+    def __init__(self, slow_query_ms=200, slow_request_ms=1000, keep=100):
+        self.slow_query = slow_query_ms / 1000
+        self.slow_request = slow_request_ms / 1000
+        self._lock = threading.Lock()
+        self._recent = collections.deque(maxlen=keep)
+        self._by_fingerprint = {}
+        self._counters = {'slow_queries': 0, 'slow_requests': 0}
+
+    @contextmanager
+    def query(self, name, sql=None, params=None):
+        """Запрос name к БД на блок with: фаза query и запись в журнал, если он медленный"""
+        timings = _current.get()
+        started = time.perf_counter()
+        failed = False
+        try:
+            with timings.phase('query') if timings is not None else nullcontext():
+                yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            if timings is not None:
+                timings.queries += 1
+            if self.slow_query and elapsed >= self.slow_query:
+                self._log_query(name, sql, params, elapsed, failed)
+
+    def request_finished(self, method, route, status, seconds, timings=None):
+        """Запись запроса API, если он медленный"""
+        if not self.slow_request or seconds < self.slow_request:
+            return
+        breakdown = timings.breakdown(seconds) if timings is not None else {'total': round(seconds * 1000, 2)}
+        queries = timings.queries if timings is not None else 0
+        phases = ' '.join(f'{name}={ms}' for name, ms in breakdown.items() if name != 'total')
+        print(f"[slow_request] {breakdown['total']}ms {method} {route} {status} queries={queries} {phases}")
+        with self._lock:
+            self._counters['slow_requests'] += 1
+            self._recent.append({
+                'kind': 'request', 'at': time.time(), 'method': method, 'route': route,
+                'status': status, 'queries': queries, 'ms': breakdown,
+            })
+
+    def _log_query(self, name, sql, params, elapsed, failed):
+        ms = round(elapsed * 1000, 2)
+        fp, text = fingerprint(sql) if sql else ('-', '')
+        print(f"[slow_query] {ms}ms {name} fp={fp} params={redact(params)}"
+              f"{' failed' if failed else ''} {text[:500]}")
+        with self._lock:
+            self._counters['slow_queries'] += 1
+            self._recent.append({
+                'kind': 'query', 'at': time.time(), 'name': name, 'fingerprint': fp,
+                'sql': text, 'params': redact(params), 'ms': ms, 'failed': failed,
+            })
+            entry = self._by_fingerprint.setdefault((name, fp), {
+                'name': name, 'fingerprint': fp, 'sql': text, 'count': 0, 'time_total': 0.0, 'time_max': 0.0,
+            })
+            entry['count'] += 1
+            entry['time_total'] += elapsed
+            entry['time_max'] = max(entry['time_max'], elapsed)
+
+    def stats(self):
+        """Счетчики, медленные запросы по отпечаткам (самые затратные первыми) и последние записи"""
+        with self._lock:
+            recent = list(self._recent)
+            queries = [dict(entry) for entry in self._by_fingerprint.values()]
+            counters = dict(self._counters)
+        for entry in queries:
+            entry['time_total'] = round(entry['time_total'], 6)
+            entry['time_max'] = round(entry['time_max'], 6)
+        queries.sort(key=lambda entry: entry['time_total'], reverse=True)
+        return dict(counters, slow_query_ms=self.slow_query * 1000, slow_request_ms=self.slow_request * 1000,
+                    queries=queries, recent=recent[::-1])
+
+
+# ============================================================================
+# ПРОФИЛИРОВАНИЕ
+# ============================================================================
+
+class SamplingProfiler:
+    """
+    Семплирующий профилировщик одного потока: фоновый поток раз в interval
+    секунд снимает стек (sys._current_frames). Профилируемый код не
+    инструментируется, поэтому накладные расходы - только на время профиля.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.count = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            self.samples[tuple(reversed(stack))] += 1
+            self.count += 1
+
+    def folded(self):
+        """Стеки в формате collapsed (flamegraph.pl, speedscope)"""
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+    def top(self, limit=25):
+        """Функции по числу семплов: total - в стеке, self - на вершине стека"""
+        total = collections.Counter()
+        own = collections.Counter()
+        for stack, count in self.samples.items():
+            for function in set(stack):
+                total[function] += count
+            own[stack[-1]] += count
+        return [
+            {'function': function, 'total': count, 'self': own[function],
+             'percent': round(count * 100 / self.count, 1)}
+            for function, count in total.most_common(limit)
+        ]
+
+
+class RequestProfiler:
+    """
+    Профили запросов по запросу администратора.
+
+    - token: значение X-Profile / ?profile= (без токена профилирование выключено)
+    - directory: каталог для профилей в формате collapsed ({id}.folded)
+    - keep: сколько последних профилей хранить в памяти воркера
+    """
+
+    def __init__(self, token=None, directory=None, interval_ms=5, keep=20):
+        self.token = token
+        self.directory = directory
+        self.interval = interval_ms / 1000
+        self._lock = threading.Lock()
+        self._profiles = collections.OrderedDict()
+        self._keep = keep
+
+    @property
+    def enabled(self):
+        return self.token is not None
+
+    def requested(self, value):
+        """Запрошено ли профилирование (значение заголовка или параметра)"""
+        return self.enabled and bool(value) and hmac.compare_digest(value.encode(), self.token.encode())
+
+    def start(self):
+        """Начало профиля текущего потока: (id, профилировщик)"""
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        return profile_id, SamplingProfiler(threading.get_ident(), self.interval).start()
+
+    def finish(self, profile_id, sampler, timings, method, route, status):
+        """Остановка профиля и сохранение (в памяти и в directory)"""
+        sampler.stop()
+        total = time.perf_counter() - timings.started
+        profile = {
+            'id': profile_id, 'at': time.time(), 'method': method, 'route': route, 'status': status,
+            'samples': sampler.count, 'interval_ms': self.interval * 1000,
+            'phases_ms': timings.breakdown(total), 'queries': timings.queries,
+            'top': sampler.top(), 'folded': sampler.folded(),
+        }
+        with self._lock:
+            self._profiles[profile_id] = profile
+            while len(self._profiles) > self._keep:
+                self._profiles.popitem(last=False)
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(os.path.join(self.directory, f'{profile_id}.folded'), 'w') as f:
+                    f.write(profile['folded'])
+            except OSError as e:
+                print(f"[profiling] failed to save profile {profile_id}: {e}")
+        print(f"[profiling] {profile_id} {method} {route} {status} "
+              f"{profile['phases_ms']['total']}ms samples={sampler.count}")
+        return profile
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self):
+        """Сохраненные профили без стеков, последние первыми"""
+        with self._lock:
+            profiles = list(self._profiles.values())
+        keys = ('id', 'at', 'method', 'route', 'status', 'samples', 'phases_ms', 'queries')
+        return [{key: profile[key] for key in keys} for profile in reversed(profiles)]
+
+
+# ============================================================================
+# ПОДКЛЮЧЕНИЕ
+# ============================================================================
+
+def init_app(app, slow_log, profiler):
+    """
+    Учет фаз, журнал медленных запросов и профилирование для приложения Flask.
+
+    Медленный запрос определяется при закрытии ответа (с передачей тела),
+    профиль останавливается там же.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def start_request_timings():
+        g.timings = begin_request()
+        if profiler.requested(request.headers.get('X-Profile') or request.args.get('profile')):
+            g.profile = profiler.start()
+
+    @app.after_request
+    def finish_request_timings(response):
+        timings = g.pop('timings', None)
+        if timings is None:
+            return response
+        method = request.method
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        status = response.status_code
+        profile = g.pop('profile', None)
+        if profile is not None:
+            response.headers['Server-Timing'] = timings.server_timing()
+            response.headers['X-Profile-Id'] = profile[0]
+
+        def finish():
+            slow_log.request_finished(method, route, status, time.perf_counter() - timings.started, timings)
+            if profile is not None:
+                profiler.finish(*profile, timings, method, route, status)
+
+        response.call_on_close(finish)
+        return response
+
+    @app.teardown_request
+    def abort_request_timings(exc=None):
+        # after_request не вызывался - останавливаем профиль
+        profile = g.pop('profile', None)
+        timings = g.pop('timings', None)
+        if profile is not None and timings is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            profiler.finish(*profile, timings, request.method, route, 500)
+        end_request()
+
+    app.extensions['slow_log'] = slow_log
+    app.extensions['profiler'] = profiler
+    return slow_log
+
+
+class ProfilingMiddleware:
+    """
+    ASGI-middleware учета фаз, журнала медленных запросов и профилирования.
+
+    Профилировщик семплирует поток цикла событий, поэтому в профиль попадают
+    и другие запросы, выполнявшиеся в это время.
+    """
+
+    def __init__(self, app, slow_log, profiler):
+        self.app = app
+        self.slow_log = slow_log
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timings = begin_request()
+        status = 500
+        profile = None
+        if self.profiler.enabled:
+            headers = dict(scope.get('headers') or ())
+            value = headers.get(b'x-profile', b'').decode('latin-1')
+            if not value:
+                value = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('profile', [''])[0]
+            if self.profiler.requested(value):
+                profile = self.profiler.start()
+
+        async def send_with_timings(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if profile is not None:
+                    message['headers'] = list(message.get('headers', [])) + [
+                        (b'server-timing', timings.server_timing().encode()),
+                        (b'x-profile-id', profile[0].encode()),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            route = scope.get('route')
+            path = route.path.replace('{', '<').replace('}', '>') if route is not None else 'unmatched'
+            self.slow_log.request_finished(scope['method'], path, status,
+                                           time.perf_counter() - timings.started, timings)
+            if profile is not None:
+                self.profiler.finish(*profile, timings, scope['method'], path, status)
+            end_request()
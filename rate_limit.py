@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Ограничение частоты запросов и сброс нагрузки перед обработчиками API
+
+Запрос проходит три проверки (все - в памяти воркера, без БД):
+
+1. корзина токенов клиента (telegram_user_id, без него - IP) для класса
+   эндпоинта: read - дешевые чтения, write - запись, admin - тяжелые админ-запросы;
+   превышение - 429 с Retry-After
+2. общая корзина класса на воркер - защищает БД от суммы клиентов
+   (и от подмены telegram_user_id); превышение - 503 с Retry-After
+3. число одновременно выполняемых обработчиков с запросами к БД (не больше
+   размера пула): свободного места нет дольше RATE_LIMIT_QUEUE_TIMEOUT - 503
+
+Лимиты на воркер: при N воркерах gunicorn общий бюджет в N раз больше.
+Бюджет задается как 'запросов в секунду:размер корзины', 0 - без ограничения.
+"""
+
+import asyncio
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+READ = 'read'
+WRITE = 'write'
+ADMIN = 'admin'
+EXEMPT = 'exempt'
+
+TOO_MANY_REQUESTS = 'Too many requests'
+SERVER_BUSY = 'Server is busy, retry later'
+
+
+def parse_budget(value):
+    """'rate:burst' -> (rate, burst); без burst корзина - на секунду запросов"""
+    rate, _, burst = value.partition(':')
+    rate = float(rate)
+    return rate, float(burst) if burst else max(rate, 1.0)
+
+
+def rate_limit_config_from_env():
+    """Параметры ограничения запросов из переменных окружения"""
+    return {
+        'enabled': os.getenv('RATE_LIMIT_ENABLED', '1') not in ('0', 'false', 'no'),
+        'user_budgets': {
+            READ: parse_budget(os.getenv('RATE_LIMIT_USER_READ', '20:40')),
+            WRITE: parse_budget(os.getenv('RATE_LIMIT_USER_WRITE', '5:20')),
+            ADMIN: parse_budget(os.getenv('RATE_LIMIT_USER_ADMIN', '1:5')),
+        },
+        'global_budgets': {
+            READ: parse_budget(os.getenv('RATE_LIMIT_GLOBAL_READ', '500:1000')),
+            WRITE: parse_budget(os.getenv('RATE_LIMIT_GLOBAL_WRITE', '200:400')),
+            ADMIN: parse_budget(os.getenv('RATE_LIMIT_GLOBAL_ADMIN', '5:10')),
+        },
+        # По умолчанию - размер пула: лишние запросы не ждут соединение DB_POOL_TIMEOUT
+        'max_concurrent': int(os.getenv('RATE_LIMIT_MAX_CONCURRENT', os.getenv('DB_POOL_MAX_SIZE', '10'))),
+        'queue_timeout': float(os.getenv('RATE_LIMIT_QUEUE_TIMEOUT', '0.1')),
+        'max_keys': int(os.getenv('RATE_LIMIT_MAX_KEYS', '10000')),
+        # За nginx адрес клиента - в X-Real-IP (см. SETUP_TIMEWEB_API.md)
+        'trust_proxy': os.getenv('RATE_LIMIT_TRUST_PROXY', '1') not in ('0', 'false', 'no'),
+    }
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше burst (без блокировок)"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def take(self, now):
+        """0.0 - токен взят, иначе через сколько секунд он появится"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def give_back(self):
+        """Вернуть токен (запрос отклонен следующей проверкой)"""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class RateLimiter:
+    """
+    Допуск запросов к обработчикам (синхронный API, потоки gunicorn).
+
+    - classes: эндпоинт -> класс (read/write/admin/exempt), остальные
+      по методу: GET/HEAD - read, иначе write
+    - no_db: эндпоинты без запросов к БД - не занимают место в max_concurrent
+    - user_budgets/global_budgets: класс -> (rate, burst) на клиента и на воркер
+    - max_concurrent: обработчиков с запросами к БД одновременно (0 - без ограничения)
+    - queue_timeout: сколько ждать свободного места, сек
+    - max_keys: корзин клиентов в памяти (вытесняются давно не обращавшиеся)
+    - trust_proxy: IP клиента из X-Real-IP
+    """
+
+    def __init__(self, classes=None, no_db=(), enabled=True, user_budgets=None, global_budgets=None,
+                 max_concurrent=10, queue_timeout=0.1, max_keys=10000, trust_proxy=True):
+        self.classes = dict(classes or {})
+        self.no_db = frozenset(no_db)
+        self.enabled = enabled
+        self.user_budgets = {name: budget for name, budget in (user_budgets or {}).items() if budget[0] > 0}
+        self.global_budgets = {name: budget for name, budget in (global_budgets or {}).items() if budget[0] > 0}
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.max_keys = max_keys
+        self.trust_proxy = trust_proxy
+
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # (класс, клиент) -> TokenBucket, по давности обращения
+        self._global = {name: TokenBucket(*budget) for name, budget in self.global_budgets.items()}
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+        self._in_flight = 0
+        self._counters = {name: {'allowed': 0, 'limited_user': 0, 'limited_global': 0}
+                          for name in (READ, WRITE, ADMIN)}
+        self._counters['concurrency'] = {'admitted': 0, 'shed': 0}
+
+    def rate_class(self, endpoint, method):
+        if endpoint in self.classes:
+            return self.classes[endpoint]
+        return READ if method in ('GET', 'HEAD') else WRITE
+
+    def client_key(self, telegram_id, remote_addr, real_ip=None):
+        """Клиент для корзины: пользователь Telegram, иначе адрес"""
+        if telegram_id:
+            return f'tg:{telegram_id}'
+        if self.trust_proxy and real_ip:
+            return f'ip:{real_ip}'
+        return f'ip:{remote_addr}'
+
+    def check(self, rate_class, key):
+        """
+        Корзины клиента и воркера. None - запрос допущен,
+        иначе (status, error, retry_after) для ответа.
+        """
+        if not self.enabled or rate_class == EXEMPT:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            counters = self._counters[rate_class]
+            bucket = None
+            budget = self.user_budgets.get(rate_class)
+            if budget is not None:
+                bucket = self._bucket(rate_class, key, budget, now)
+                wait = bucket.take(now)
+                if wait:
+                    counters['limited_user'] += 1
+                    return 429, TOO_MANY_REQUESTS, wait
+            shared = self._global.get(rate_class)
+            if shared is not None:
+                wait = shared.take(now)
+                if wait:
+                    # Клиент не виноват - его токен не тратится
+                    if bucket is not None:
+                        bucket.give_back()
+                    counters['limited_global'] += 1
+                    return 503, SERVER_BUSY, wait
+            counters['allowed'] += 1
+        return None
+
+    def needs_slot(self, endpoint, rate_class):
+        return (self.enabled and self.max_concurrent > 0 and rate_class != EXEMPT
+                and endpoint not in self.no_db)
+
+    def acquire(self):
+        """Место для обработчика с запросами к БД; False - мест нет (503)"""
+        admitted = self._slots.acquire(timeout=self.queue_timeout)
+        self._count_slot(admitted)
+        return admitted
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._counters.items()}
+            clients = len(self._buckets)
+            in_flight = self._in_flight
+        return {
+            'enabled': self.enabled,
+            'user_budgets': {name: {'rate': rate, 'burst': burst} for name, (rate, burst) in self.user_budgets.items()},
+            'global_budgets': {name: {'rate': rate, 'burst': burst} for name, (rate, burst) in self.global_budgets.items()},
+            'max_concurrent': self.max_concurrent,
+            'in_flight': in_flight,
+            'clients': clients,
+            'counters': counters,
+        }
+
+    def _bucket(self, rate_class, key, budget, now):
+        # Вызывается под self._lock
+        bucket = self._buckets.get((rate_class, key))
+        if bucket is None:
+            bucket = self._buckets[(rate_class, key)] = TokenBucket(*budget, now=now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end((rate_class, key))
+        return bucket
+
+    def _count_slot(self, admitted):
+        with self._lock:
+            if admitted:
+                self._in_flight += 1
+                self._counters['concurrency']['admitted'] += 1
+            else:
+                self._counters['concurrency']['shed'] += 1
+
+
+class AsyncRateLimiter(RateLimiter):
+    """RateLimiter для asyncio (timeweb_api_async.py): места - asyncio.Semaphore"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._slots = asyncio.Semaphore(self.max_concurrent) if self.max_concurrent > 0 else None
+
+    async def acquire(self):
+        admitted = True
+        if self._slots.locked():
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                admitted = False
+        else:
+            await self._slots.acquire()
+        self._count_slot(admitted)
+        return admitted
+
+
+def retry_after(seconds):
+    """Значение заголовка Retry-After (целые секунды, не меньше 1)"""
+    return str(max(1, math.ceil(seconds)))
+
+
+def request_telegram_id(path_params, query_params, body):
+    """telegram_user_id из пути, параметров или тела запроса"""
+    telegram_id = path_params.get('telegram_user_id') or query_params.get('telegram_user_id')
+    if not telegram_id and isinstance(body, dict):
+        telegram_id = body.get('telegram_user_id') or body.get('telegram_id')
+    return telegram_id
+
+
+def init_app(app, limiter):
+    """
+    Допуск запросов приложения Flask. Место в max_concurrent освобождается
+    после обработчика, у потоковых ответов - при закрытии (соединение с БД
+    занято до конца передачи).
+    """
+    from flask import g, jsonify, request
+
+    def reject(status, error, wait):
+        response = jsonify({'data': None, 'error': error})
+        response.status_code = status
+        response.headers['Retry-After'] = retry_after(wait)
+        return response
+
+    @app.before_request
+    def admit_request():
+        if not limiter.enabled or request.endpoint is None or request.method == 'OPTIONS':
+            return None
+        rate_class = limiter.rate_class(request.endpoint, request.method)
+        if rate_class == EXEMPT:
+            return None
+        body = request.get_json(silent=True) if request.is_json else None
+        key = limiter.client_key(request_telegram_id(request.view_args or {}, request.args, body),
+                                 request.remote_addr, request.headers.get('X-Real-IP'))
+        rejected = limiter.check(rate_class, key)
+        if rejected is not None:
+            return reject(*rejected)
+        if limiter.needs_slot(request.endpoint, rate_class):
+            if not limiter.acquire():
+                return reject(503, SERVER_BUSY, 1)
+            g.rate_limit_slot = True
+        return None
+
+    @app.after_request
+    def release_slot_on_close(response):
+        if response.is_streamed and g.pop('rate_limit_slot', False):
+            response.call_on_close(limiter.release)
+        return response
+
+    @app.teardown_request
+    def release_slot(exc=None):
+        if g.pop('rate_limit_slot', False):
+            limiter.release()
+
+    app.extensions['rate_limit'] = limiter
+    return limiter
+
+
+class ReleaseOnClose:
+    """Потоковый ответ ASGI, освобождающий место после отправки тела"""
+
+    def __init__(self, response, release):
+        self.response = response
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            self.release()
+
+
+def limit_endpoint(limiter, endpoint, json_response):
+    """Допуск запросов к обработчику Starlette (json_response - ответ в формате API)"""
+    name = endpoint.__name__
+
+    def reject(status, error, wait):
+        response = json_response({'data': None, 'error': error}, status)
+        response.headers['Retry-After'] = retry_after(wait)
+        return response
+
+    @functools.wraps(endpoint)
+    async def wrapper(request):
+        if not limiter.enabled or request.method == 'OPTIONS':
+            return await endpoint(request)
+        rate_class = limiter.rate_class(name, request.method)
+        if rate_class == EXEMPT:
+            return await endpoint(request)
+        body = None
+        if request.headers.get('content-type', '').startswith('application/json'):
+            try:
+                body = json.loads(await request.body() or b'null')
+            except ValueError:
+                pass
+        client = request.client.host if request.client else None
+        key = limiter.client_key(request_telegram_id(request.path_params, request.query_params, body),
+                                 client, request.headers.get('x-real-ip'))
+        rejected = limiter.check(rate_class, key)
+        if rejected is not None:
+            return reject(*rejected)
+        if not limiter.needs_slot(name, rate_class):
+            return await endpoint(request)
+        if not await limiter.acquire():
+            return reject(503, SERVER_BUSY, 1)
+        try:
+            response = await endpoint(request)
+        except BaseException:
+            limiter.release()
+            raise
+        if hasattr(response, 'body_iterator'):
+            return ReleaseOnClose(response, limiter.release)
+        limiter.release()
+        return response
+    return wrapper
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Слой ответов для Flask API: быстрый JSON (orjson) и сжатие gzip/brotli
+Подключается одной строкой: init_app(app)
+
+orjson и brotli необязательны: без них используется стандартный json
+и только gzip. Формат JSON совпадает с Flask по умолчанию (даты в формате
+HTTP, UUID и Decimal строками, ключи отсортированы).
+"""
+
+import dataclasses
+import decimal
+import functools
+import gzip
+import json
+import os
+import uuid
+import zlib
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+from profiling import phase
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - зависит от окружения
+    brotli = None
+
+
+def response_config_from_env():
+    """Параметры слоя ответов из переменных окружения"""
+    return {
+        'compress': os.getenv('RESPONSE_COMPRESSION', '1') not in ('0', 'false', 'no'),
+        'min_size': int(os.getenv('RESPONSE_COMPRESS_MIN_SIZE', '1024')),
+        'gzip_level': int(os.getenv('RESPONSE_GZIP_LEVEL', '6')),
+        'brotli_quality': int(os.getenv('RESPONSE_BROTLI_QUALITY', '5')),
+    }
+
+
+# ============================================================================
+# JSON
+# ============================================================================
+
+def _default(obj):
+    # Типы, которые orjson не сериализует сам или сериализует иначе, чем Flask
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON-провайдер Flask на orjson.
+
+    Даты отдаются через default (OPT_PASSTHROUGH_DATETIME), чтобы формат
+    не отличался от DefaultJSONProvider. Все, что orjson не может закодировать
+    (например, int больше 64 бит), кодируется стандартным json.
+    """
+
+    if orjson is not None:
+        OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs.get('indent') is not None:
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(obj, default=_default, option=self.OPTIONS).decode()
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        with phase('encode'):
+            return self._response(*args, **kwargs)
+
+    def _response(self, *args, **kwargs):
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = orjson.dumps(obj, default=_default, option=self.OPTIONS | orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def dumps(obj):
+    """JSON в формате ответов Flask без приложения Flask (для timeweb_api_async.py)"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_default, option=FastJSONProvider.OPTIONS).decode()
+        except TypeError:
+            pass
+    return json.dumps(obj, default=_default, sort_keys=True, separators=(',', ':'))
+
+
+# ============================================================================
+# СЖАТИЕ
+# ============================================================================
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
+
+class ResponseCompressor:
+    """
+    Сжатие ответов в after_request.
+
+    Кодировка выбирается по Accept-Encoding (br, если доступен brotli, иначе gzip).
+    Обычные ответы сжимаются от min_size байт, потоковые (stream_query) - всегда,
+    кусками по мере генерации.
+    """
+
+    def __init__(self, compress=True, min_size=1024, gzip_level=6, brotli_quality=5):
+        self.enabled = compress
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def encodings(self):
+        """Поддерживаемые кодировки в порядке предпочтения"""
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def choose_encoding(self, request):
+        accepted = request.accept_encodings
+        best, best_quality = None, 0
+        for encoding in self.encodings():
+            quality = accepted[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def after_request(self, request, response):
+        if not self.enabled or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        response.vary.add('Accept-Encoding')
+
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers
+                or response.direct_passthrough
+                or request.method == 'HEAD'):
+            return response
+
+        encoding = self.choose_encoding(request)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self._compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            with phase('compress'):
+                response.set_data(self._compress(data, encoding))
+
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def _compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    def _compress_stream(self, chunks, encoding):
+        # Каждая пачка строк сбрасывается из компрессора сразу (flush), иначе
+        # он копит весь ответ и клиент получает первые байты только в конце
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            compress, finish = compressor.compress, compressor.flush
+            flush = functools.partial(compressor.flush, zlib.Z_SYNC_FLUSH)
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                if not chunk:
+                    continue
+                data = compress(chunk) + flush()
+                if data:
+                    yield data
+            yield finish()
+        finally:
+            # Закрываем исходный генератор (возврат соединения в пул у JsonRowStream)
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+
+def init_app(app, **config):
+    """Подключение быстрого JSON и сжатия к приложению Flask"""
+    from flask import request
+
+    settings = response_config_from_env()
+    settings.update(config)
+
+    app.json = FastJSONProvider(app)
+    compressor = ResponseCompressor(**settings)
+
+    @app.after_request
+    def compress_response(response):
+        return compressor.after_request(request, response)
+
+    app.extensions['response_layer'] = compressor
+    return compressor
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Дневные итоги и недельные когорты для админ-панели
+Таблицы и пересчет хвоста - в timeweb-daily-rollups.sql; графики читают
+daily_rollups, удержание - weekly_cohorts.
+
+Пересчет (cron раз в несколько минут):
+    python3 rollups.py --refresh
+    python3 rollups.py --refresh --loop 300
+    python3 rollups.py --refresh --from 2026-01-01   # пересчитать с даты
+"""
+
+import argparse
+import os
+import time
+from datetime import date, timedelta
+
+import psycopg2.extras
+
+# Недель удержания в /api/admin/cohorts по умолчанию
+DEFAULT_COHORT_WEEKS = int(os.getenv('ROLLUP_COHORT_WEEKS', '12'))
+
+REFRESH_SQL = "SELECT from_day, to_day FROM refresh_daily_rollups(%s)"
+REFRESH_ASYNC_SQL = "SELECT from_day, to_day FROM refresh_daily_rollups($1::date)"
+
+# Размер когорты - новые пользователи за неделю из daily_rollups
+_COHORTS_SQL = """
+SELECT c.cohort_week, s.size, c.activity_week, c.users
+FROM weekly_cohorts c
+JOIN (
+    SELECT date_trunc('week', day)::date AS cohort_week, SUM(new_users)::int AS size
+    FROM daily_rollups
+    WHERE day >= {since}
+    GROUP BY 1
+) s USING (cohort_week)
+WHERE c.cohort_week >= {since} AND c.activity_week >= c.cohort_week
+ORDER BY c.cohort_week, c.activity_week
+"""
+COHORTS_SQL = _COHORTS_SQL.format(since='%(since)s')
+COHORTS_ASYNC_SQL = _COHORTS_SQL.format(since='$1::date')
+
+
+def refresh(pool, from_day=None):
+    """Пересчет хвоста (или с from_day); None - пересчет уже идет в другой сессии"""
+    with pool.connection() as conn:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute(REFRESH_SQL, (from_day,))
+            row = cur.fetchone()
+        conn.commit()
+    return dict(row) if row else None
+
+
+def parse_day(value):
+    """Дата из параметра запроса (YYYY-MM-DD); ValueError - неверный формат"""
+    return date.fromisoformat(value) if value else None
+
+
+def cohorts_since(weeks):
+    """Понедельник недели, с которой начинаются когорты (weeks последних недель)"""
+    today = date.today()
+    return today - timedelta(days=today.weekday(), weeks=weeks - 1)
+
+
+def cohort_table(rows):
+    """
+    Строки weekly_cohorts -> когорты для графика удержания:
+    [{cohort_week, size, weeks: [{week, users, retention}]}], week 0 - неделя регистрации
+    """
+    cohorts = {}
+    for row in rows:
+        cohort = cohorts.setdefault(row['cohort_week'], {
+            'cohort_week': row['cohort_week'],
+            'size': row['size'],
+            'weeks': [],
+        })
+        cohort['weeks'].append({
+            'week': (row['activity_week'] - row['cohort_week']).days // 7,
+            'users': row['users'],
+            'retention': round(row['users'] / row['size'], 4) if row['size'] else None,
+        })
+    return list(cohorts.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пересчет дневных итогов и когорт')
+    parser.add_argument('--refresh', action='store_true', help='пересчитать хвост')
+    parser.add_argument('--from', dest='from_day', help='пересчитать начиная с даты (YYYY-MM-DD)')
+    parser.add_argument('--loop', type=float, default=0, help='повторять каждые N секунд')
+    args = parser.parse_args()
+
+    from timeweb_api_simple import pool
+
+    if not args.refresh:
+        parser.print_help()
+        return
+
+    from_day = parse_day(args.from_day)
+    while True:
+        started = time.perf_counter()
+        result = refresh(pool, from_day)
+        elapsed = round((time.perf_counter() - started) * 1000, 1)
+        if result is None:
+            print("[rollups] refresh is already running in another session")
+        else:
+            print(f"[rollups] refreshed {result['from_day']}..{result['to_day']} in {elapsed}ms")
+        if not args.loop:
+            break
+        from_day = None
+        time.sleep(args.loop)
+
+
+if __name__ == '__main__':
+    main()
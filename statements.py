@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Реестр подготовленных запросов (PREPARE/EXECUTE) для горячих запросов API
+Каждый запрос подготавливается один раз на соединение пула, дальше
+выполняется по имени без повторного разбора и планирования
+
+Отключение (например, за pgbouncer в режиме transaction):
+    DB_PREPARED_STATEMENTS=0
+"""
+
+import os
+import threading
+import time
+
+import psycopg2
+
+# Коды ошибок, после которых подготовленный запрос на соединении надо пересоздать:
+# 26000 - запроса с таким именем нет (сессию сбросили), 0A000 - план
+# больше не подходит (изменилась схема таблицы или представления)
+REPREPARE_PGCODES = ('26000', '0A000')
+
+
+def statements_config_from_env():
+    """Параметры реестра из переменных окружения"""
+    return {
+        'enabled': os.getenv('DB_PREPARED_STATEMENTS', '1') not in ('0', 'false', 'no'),
+    }
+
+
+class Statement:
+    """
+    Именованный запрос.
+
+    sql пишется как для psycopg2 (%s), param_types - типы PostgreSQL для
+    каждого %s по порядку (нужны PREPARE: без них у параметров в
+    INSERT ... SELECT тип text).
+    """
+
+    def __init__(self, name, sql, param_types=()):
+        count = sql.count('%s')
+        if count != len(param_types):
+            raise ValueError(f"Statement {name}: {count} placeholders, {len(param_types)} types")
+
+        self.name = name
+        self.sql = sql
+        self.param_types = tuple(param_types)
+
+        numbered = sql
+        for n in range(1, count + 1):
+            numbered = numbered.replace('%s', f'${n}', 1)
+        types = f" ({', '.join(self.param_types)})" if count else ''
+        self.prepare_sql = f"PREPARE {name}{types} AS {numbered}"
+        self.execute_sql = f"EXECUTE {name} ({', '.join(['%s'] * count)})" if count else f"EXECUTE {name}"
+
+
+class StatementRegistry:
+    """
+    Реестр запросов со счетчиками выполнения.
+
+    - enabled: False - запросы выполняются обычным cur.execute(sql)
+      (счетчики при этом продолжают считаться)
+    Подготовленные на соединении запросы хранятся в conn.prepared
+    (PooledConnection из db_pool.py).
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._statements = {}
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def register(self, name, sql, param_types=()):
+        """Добавление запроса в реестр"""
+        statement = Statement(name, sql, param_types)
+        with self._lock:
+            if name in self._statements:
+                raise ValueError(f"Statement {name} is already registered")
+            self._statements[name] = statement
+            self._counters[name] = {
+                'calls': 0,
+                'errors': 0,
+                'prepares': 0,
+                'time_total': 0.0,
+                'time_max': 0.0,
+            }
+        return statement
+
+    def get(self, name):
+        """Запрос по имени"""
+        return self._statements[name]
+
+    def execute(self, cur, name, params=()):
+        """Выполнение запроса name на курсоре cur (результат читается как обычно через fetch*)"""
+        statement = self._statements[name]
+        conn = cur.connection
+        prepared = getattr(conn, 'prepared', None) if self.enabled else None
+
+        started = time.perf_counter()
+        prepares = 0
+        try:
+            if prepared is None:
+                cur.execute(statement.sql, params)
+            else:
+                if getattr(conn, 'deallocate_all', False):
+                    cur.execute("DEALLOCATE ALL")
+                    conn.deallocate_all = False
+                if name not in prepared:
+                    cur.execute(statement.prepare_sql)
+                    prepared.add(name)
+                    prepares = 1
+                cur.execute(statement.execute_sql, params)
+        except psycopg2.Error as e:
+            if prepared is not None and e.pgcode in REPREPARE_PGCODES:
+                # Транзакция уже прервана - подготовим заново при следующем вызове
+                prepared.clear()
+                conn.deallocate_all = True
+            self._record(name, time.perf_counter() - started, prepares, error=True)
+            raise
+        self._record(name, time.perf_counter() - started, prepares)
+
+    def fetchall(self, conn, name, params=(), cursor_factory=None):
+        """
+        Все строки запроса name.
+
+        Должен быть первым запросом транзакции conn: если подготовленный план
+        устарел (изменилась схема), транзакция откатывается и запрос
+        повторяется с новым PREPARE.
+        """
+        for attempt in (1, 2):
+            try:
+                with conn.cursor(cursor_factory=cursor_factory) as cur:
+                    self.execute(cur, name, params)
+                    return cur.fetchall()
+            except psycopg2.Error as e:
+                if attempt == 2 or not self.enabled or e.pgcode not in REPREPARE_PGCODES:
+                    raise
+                conn.rollback()
+
+    def stats(self):
+        """Счетчики по запросам, самые затратные по суммарному времени - первыми"""
+        with self._lock:
+            rows = [dict(counters, name=name) for name, counters in self._counters.items()]
+        for row in rows:
+            row['time_avg'] = round(row['time_total'] / row['calls'], 6) if row['calls'] else 0.0
+            row['time_total'] = round(row['time_total'], 6)
+            row['time_max'] = round(row['time_max'], 6)
+        rows.sort(key=lambda row: row['time_total'], reverse=True)
+        return {'enabled': self.enabled, 'statements': rows}
+
+    def reset(self):
+        """Обнуление счетчиков"""
+        with self._lock:
+            for counters in self._counters.values():
+                counters.update(calls=0, errors=0, prepares=0, time_total=0.0, time_max=0.0)
+
+    def _record(self, name, elapsed, prepares, error=False):
+        with self._lock:
+            counters = self._counters[name]
+            counters['calls'] += 1
+            counters['prepares'] += prepares
+            counters['time_total'] += elapsed
+            if elapsed > counters['time_max']:
+                counters['time_max'] = elapsed
+            if error:
+                counters['errors'] += 1
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Счетчики для /api/admin/stats
+Итоги хранятся в admin_counters (см. timeweb-admin-counters.sql) и кешируются в процессе на несколько секунд
+
+Сверка с точным пересчетом:
+    python3 stats_counters.py --reconcile
+    python3 stats_counters.py --reconcile --loop 3600
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extras
+
+COUNTER_NAMES = ('users', 'strategies', 'analyses', 'active_users')
+
+READ_COUNTERS_SQL = """
+SELECT name, COALESCE(SUM(value), 0)::BIGINT AS value
+FROM admin_counters
+GROUP BY name
+"""
+
+# Запасной вариант, пока timeweb-admin-counters.sql не применен
+EXACT_COUNTS_SQL = """
+SELECT
+    (SELECT COUNT(*) FROM users) AS users,
+    (SELECT COUNT(*) FROM strategies) AS strategies,
+    (SELECT COUNT(*) FROM analyses) AS analyses,
+    (SELECT COUNT(DISTINCT user_id) FROM strategies) AS active_users
+"""
+
+
+class AdminCounters:
+    """Итоги для админ-панели с коротким кешем в памяти процесса"""
+
+    def __init__(self, pool, ttl=None):
+        self.pool = pool
+        self.ttl = float(os.getenv('ADMIN_STATS_TTL', '5')) if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires_at = 0.0
+
+    def get(self):
+        """Текущие итоги (из кеша, если он не устарел)"""
+        now = time.monotonic()
+        with self._lock:
+            if self._value is not None and now < self._expires_at:
+                return dict(self._value)
+
+        value = self._read()
+        with self._lock:
+            self._value = value
+            self._expires_at = time.monotonic() + self.ttl
+        return dict(value)
+
+    def invalidate(self):
+        """Сброс кеша"""
+        with self._lock:
+            self._value = None
+
+    def reconcile(self):
+        """Точный пересчет и исправление дрейфа счетчиков"""
+        with self.pool.connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                cur.execute("SELECT * FROM reconcile_admin_counters()")
+                rows = [dict(row) for row in cur.fetchall()]
+            conn.commit()
+        self.invalidate()
+        return rows
+
+    def _read(self):
+        with self.pool.connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                try:
+                    cur.execute(READ_COUNTERS_SQL)
+                    stored = {row['name']: row['value'] for row in cur.fetchall()}
+                    value = {name: stored.get(name, 0) for name in COUNTER_NAMES}
+                except psycopg2.errors.UndefinedTable:
+                    conn.rollback()
+                    print("[admin_stats] admin_counters table not found, falling back to COUNT(*)")
+                    cur.execute(EXACT_COUNTS_SQL)
+                    value = dict(cur.fetchone())
+            conn.commit()
+        return value
+
+
+class AsyncAdminCounters(AdminCounters):
+    """AdminCounters для пула asyncpg (timeweb_api_async.py): get() и reconcile() - корутины"""
+
+    async def get(self):
+        """Текущие итоги (из кеша, если он не устарел)"""
+        now = time.monotonic()
+        with self._lock:
+            if self._value is not None and now < self._expires_at:
+                return dict(self._value)
+
+        value = await self._read()
+        with self._lock:
+            self._value = value
+            self._expires_at = time.monotonic() + self.ttl
+        return dict(value)
+
+    async def reconcile(self):
+        """Точный пересчет и исправление дрейфа счетчиков"""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read'):
+                rows = [dict(row) for row in await conn.fetch("SELECT * FROM reconcile_admin_counters()")]
+        self.invalidate()
+        return rows
+
+    async def _read(self):
+        import asyncpg
+
+        async with self.pool.acquire() as conn:
+            try:
+                stored = {row['name']: row['value'] for row in await conn.fetch(READ_COUNTERS_SQL)}
+                return {name: stored.get(name, 0) for name in COUNTER_NAMES}
+            except asyncpg.exceptions.UndefinedTableError:
+                print("[admin_stats] admin_counters table not found, falling back to COUNT(*)")
+                return dict(await conn.fetchrow(EXACT_COUNTS_SQL))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сверка счетчиков admin_counters')
+    parser.add_argument('--reconcile', action='store_true', help='пересчитать и исправить дрейф')
+    parser.add_argument('--loop', type=float, default=0, help='повторять каждые N секунд')
+    args = parser.parse_args()
+
+    from timeweb_api_simple import pool
+
+    counters = AdminCounters(pool, ttl=0)
+    if not args.reconcile:
+        print(counters.get())
+        return
+
+    while True:
+        for row in counters.reconcile():
+            status = 'OK' if row['drift'] == 0 else f"fixed drift {row['drift']:+d}"
+            print(f"[admin_stats] {row['counter']}: {row['counted']} ({status})")
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == '__main__':
+    main()
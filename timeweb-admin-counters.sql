@@ -0,0 +1,160 @@
+-- СЧЕТЧИКИ ДЛЯ /api/admin/stats
+-- Итоги (users, strategies, analyses, active_users) поддерживаются триггерами
+-- при INSERT/DELETE, поэтому эндпоинт читает несколько строк вместо COUNT(*) по таблицам.
+--
+-- Каждый счетчик разбит на слоты: триггер прибавляет дельту в случайный слот,
+-- чтобы параллельные транзакции не выстраивались в очередь за одной строкой.
+-- Значение счетчика = SUM(value) по всем слотам. Слот -1 зарезервирован
+-- за сверкой (reconcile_admin_counters), триггеры его не трогают.
+
+BEGIN;
+
+-- Блокируем запись на время установки триггеров и начального пересчета,
+-- чтобы ни одна вставка не проскочила между ними
+LOCK TABLE users, strategies, analyses IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE IF NOT EXISTS admin_counters (
+    name TEXT NOT NULL,
+    slot SMALLINT NOT NULL,
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, slot)
+);
+
+COMMENT ON TABLE admin_counters IS 'Итоги для админ-панели, поддерживаются триггерами';
+
+-- Прибавление дельты к счетчику
+CREATE OR REPLACE FUNCTION add_admin_counter(p_name TEXT, p_delta BIGINT)
+RETURNS VOID AS $$
+BEGIN
+    IF p_delta = 0 THEN
+        RETURN;
+    END IF;
+    INSERT INTO admin_counters (name, slot, value)
+    VALUES (p_name, floor(random() * 16)::SMALLINT, p_delta)
+    ON CONFLICT (name, slot) DO UPDATE SET value = admin_counters.value + EXCLUDED.value;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггеры уровня оператора: одна дельта на INSERT/DELETE, а не на каждую строку
+CREATE OR REPLACE FUNCTION admin_counters_on_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM add_admin_counter(TG_TABLE_NAME, (SELECT COUNT(*) FROM new_rows));
+
+    IF TG_TABLE_NAME = 'strategies' THEN
+        -- Пользователь стал активным, если до этого оператора стратегий у него не было
+        PERFORM add_admin_counter('active_users', (
+            SELECT COUNT(DISTINCT n.user_id)
+            FROM new_rows n
+            WHERE n.user_id IS NOT NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM strategies s
+                  WHERE s.user_id = n.user_id
+                    AND s.id NOT IN (SELECT id FROM new_rows)
+              )
+        ));
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION admin_counters_on_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM add_admin_counter(TG_TABLE_NAME, -(SELECT COUNT(*) FROM old_rows));
+
+    IF TG_TABLE_NAME = 'strategies' THEN
+        -- Пользователь перестал быть активным, если стратегий не осталось
+        PERFORM add_admin_counter('active_users', -(
+            SELECT COUNT(DISTINCT o.user_id)
+            FROM old_rows o
+            WHERE o.user_id IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM strategies s WHERE s.user_id = o.user_id)
+        ));
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS admin_counters_users_insert ON users;
+CREATE TRIGGER admin_counters_users_insert
+    AFTER INSERT ON users REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION admin_counters_on_insert();
+
+DROP TRIGGER IF EXISTS admin_counters_users_delete ON users;
+CREATE TRIGGER admin_counters_users_delete
+    AFTER DELETE ON users REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION admin_counters_on_delete();
+
+DROP TRIGGER IF EXISTS admin_counters_strategies_insert ON strategies;
+CREATE TRIGGER admin_counters_strategies_insert
+    AFTER INSERT ON strategies REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION admin_counters_on_insert();
+
+DROP TRIGGER IF EXISTS admin_counters_strategies_delete ON strategies;
+CREATE TRIGGER admin_counters_strategies_delete
+    AFTER DELETE ON strategies REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION admin_counters_on_delete();
+
+DROP TRIGGER IF EXISTS admin_counters_analyses_insert ON analyses;
+CREATE TRIGGER admin_counters_analyses_insert
+    AFTER INSERT ON analyses REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION admin_counters_on_insert();
+
+DROP TRIGGER IF EXISTS admin_counters_analyses_delete ON analyses;
+CREATE TRIGGER admin_counters_analyses_delete
+    AFTER DELETE ON analyses REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION admin_counters_on_delete();
+
+-- Сверка: точный пересчет и исправление расхождений.
+-- Вызывать в транзакции REPEATABLE READ: тогда COUNT(*) и SUM(value) видят
+-- один и тот же набор зафиксированных транзакций, и разница между ними -
+-- настоящий дрейф (TRUNCATE, гонки active_users, ручные правки).
+-- Исправление прибавляется в слот -1, поэтому не конфликтует с триггерами.
+CREATE OR REPLACE FUNCTION reconcile_admin_counters()
+RETURNS TABLE(counter TEXT, counted BIGINT, stored BIGINT, drift BIGINT) AS $$
+#variable_conflict use_column
+BEGIN
+    IF current_setting('transaction_isolation') NOT IN ('repeatable read', 'serializable') THEN
+        RAISE EXCEPTION 'reconcile_admin_counters() requires REPEATABLE READ isolation';
+    END IF;
+
+    -- Одна сверка за раз
+    IF NOT pg_try_advisory_xact_lock(hashtext('reconcile_admin_counters')) THEN
+        RAISE EXCEPTION 'reconcile_admin_counters() is already running';
+    END IF;
+
+    RETURN QUERY
+    WITH exact AS (
+        SELECT 'users'::TEXT AS name, (SELECT COUNT(*) FROM users) AS value
+        UNION ALL SELECT 'strategies', (SELECT COUNT(*) FROM strategies)
+        UNION ALL SELECT 'analyses', (SELECT COUNT(*) FROM analyses)
+        UNION ALL SELECT 'active_users', (SELECT COUNT(DISTINCT user_id) FROM strategies)
+    ),
+    totals AS (
+        SELECT e.name, e.value AS counted,
+               COALESCE((SELECT SUM(c.value) FROM admin_counters c WHERE c.name = e.name), 0)::BIGINT AS stored
+        FROM exact e
+    ),
+    fixed AS (
+        INSERT INTO admin_counters (name, slot, value)
+        SELECT name, -1, counted - stored FROM totals WHERE counted <> stored
+        ON CONFLICT (name, slot) DO UPDATE SET value = admin_counters.value + EXCLUDED.value
+    )
+    SELECT name, counted, stored, counted - stored FROM totals;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Начальное заполнение (таблицы заблокированы, поэтому значения точные)
+DELETE FROM admin_counters;
+INSERT INTO admin_counters (name, slot, value)
+SELECT 'users', -1, COUNT(*) FROM users
+UNION ALL SELECT 'strategies', -1, COUNT(*) FROM strategies
+UNION ALL SELECT 'analyses', -1, COUNT(*) FROM analyses
+UNION ALL SELECT 'active_users', -1, COUNT(DISTINCT user_id) FROM strategies;
+
+GRANT SELECT, INSERT, UPDATE, DELETE ON admin_counters TO tradeanalyzer_app;
+
+COMMIT;
@@ -13,9 +13,17 @@ import json
 from datetime import datetime
 import uuid
 
+from db_pool import ConnectionPool, PoolError, pool_config_from_env
+from health import HealthMonitor, health_config_from_env
+import response_layer
+from migration_engine import MigrationEngine, MigrationError, iter_text_chunks
+
 app = Flask(__name__)
 CORS(app)  # Разрешаем CORS для фронтенда
 
+# Быстрый JSON и сжатие ответов (response_layer.py)
+response_layer.init_app(app)
+
 # Конфигурация БД
 DB_CONFIG = {
     'host': os.getenv('DB_HOST', 'localhost'),
@@ -25,40 +33,35 @@ DB_CONFIG = {
     'password': os.getenv('DB_PASSWORD', 'SECURE_PASSWORD_HERE')
 }
 
-def get_db_connection():
-    """Создание подключения к БД"""
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
-    except Exception as e:
-        print(f"Database connection error: {e}")
-        return None
+# Пул соединений (общий для всех потоков воркера)
+pool = ConnectionPool(DB_CONFIG, **pool_config_from_env())
+
+# Состояние БД и пула для /api/health* - проверяется фоновым потоком (health.py)
+health = HealthMonitor(pool, **health_config_from_env())
 
 def execute_query(sql, params=None, fetch=True):
     """Выполнение SQL запроса"""
-    conn = get_db_connection()
-    if not conn:
-        return {'error': 'Database connection failed'}
-    
     try:
-        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-            cur.execute(sql, params or [])
-            
-            if fetch:
-                rows = cur.fetchall()
-                # Конвертируем в обычные словари для JSON
-                result = [dict(row) for row in rows]
-            else:
-                result = []
+        with pool.connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute(sql, params or [])
                 
+                if fetch:
+                    rows = cur.fetchall()
+                    # Конвертируем в обычные словари для JSON
+                    result = [dict(row) for row in rows]
+                else:
+                    result = []
+                    
             conn.commit()
             return {'rows': result, 'error': None}
             
+    except PoolError as e:
+        print(f"Database connection error: {e}")
+        return {'rows': None, 'error': 'Database connection failed'}
     except Exception as e:
-        conn.rollback()
+        # Откат транзакции выполняет пул при возврате соединения
         return {'rows': None, 'error': str(e)}
-    finally:
-        conn.close()
 
 @app.route('/api/query', methods=['POST'])
 def execute_sql():
@@ -239,82 +242,54 @@ def get_user_stats(telegram_user_id):
 
 @app.route('/api/health')
 def health_check():
-    """Проверка здоровья API"""
-    try:
-        conn = get_db_connection()
-        if conn:
-            conn.close()
-            return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
-        else:
-            return jsonify({'status': 'unhealthy', 'error': 'Database connection failed'}), 500
-    except Exception as e:
-        return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
+    """Проверка здоровья API (состояние из фоновой проверки, без запроса к БД)"""
+    status = health.status()
+    body = {
+        'status': status['status'],
+        'reasons': status['reasons'],
+        'timestamp': datetime.now().isoformat(),
+        'database': 'connected' if health.ready(status) else 'disconnected',
+        'db': status['database'],
+        'pool': status['pool']
+    }
+    if not health.ready(status):
+        body['error'] = 'Database connection failed'
+        return jsonify(body), 500
+    return jsonify(body)
+
+@app.route('/api/health/live')
+def health_live():
+    """Liveness: воркер отвечает (БД не проверяется)"""
+    return jsonify(health.live())
+
+@app.route('/api/health/ready')
+def health_ready():
+    """Readiness: 503, если БД недоступна по последним фоновым проверкам"""
+    status = health.status()
+    return jsonify(status), 200 if health.ready(status) else 503
 
 @app.route('/api/migrate', methods=['POST'])
 def migrate_data():
-    """Импорт данных из Supabase экспорта"""
+    """Импорт данных из Supabase экспорта (тело читается потоково, см. migration_engine.py)"""
     try:
-        data = request.get_json()
-        
-        if not data or 'users' not in data:
-            return jsonify({'error': 'Invalid migration data'}), 400
-        
-        migrated = {'users': 0, 'strategies': 0, 'analyses': 0}
-        
-        # Миграция пользователей
-        for user in data.get('users', []):
-            sql = """
-            INSERT INTO users (id, telegram_id, username, first_name, last_name, created_at, updated_at)
-            VALUES (%(id)s, %(telegram_id)s, %(username)s, %(first_name)s, %(last_name)s, %(created_at)s, %(updated_at)s)
-            ON CONFLICT (telegram_id) DO NOTHING
-            """
-            result = execute_query(sql, user, fetch=False)
-            if not result['error']:
-                migrated['users'] += 1
-        
-        # Миграция стратегий
-        for strategy in data.get('strategies', []):
-            sql = """
-            INSERT INTO strategies (id, user_id, name, description, fields, is_public, created_at, updated_at)
-            VALUES (%(id)s, %(user_id)s, %(name)s, %(description)s, %(fields)s, %(is_public)s, %(created_at)s, %(updated_at)s)
-            ON CONFLICT (id) DO NOTHING
-            """
-            result = execute_query(sql, strategy, fetch=False)
-            if not result['error']:
-                migrated['strategies'] += 1
-        
-        # Миграция анализов
-        for analysis in data.get('analyses', []):
-            # Переименовываем поля для совместимости
-            analysis_data = {
-                'id': analysis.get('id'),
-                'user_id': analysis.get('user_id'),
-                'strategy_id': analysis.get('strategy_id'),
-                'answers': analysis.get('answers'),
-                'positive_factors': analysis.get('positive_factors'),
-                'negative_factors': analysis.get('negative_factors'),
-                'neutral_factors': analysis.get('neutral_factors'),
-                'recommendation': analysis.get('recommendation'),
-                'created_at': analysis.get('created_at')
-            }
-            
-            sql = """
-            INSERT INTO analyses (id, user_id, strategy_id, answers, positive_factors, 
-                                negative_factors, neutral_factors, recommendation, created_at)
-            VALUES (%(id)s, %(user_id)s, %(strategy_id)s, %(answers)s, %(positive_factors)s,
-                    %(negative_factors)s, %(neutral_factors)s, %(recommendation)s, %(created_at)s)
-            ON CONFLICT (id) DO NOTHING
-            """
-            result = execute_query(sql, analysis_data, fetch=False)
-            if not result['error']:
-                migrated['analyses'] += 1
+        with pool.connection() as conn:
+            engine = MigrationEngine(conn)
+            stats = engine.run(iter_text_chunks(request.stream))
         
+        migrated = stats['migrated']
         return jsonify({
             'success': True,
             'migrated': migrated,
+            'skipped': stats['skipped'],
+            'elapsed': stats['elapsed'],
             'message': f"Migrated {migrated['users']} users, {migrated['strategies']} strategies, {migrated['analyses']} analyses"
         })
         
+    except MigrationError as e:
+        return jsonify({'error': str(e)}), 400
+    except PoolError as e:
+        print(f"Database connection error: {e}")
+        return jsonify({'error': 'Database connection failed'}), 500
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -322,12 +297,11 @@ if __name__ == '__main__':
     print("🚀 Starting Timeweb API server...")
     print(f"📊 Database: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}")
     
-    # Проверяем подключение к БД при запуске
-    conn = get_db_connection()
-    if conn:
+    # Проверяем подключение к БД при запуске и прогреваем пул
+    try:
+        pool.fill()
         print("✅ Database connection successful")
-        conn.close()
-    else:
-        print("❌ Database connection failed")
+    except PoolError as e:
+        print(f"❌ Database connection failed: {e}")
     
     app.run(host='0.0.0.0', port=5000, debug=False)
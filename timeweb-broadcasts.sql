@@ -0,0 +1,29 @@
+-- СОСТОЯНИЕ РАССЫЛОК БОТА (broadcast.py)
+-- Одна строка на рассылку: текст и курсор по users.id. Все пользователи с
+-- id <= cursor_id уже обработаны, и счетчики учитывают только их; в done -
+-- обработанные после курсора (отправка идет параллельно, не по порядку).
+-- После падения рассылка продолжается с курсора без повторной отправки.
+-- Скрипт можно применять повторно.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS broadcasts (
+    name TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    web_app_button BOOLEAN NOT NULL DEFAULT FALSE,
+    status TEXT NOT NULL DEFAULT 'running',       -- running / finished
+    cursor_id UUID,                               -- последний обработанный users.id
+    done JSONB NOT NULL DEFAULT '{}',             -- {users.id: результат} после курсора
+    sent INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,           -- пользователь заблокировал бота
+    failed INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+COMMENT ON TABLE broadcasts IS 'Рассылки бота: текст, курсор и итоги доставки';
+
+GRANT SELECT, INSERT, UPDATE, DELETE ON broadcasts TO tradeanalyzer_app;
+
+COMMIT;
@@ -21,6 +21,7 @@ const TIMEWEB_CONFIG = {
     retryAttempts: 3, // Количество попыток
     retryDelay: 1000, // Начальная задержка между попытками (экспоненциальная)
     healthCheckTimeout: 2000, // 2 секунды для проверки доступности endpoint
+    pageSize: 500, // Строк на страницу списков (не больше API_MAX_PAGE_SIZE на сервере)
     
     // Определение окружения
     isDevelopment: window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1'
@@ -231,6 +232,16 @@ class TimewebTable {
         return body;
     }
     
+    // Таблицы с эндпоинтом /bulk (вставка массива одним запросом)
+    supportsBulk() {
+        return this.tableName === 'strategies' || this.tableName === 'analysis_results';
+    }
+    
+    // Таблицы, которые API отдает страницами (limit, cursor -> next_cursor)
+    supportsPaging() {
+        return this.tableName === 'strategies' || this.tableName === 'analysis_results';
+    }
+    
     eq(column, value) {
         this.whereConditions[column] = value;
         return this;
@@ -281,7 +292,11 @@ class TimewebTable {
                 this.insertData = null;
                 try {
                     // Готовим тело запроса с нормализацией
-                    const payload = this.prepareInsertBody(data);
+                    // (массив стратегий/анализов отправляется одним запросом на /bulk)
+                    const isBulk = Array.isArray(data) && this.supportsBulk();
+                    const payload = isBulk
+                        ? { telegram_user_id: this.getTelegramUserId(), items: data.map(item => this.prepareInsertBody(item)) }
+                        : this.prepareInsertBody(data);
                     if (this.tableName === 'user_events') {
                         try { console.log('📊 user_events payload (execute):', payload); } catch (_) {}
                     }
@@ -293,6 +308,9 @@ class TimewebTable {
                     } else if (this.tableName === 'analysis_results') {
                         endpoint = 'analysis_results';
                     }
+                    if (isBulk) {
+                        endpoint += '/bulk';
+                    }
                     
                     const response = await fetchWithRetry(
                         `${this.apiUrl}/${endpoint}`,
@@ -343,20 +361,45 @@ class TimewebTable {
                 endpoint = 'analysis_results';
             }
             
-            const url = `${this.apiUrl}/${endpoint}?${params.toString()}`;
-            const response = await fetchWithRetry(
-                url,
-                {},
-                TIMEWEB_CONFIG.retryAttempts,
-                TIMEWEB_CONFIG.retryDelay,
-                TIMEWEB_CONFIG.timeout
-            );
-            
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+            // Списки стратегий и анализов отдаются страницами: идем по next_cursor,
+            // пока не соберем все строки (или сколько просили через limit()/single())
+            const wanted = this.returnSingle ? 1 : (Number(this.limitClause) || null);
+            if (this.supportsPaging()) {
+                params.append('limit', String(Math.min(wanted || TIMEWEB_CONFIG.pageSize, TIMEWEB_CONFIG.pageSize)));
             }
             
-            const result = await response.json();
+            let result = null;
+            let rows = [];
+            let cursor = null;
+            do {
+                const pageParams = new URLSearchParams(params);
+                if (cursor) {
+                    pageParams.append('cursor', cursor);
+                }
+                const url = `${this.apiUrl}/${endpoint}?${pageParams.toString()}`;
+                const response = await fetchWithRetry(
+                    url,
+                    {},
+                    TIMEWEB_CONFIG.retryAttempts,
+                    TIMEWEB_CONFIG.retryDelay,
+                    TIMEWEB_CONFIG.timeout
+                );
+                
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                
+                result = await response.json();
+                if (!Array.isArray(result.data)) {
+                    break;
+                }
+                rows = rows.concat(result.data);
+                cursor = result.next_cursor || null;
+            } while (cursor && !(wanted && rows.length >= wanted));
+            
+            if (Array.isArray(result.data)) {
+                result = { data: wanted ? rows.slice(0, wanted) : rows, error: result.error };
+            }
             
             if (this.returnSingle && result.data && result.data.length > 0) {
                 return { data: result.data[0], error: result.error };
@@ -404,12 +447,16 @@ class TimewebTable {
                 try {
                     // Добавляем telegram_user_id если есть Telegram данные
                     const telegramUserId = this.getTelegramUserId();
-                    if (telegramUserId && !data.telegram_user_id) {
+                    const isBulk = Array.isArray(data) && this.supportsBulk();
+                    if (telegramUserId && !isBulk && !data.telegram_user_id) {
                         data.telegram_user_id = telegramUserId;
                     }
                     
                     // Готовим тело запроса с нормализацией
-                    const payload = this.prepareInsertBody(data);
+                    // (массив стратегий/анализов отправляется одним запросом на /bulk)
+                    const payload = isBulk
+                        ? { telegram_user_id: telegramUserId, items: data.map(item => this.prepareInsertBody(item)) }
+                        : this.prepareInsertBody(data);
                     if (this.tableName === 'user_events') {
                         try { console.log('📊 user_events payload:', payload); } catch (_) {}
                     }
@@ -421,6 +468,9 @@ class TimewebTable {
                     } else if (this.tableName === 'analysis_results') {
                         endpoint = 'analysis_results';
                     }
+                    if (isBulk) {
+                        endpoint += '/bulk';
+                    }
                     
                     const response = await fetch(`${this.apiUrl}/${endpoint}`, {
                         method: 'POST',
@@ -0,0 +1,168 @@
+-- ДНЕВНЫЕ ИТОГИ И НЕДЕЛЬНЫЕ КОГОРТЫ ДЛЯ АДМИН-ПАНЕЛИ
+-- Графики (/api/admin/users_by_date, /api/admin/daily) и удержание
+-- (/api/admin/cohorts) читают готовые строки вместо группировки всех
+-- стратегий, анализов и событий на каждый запрос.
+--
+-- refresh_daily_rollups() пересчитывает только хвост: последний записанный
+-- день и все дни после него (запросы по диапазону created_at >= ... идут по
+-- индексам). Запускается по cron раз в несколько минут (rollups.py --refresh).
+-- Прошедшие дни не меняются: удаленные позже стратегии из них не вычитаются.
+--
+-- Дни и недели считаются по rollup_timezone() (Москва), недели - с понедельника.
+-- Скрипт можно применять повторно; при первом применении заполняется вся история.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION rollup_timezone()
+RETURNS TEXT AS $$
+    SELECT 'Europe/Moscow'::TEXT
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    day DATE PRIMARY KEY,
+    new_users INTEGER NOT NULL DEFAULT 0,
+    active_users INTEGER NOT NULL DEFAULT 0,      -- стратегия, анализ или событие за день
+    strategy_users INTEGER NOT NULL DEFAULT 0,    -- создавали стратегии (users_by_date)
+    strategies_created INTEGER NOT NULL DEFAULT 0,
+    analyses_created INTEGER NOT NULL DEFAULT 0,
+    events INTEGER NOT NULL DEFAULT 0,
+    events_by_type JSONB NOT NULL DEFAULT '{}',
+    refreshed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Недели, в которые пользователь был активен (основа когорт)
+CREATE TABLE IF NOT EXISTS user_active_weeks (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    week DATE NOT NULL,
+    PRIMARY KEY (user_id, week)
+);
+CREATE INDEX IF NOT EXISTS idx_user_active_weeks_week ON user_active_weeks (week);
+
+-- Когорта - неделя регистрации; users - сколько из нее активны в activity_week
+CREATE TABLE IF NOT EXISTS weekly_cohorts (
+    cohort_week DATE NOT NULL,
+    activity_week DATE NOT NULL,
+    users INTEGER NOT NULL,
+    PRIMARY KEY (cohort_week, activity_week)
+);
+
+-- Хвост читается по created_at (у strategies и analyses индексы уже есть)
+CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at);
+CREATE INDEX IF NOT EXISTS idx_user_events_created_at ON user_events (created_at);
+
+CREATE OR REPLACE FUNCTION refresh_daily_rollups(p_from DATE DEFAULT NULL)
+RETURNS TABLE (from_day DATE, to_day DATE) AS $$
+DECLARE
+    v_tz TEXT := rollup_timezone();
+    v_today DATE := (NOW() AT TIME ZONE rollup_timezone())::DATE;
+    v_from DATE;
+    v_from_ts TIMESTAMP WITH TIME ZONE;
+    v_from_week DATE;
+BEGIN
+    -- Пересчет уже идет в другой сессии - второй не нужен
+    IF NOT pg_try_advisory_xact_lock(hashtext('refresh_daily_rollups')) THEN
+        RETURN;
+    END IF;
+
+    -- Хвост: последний записанный день; пустая таблица - вся история
+    v_from := COALESCE(
+        p_from,
+        (SELECT MAX(day) FROM daily_rollups),
+        (SELECT (MIN(first_at) AT TIME ZONE v_tz)::DATE FROM (
+            SELECT MIN(created_at) AS first_at FROM users
+            UNION ALL SELECT MIN(created_at) FROM strategies
+            UNION ALL SELECT MIN(created_at) FROM analyses
+            UNION ALL SELECT MIN(created_at) FROM user_events
+        ) firsts),
+        v_today
+    );
+    v_from_ts := v_from::TIMESTAMP AT TIME ZONE v_tz;
+    v_from_week := date_trunc('week', v_from)::DATE;
+
+    DROP TABLE IF EXISTS rollup_activity;
+    CREATE TEMP TABLE rollup_activity ON COMMIT DROP AS
+    SELECT DISTINCT user_id, (created_at AT TIME ZONE v_tz)::DATE AS day
+    FROM (
+        SELECT user_id, created_at FROM strategies WHERE created_at >= v_from_ts
+        UNION ALL
+        SELECT user_id, created_at FROM analyses WHERE created_at >= v_from_ts
+        UNION ALL
+        SELECT user_id, created_at FROM user_events WHERE created_at >= v_from_ts
+    ) activity
+    WHERE user_id IS NOT NULL;
+
+    INSERT INTO daily_rollups (
+        day, new_users, active_users, strategy_users, strategies_created,
+        analyses_created, events, events_by_type, refreshed_at
+    )
+    SELECT
+        d.day,
+        COALESCE(u.created, 0),
+        COALESCE(a.users, 0),
+        COALESCE(s.users, 0),
+        COALESCE(s.created, 0),
+        COALESCE(an.created, 0),
+        COALESCE(e.created, 0),
+        COALESCE(e.by_type, '{}'::JSONB),
+        NOW()
+    FROM (SELECT generate_series(v_from, v_today, INTERVAL '1 day')::DATE AS day) d
+    LEFT JOIN (
+        SELECT (created_at AT TIME ZONE v_tz)::DATE AS day, COUNT(*) AS created
+        FROM users WHERE created_at >= v_from_ts GROUP BY 1
+    ) u USING (day)
+    LEFT JOIN (
+        SELECT (created_at AT TIME ZONE v_tz)::DATE AS day, COUNT(*) AS created,
+               COUNT(DISTINCT user_id) AS users
+        FROM strategies WHERE created_at >= v_from_ts GROUP BY 1
+    ) s USING (day)
+    LEFT JOIN (
+        SELECT (created_at AT TIME ZONE v_tz)::DATE AS day, COUNT(*) AS created
+        FROM analyses WHERE created_at >= v_from_ts GROUP BY 1
+    ) an USING (day)
+    LEFT JOIN (
+        SELECT day, SUM(created) AS created, jsonb_object_agg(event_type, created) AS by_type
+        FROM (
+            SELECT (created_at AT TIME ZONE v_tz)::DATE AS day, event_type, COUNT(*) AS created
+            FROM user_events WHERE created_at >= v_from_ts GROUP BY 1, 2
+        ) by_type
+        GROUP BY day
+    ) e USING (day)
+    LEFT JOIN (
+        SELECT day, COUNT(*) AS users FROM rollup_activity GROUP BY day
+    ) a USING (day)
+    ON CONFLICT (day) DO UPDATE SET
+        new_users = EXCLUDED.new_users,
+        active_users = EXCLUDED.active_users,
+        strategy_users = EXCLUDED.strategy_users,
+        strategies_created = EXCLUDED.strategies_created,
+        analyses_created = EXCLUDED.analyses_created,
+        events = EXCLUDED.events,
+        events_by_type = EXCLUDED.events_by_type,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    -- Недели активности накапливаются: дни недели до хвоста уже записаны раньше
+    INSERT INTO user_active_weeks (user_id, week)
+    SELECT DISTINCT user_id, date_trunc('week', day)::DATE
+    FROM rollup_activity
+    ON CONFLICT DO NOTHING;
+
+    -- Когорты пересчитываются только для недель хвоста
+    DELETE FROM weekly_cohorts WHERE activity_week >= v_from_week;
+    INSERT INTO weekly_cohorts (cohort_week, activity_week, users)
+    SELECT date_trunc('week', u.created_at AT TIME ZONE v_tz)::DATE, w.week, COUNT(*)
+    FROM user_active_weeks w
+    JOIN users u ON u.id = w.user_id
+    WHERE w.week >= v_from_week AND u.created_at IS NOT NULL
+    GROUP BY 1, 2;
+
+    RETURN QUERY SELECT v_from, v_today;
+END;
+$$ LANGUAGE plpgsql
+SET client_min_messages = warning;  -- без NOTICE от DROP TABLE IF EXISTS
+
+GRANT SELECT, INSERT, UPDATE, DELETE ON daily_rollups, user_active_weeks, weekly_cohorts TO tradeanalyzer_app;
+
+-- Начальное заполнение (при повторном применении - только хвост)
+SELECT * FROM refresh_daily_rollups();
+
+COMMIT;
@@ -0,0 +1,16 @@
+-- КОМПОЗИТНЫЕ ИНДЕКСЫ ДЛЯ KEYSET-ПАГИНАЦИИ
+-- GET /api/strategies и GET /api/analysis_results читают страницы
+-- WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?
+-- Индекс (user_id, created_at DESC, id DESC) отдает страницу одним range scan без сортировки.
+-- CONCURRENTLY - без блокировки записи; выполнять вне транзакции (psql -f).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_strategies_user_created_id
+    ON strategies (user_id, created_at DESC, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_analyses_user_created_id
+    ON analyses (user_id, created_at DESC, id DESC);
+
+-- idx_strategies_user_id и idx_analyses_user_id теперь покрываются префиксом
+-- новых индексов; их можно удалить после проверки планов запросов:
+-- DROP INDEX CONCURRENTLY IF EXISTS idx_strategies_user_id;
+-- DROP INDEX CONCURRENTLY IF EXISTS idx_analyses_user_id;
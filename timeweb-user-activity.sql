@@ -0,0 +1,241 @@
+-- АГРЕГАТ АКТИВНОСТИ ПОЛЬЗОВАТЕЛЕЙ ДЛЯ /api/admin/users_list
+-- Одна строка на пользователя: число стратегий и анализов и время последней
+-- стратегии. Поддерживается триггерами, поэтому список пользователей читается
+-- одним проходом по индексу вместо трех коррелированных подзапросов на строку.
+--
+-- Там же версии данных пользователя (*_version, *_changed_at): увеличиваются
+-- при любом INSERT/UPDATE/DELETE стратегий и анализов и используются для
+-- ETag/Last-Modified в GET /api/strategies и /api/analysis_results.
+-- Скрипт можно применять повторно (в том числе поверх прошлой версии).
+
+BEGIN;
+
+-- Блокируем запись на время установки триггеров и начального заполнения
+LOCK TABLE users, strategies, analyses IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE IF NOT EXISTS user_activity (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    created_at TIMESTAMP WITH TIME ZONE,          -- копия users.created_at для сортировки
+    strategies_count INTEGER NOT NULL DEFAULT 0,
+    analyses_count INTEGER NOT NULL DEFAULT 0,
+    last_activity TIMESTAMP WITH TIME ZONE        -- MAX(strategies.created_at)
+);
+
+ALTER TABLE user_activity
+    ADD COLUMN IF NOT EXISTS strategies_version BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS strategies_changed_at TIMESTAMP WITH TIME ZONE,
+    ADD COLUMN IF NOT EXISTS analyses_version BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS analyses_changed_at TIMESTAMP WITH TIME ZONE;
+
+COMMENT ON TABLE user_activity IS 'Активность пользователей, поддерживается триггерами';
+
+-- Индексы под сортировки списка (DESC, user_id - для keyset-пагинации).
+-- NULL заменяется на epoch, чтобы ключ сортировки всегда был сравним.
+CREATE INDEX IF NOT EXISTS idx_user_activity_created_at
+    ON user_activity ((COALESCE(created_at, 'epoch'::timestamptz)) DESC, user_id DESC);
+CREATE INDEX IF NOT EXISTS idx_user_activity_last_activity
+    ON user_activity ((COALESCE(last_activity, 'epoch'::timestamptz)) DESC, user_id DESC);
+CREATE INDEX IF NOT EXISTS idx_user_activity_strategies_count
+    ON user_activity (strategies_count DESC, user_id DESC);
+CREATE INDEX IF NOT EXISTS idx_user_activity_analyses_count
+    ON user_activity (analyses_count DESC, user_id DESC);
+
+-- Новые пользователи
+CREATE OR REPLACE FUNCTION user_activity_on_user_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO user_activity (user_id, created_at, strategies_changed_at, analyses_changed_at)
+    SELECT id, created_at, NOW(), NOW() FROM new_rows
+    ON CONFLICT (user_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Новые стратегии: +count, last_activity = max, новая версия
+CREATE OR REPLACE FUNCTION user_activity_on_strategy_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO user_activity (user_id, created_at, strategies_count, last_activity,
+                               strategies_version, strategies_changed_at)
+    SELECT n.user_id, u.created_at, COUNT(*), MAX(n.created_at), 1, NOW()
+    FROM new_rows n
+    JOIN users u ON u.id = n.user_id
+    GROUP BY n.user_id, u.created_at
+    ON CONFLICT (user_id) DO UPDATE SET
+        strategies_count = user_activity.strategies_count + EXCLUDED.strategies_count,
+        last_activity = GREATEST(user_activity.last_activity, EXCLUDED.last_activity),
+        strategies_version = user_activity.strategies_version + 1,
+        strategies_changed_at = EXCLUDED.strategies_changed_at;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удаленные стратегии: -count, last_activity пересчитывается по индексу
+-- (user_id, created_at DESC, id DESC) из timeweb-keyset-indexes.sql
+CREATE OR REPLACE FUNCTION user_activity_on_strategy_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE user_activity ua SET
+        strategies_count = ua.strategies_count - d.cnt,
+        last_activity = (SELECT MAX(s.created_at) FROM strategies s WHERE s.user_id = ua.user_id),
+        strategies_version = ua.strategies_version + 1,
+        strategies_changed_at = NOW()
+    FROM (SELECT user_id, COUNT(*) AS cnt FROM old_rows GROUP BY user_id) d
+    WHERE ua.user_id = d.user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_activity_on_analysis_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO user_activity (user_id, created_at, analyses_count,
+                               analyses_version, analyses_changed_at)
+    SELECT n.user_id, u.created_at, COUNT(*), 1, NOW()
+    FROM new_rows n
+    JOIN users u ON u.id = n.user_id
+    GROUP BY n.user_id, u.created_at
+    ON CONFLICT (user_id) DO UPDATE SET
+        analyses_count = user_activity.analyses_count + EXCLUDED.analyses_count,
+        analyses_version = user_activity.analyses_version + 1,
+        analyses_changed_at = EXCLUDED.analyses_changed_at;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_activity_on_analysis_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE user_activity ua SET
+        analyses_count = ua.analyses_count - d.cnt,
+        analyses_version = ua.analyses_version + 1,
+        analyses_changed_at = NOW()
+    FROM (SELECT user_id, COUNT(*) AS cnt FROM old_rows GROUP BY user_id) d
+    WHERE ua.user_id = d.user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Изменение стратегий/анализов: только новая версия (счетчики не меняются).
+-- Сюда же попадает обнуление analyses.strategy_id при удалении стратегии.
+CREATE OR REPLACE FUNCTION user_activity_on_update()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'strategies' THEN
+        UPDATE user_activity SET
+            strategies_version = strategies_version + 1,
+            strategies_changed_at = NOW()
+        WHERE user_id IN (SELECT user_id FROM new_rows UNION SELECT user_id FROM old_rows);
+    ELSE
+        UPDATE user_activity SET
+            analyses_version = analyses_version + 1,
+            analyses_changed_at = NOW()
+        WHERE user_id IN (SELECT user_id FROM new_rows UNION SELECT user_id FROM old_rows);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_activity_users_insert ON users;
+CREATE TRIGGER user_activity_users_insert
+    AFTER INSERT ON users REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_activity_on_user_insert();
+
+DROP TRIGGER IF EXISTS user_activity_strategies_insert ON strategies;
+CREATE TRIGGER user_activity_strategies_insert
+    AFTER INSERT ON strategies REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_activity_on_strategy_insert();
+
+DROP TRIGGER IF EXISTS user_activity_strategies_delete ON strategies;
+CREATE TRIGGER user_activity_strategies_delete
+    AFTER DELETE ON strategies REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_activity_on_strategy_delete();
+
+DROP TRIGGER IF EXISTS user_activity_strategies_update ON strategies;
+CREATE TRIGGER user_activity_strategies_update
+    AFTER UPDATE ON strategies REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_activity_on_update();
+
+DROP TRIGGER IF EXISTS user_activity_analyses_insert ON analyses;
+CREATE TRIGGER user_activity_analyses_insert
+    AFTER INSERT ON analyses REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_activity_on_analysis_insert();
+
+DROP TRIGGER IF EXISTS user_activity_analyses_delete ON analyses;
+CREATE TRIGGER user_activity_analyses_delete
+    AFTER DELETE ON analyses REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_activity_on_analysis_delete();
+
+DROP TRIGGER IF EXISTS user_activity_analyses_update ON analyses;
+CREATE TRIGGER user_activity_analyses_update
+    AFTER UPDATE ON analyses REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_activity_on_update();
+
+-- Полный пересчет (начальное заполнение и исправление дрейфа).
+-- Версии не сбрасываются; у исправленных строк они увеличиваются,
+-- чтобы клиенты не получили 304 на устаревшие данные.
+CREATE OR REPLACE FUNCTION refresh_user_activity()
+RETURNS INTEGER AS $$
+DECLARE
+    changed INTEGER;
+BEGIN
+    WITH exact AS (
+        SELECT
+            u.id AS user_id,
+            u.created_at,
+            COALESCE(s.cnt, 0) AS strategies_count,
+            COALESCE(a.cnt, 0) AS analyses_count,
+            s.last_activity
+        FROM users u
+        LEFT JOIN (
+            SELECT user_id, COUNT(*) AS cnt, MAX(created_at) AS last_activity
+            FROM strategies GROUP BY user_id
+        ) s ON s.user_id = u.id
+        LEFT JOIN (
+            SELECT user_id, COUNT(*) AS cnt FROM analyses GROUP BY user_id
+        ) a ON a.user_id = u.id
+    )
+    INSERT INTO user_activity (user_id, created_at, strategies_count, analyses_count, last_activity)
+    SELECT user_id, created_at, strategies_count, analyses_count, last_activity FROM exact
+    ON CONFLICT (user_id) DO UPDATE SET
+        created_at = EXCLUDED.created_at,
+        strategies_count = EXCLUDED.strategies_count,
+        analyses_count = EXCLUDED.analyses_count,
+        last_activity = EXCLUDED.last_activity,
+        strategies_version = user_activity.strategies_version + 1,
+        analyses_version = user_activity.analyses_version + 1
+    WHERE (user_activity.created_at, user_activity.strategies_count,
+           user_activity.analyses_count, user_activity.last_activity)
+          IS DISTINCT FROM
+          (EXCLUDED.created_at, EXCLUDED.strategies_count,
+           EXCLUDED.analyses_count, EXCLUDED.last_activity);
+
+    GET DIAGNOSTICS changed = ROW_COUNT;
+    RETURN changed;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT refresh_user_activity();
+
+-- Строки, созданные до появления версий: время изменения неизвестно, берем текущее
+UPDATE user_activity SET
+    strategies_changed_at = COALESCE(strategies_changed_at, NOW()),
+    analyses_changed_at = COALESCE(analyses_changed_at, NOW())
+WHERE strategies_changed_at IS NULL OR analyses_changed_at IS NULL;
+
+-- Статистика пользователя по счетчикам вместо двух COUNT(*)
+-- (API читает user_activity напрямую, функция остается для старых клиентов)
+CREATE OR REPLACE FUNCTION get_user_stats(p_telegram_id TEXT)
+RETURNS JSON AS $$
+    SELECT json_build_object(
+        'strategies', COALESCE(MAX(ua.strategies_count), 0),
+        'analyses', COALESCE(MAX(ua.analyses_count), 0)
+    )
+    FROM users u
+    JOIN user_activity ua ON ua.user_id = u.id
+    WHERE u.telegram_id = p_telegram_id;
+$$ LANGUAGE sql STABLE;
+
+GRANT SELECT, INSERT, UPDATE, DELETE ON user_activity TO tradeanalyzer_app;
+
+COMMIT;
@@ -0,0 +1,1229 @@
+#!/usr/bin/env python3
+"""
+Асинхронный API сервер для TradeAnalyzer на Timeweb (ASGI: Starlette + asyncpg)
+Те же URL и формат ответов, что у timeweb_api_simple.py
+
+Воркер не блокируется на запросах к БД: пока один запрос ждет PostgreSQL,
+обслуживаются остальные, поэтому одновременных клиентов может быть больше,
+чем воркеров. Зависимости - requirements-async.txt.
+
+Запуск:
+    uvicorn timeweb_api_async:app --host 0.0.0.0 --port 5000 --workers 4
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import re
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+
+import anyio
+import asyncpg
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.http import http_date, parse_date, parse_etags
+
+import profiling
+import rate_limit
+import response_layer
+import rollups
+from api_common import (
+    DATA_VERSION_COLUMNS, EPOCH, NO_DB_ENDPOINTS, RATE_CLASSES, READ_POLICIES, STICKY_WRITE_ENDPOINTS,
+    USER_LIST_SORTS, add_analysis_factors, analysis_results_json, api_config_from_env, api_info_data,
+    bulk_summary, bulk_users, decode_cursor, encode_cursor, fill_bulk_results, json_object_sql,
+    modified_since, page_validators_from_row, parse_bulk_items, parse_page_args, parse_user_event,
+    row_json_sql, written_telegram_ids
+)
+from db_pool import pool_config_from_env
+from db_router import (
+    PRIMARY, AsyncReplicaRouter, read_policies_from_env, replica_configs_from_env, replica_name,
+    router_config_from_env
+)
+from events_ingest import AsyncEventBuffer, events_config_from_env
+from health import AsyncHealthMonitor, health_config_from_env
+from json_stream import AsyncJsonRowStream, stream_config_from_env
+from metrics import Metrics, MetricsMiddleware, metrics_config_from_env
+from stats_counters import AsyncAdminCounters
+from user_cache import UserIdCache, resolve_user_ids_async, user_cache_config_from_env
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Списки и /bulk: размер страниц, JSON из PostgreSQL, предел элементов
+API_CONFIG = api_config_from_env()
+STREAM_CONFIG = stream_config_from_env()
+
+# Конфигурация БД
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'port': os.getenv('DB_PORT', '5432'),
+    'database': os.getenv('DB_NAME', 'tradeanalyzer'),
+    'user': os.getenv('DB_USER', 'tradeanalyzer_app'),
+    'password': os.getenv('DB_PASSWORD', 'SECURE_PASSWORD_2024!')
+}
+
+# Пул asyncpg с теми же DB_POOL_* переменными: min/max размер, ожидание
+# свободного соединения (timeout) и время жизни простаивающего (max_age)
+POOL_CONFIG = pool_config_from_env()
+
+CORS_ORIGINS = [
+    'https://moscowfactory-tech.github.io',
+    'http://localhost:8000',
+    'http://127.0.0.1:8000'
+]
+
+# Ошибки подключения/ожидания пула - отвечаем 'Database connection failed'
+CONNECTION_ERRORS = (
+    asyncio.TimeoutError,
+    OSError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.InterfaceError,
+)
+
+# Политики чтения по эндпоинтам (db_router.py, реплики - DB_REPLICAS)
+read_policies = read_policies_from_env(READ_POLICIES)
+
+# Создаются при старте воркера (lifespan): пул asyncpg привязан к циклу событий
+pool = None
+router = None
+user_cache = UserIdCache(**user_cache_config_from_env())
+admin_counters = None
+event_buffer = None
+health = None
+
+# Метрики Prometheus (metrics.py); время ожидания пула asyncpg не учитывается
+metrics = Metrics(**metrics_config_from_env())
+
+# Журнал медленных запросов и профилирование по X-Profile (profiling.py)
+slow_log = profiling.SlowLog(**profiling.slow_log_config_from_env())
+profiler = profiling.RequestProfiler(**profiling.profiler_config_from_env())
+
+# Ограничение частоты запросов и сброс нагрузки: 429/503 с Retry-After (rate_limit.py)
+limiter = rate_limit.AsyncRateLimiter(RATE_CLASSES, NO_DB_ENDPOINTS, **rate_limit.rate_limit_config_from_env())
+
+# Эндпоинт текущего запроса - имя запросов к БД в метриках (как request.endpoint во Flask)
+current_endpoint = contextvars.ContextVar('current_endpoint', default='query')
+
+def dumps(obj):
+    """JSON в формате Flask (ключи по алфавиту, даты в формате HTTP)"""
+    return response_layer.dumps(obj)
+
+def json_response(data, status=200):
+    """Аналог jsonify"""
+    with profiling.phase('encode'):
+        body = dumps(data) + '\n'
+    return Response(body, status_code=status, media_type='application/json')
+
+async def init_connection(conn):
+    """json/jsonb как объекты Python (как в psycopg2)"""
+    loads = response_layer.orjson.loads if response_layer.orjson is not None else json.loads
+    for name in ('json', 'jsonb'):
+        await conn.set_type_codec(name, encoder=json.dumps, decoder=loads, schema='pg_catalog')
+
+async def create_pool(config=DB_CONFIG, min_size=None):
+    """Пул asyncpg по DB_CONFIG (или конфигурации реплики) и DB_POOL_*"""
+    return await asyncpg.create_pool(
+        host=config['host'],
+        port=int(config['port']),
+        database=config['database'],
+        user=config['user'],
+        password=config['password'],
+        timeout=config.get('connect_timeout', 60),
+        min_size=POOL_CONFIG['min_size'] if min_size is None else min_size,
+        max_size=POOL_CONFIG['max_size'],
+        max_inactive_connection_lifetime=POOL_CONFIG['max_age'],
+        init=init_connection
+    )
+
+def acquire(db=None):
+    """Соединение из пула db, по умолчанию primary (с тем же ожиданием, что у синхронного пула)"""
+    return (db or pool).acquire(timeout=POOL_CONFIG['timeout'])
+
+async def read_pool(request, written_at=None):
+    """Пул для чтения по политике эндпоинта (см. timeweb_api_simple.read_pool)"""
+    route = request.scope.get('route')
+    policy = PRIMARY
+    if route is not None and request.method in ('GET', 'HEAD'):
+        policy = read_policies.get(route.name, PRIMARY)
+    key = request.path_params.get('telegram_user_id') or request.query_params.get('telegram_user_id')
+    return await router.route(policy, key, written_at)
+
+@contextmanager
+def timed_query(sql=None, params=None):
+    """Запрос к БД в метриках и журнале медленных запросов (имя - эндпоинт)"""
+    name = current_endpoint.get()
+    with metrics.query_timer(name), slow_log.query(name, sql, params):
+        yield
+
+def track_endpoint(endpoint):
+    """Запоминает имя эндпоинта для метрик запросов к БД"""
+    @functools.wraps(endpoint)
+    async def wrapper(request):
+        current_endpoint.set(endpoint.__name__)
+        return await endpoint(request)
+    return wrapper
+
+def remember_writes(endpoint):
+    """После записи чтения пользователя временно идут в primary (read-your-writes)"""
+    @functools.wraps(endpoint)
+    async def wrapper(request):
+        response = await endpoint(request)
+        if response.status_code < 400:
+            for telegram_id in written_telegram_ids(await get_json(request, silent=True)):
+                router.mark_write(telegram_id)
+        return response
+    return wrapper
+
+def row_dict(record):
+    """asyncpg.Record -> dict; UUID строкой, как их отдает psycopg2"""
+    return {key: str(value) if isinstance(value, uuid.UUID) else value for key, value in record.items()}
+
+async def execute_query(sql, params=None, fetch=True, db=None):
+    """Выполнение SQL запроса (результат в формате timeweb_api_simple.execute_query)"""
+    try:
+        async with acquire(db) as conn:
+            with timed_query(sql, params):
+                if fetch:
+                    rows = await conn.fetch(sql, *(params or []))
+                    return {'data': [row_dict(row) for row in rows], 'error': None}
+                await conn.execute(sql, *(params or []))
+                return {'data': [], 'error': None}
+    except CONNECTION_ERRORS as e:
+        print(f"Database connection error: {e}")
+        return {'data': None, 'error': 'Database connection failed'}
+    except Exception as e:
+        return {'data': None, 'error': str(e)}
+
+class RowStreamResponse(StreamingResponse):
+    """
+    StreamingResponse поверх AsyncJsonRowStream: соединение возвращается в пул
+    после отправки, в том числе если клиент отключился до первого куска
+    (генератор тела тогда не запускается и сам его не вернет)
+    """
+
+    def __init__(self, stream, **kwargs):
+        super().__init__(stream, **kwargs)
+        self.stream = stream
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Отмена задачи при обрыве не должна прервать возврат соединения
+            with anyio.CancelScope(shield=True):
+                await self.stream.close()
+
+async def stream_query(sql, params=None, limit=None, cursor_fn=None, raw=False, db=None):
+    """Потоковый ответ {"data": [...]} из курсора (для больших списков)"""
+    stream = AsyncJsonRowStream(db or pool, sql, params, dumps=dumps, batch_size=STREAM_CONFIG['batch_size'],
+                                limit=limit, cursor_fn=cursor_fn, raw=raw, timeout=POOL_CONFIG['timeout'])
+    with timed_query(sql, params):
+        await stream.open()
+    return RowStreamResponse(stream, media_type='application/json')
+
+async def get_json(request, silent=False):
+    """Тело запроса как JSON (аналог request.get_json)"""
+    try:
+        return json.loads(await request.body() or b'null')
+    except ValueError:
+        if silent:
+            return None
+        raise HTTPException(400, 'Failed to decode JSON object')
+
+# ============================================================================
+# СТРАНИЦЫ СПИСКОВ
+# ============================================================================
+
+def page_sql(sql, params, after):
+    """
+    Подстановка условия keyset в {after} и номеров параметров.
+
+    sql содержит {after} и {limit} (номер параметра LIMIT).
+    """
+    params = list(params)
+    after_sql = ''
+    if after:
+        after_sql = f'AND (created_at, id) < (${len(params) + 1}, ${len(params) + 2})'
+        params += [after[0], after[1]]
+    return sql.replace('{after}', after_sql).replace('{limit}', f'${len(params) + 1}'), params
+
+async def fetch_page(sql, params, limit, after=None, db=None):
+    """Одна страница keyset-пагинации (см. timeweb_api_simple.fetch_page)"""
+    sql, params = page_sql(sql, params, after)
+    result = await execute_query(sql, params + [limit + 1], db=db)
+    if result['error']:
+        return result
+
+    rows = result['data']
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+    return {'data': rows, 'error': None, 'next_cursor': next_cursor}
+
+async def json_page_response(columns, dates, from_sql, params, limit, after=None, db=None):
+    """Страница, собранная в JSON в PostgreSQL (см. timeweb_api_simple.fetch_page_json)"""
+    from_sql, params = page_sql(from_sql, params, after)
+    n = len(params)
+    select = ', '.join(dict.fromkeys(columns + ['created_at', 'id']))
+    sql = f"""
+    WITH page AS (
+        SELECT {select}, row_number() OVER (ORDER BY created_at DESC, id DESC) AS rn
+        {from_sql}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ${n + 1}
+    )
+    SELECT
+        '[' || COALESCE(string_agg({json_object_sql(columns, dates)}::text, ',' ORDER BY rn)
+                        FILTER (WHERE rn <= ${n + 2}), '') || ']' AS data,
+        MAX(created_at) FILTER (WHERE rn = ${n + 2}) AS last_created_at,
+        (array_agg(id) FILTER (WHERE rn = ${n + 2}))[1] AS last_id,
+        COUNT(*) > ${n + 2} AS has_more
+    FROM page
+    """
+    try:
+        async with acquire(db) as conn:
+            with timed_query(sql, params):
+                row = await conn.fetchrow(sql, *params, limit + 1, limit)
+    except CONNECTION_ERRORS as e:
+        print(f"Database connection error: {e}")
+        return json_response({'data': [], 'error': 'Database connection failed'}, 500)
+    except Exception as e:
+        return json_response({'data': [], 'error': str(e)}, 500)
+
+    next_cursor = encode_cursor(row['last_created_at'], row['last_id']) if row['has_more'] else None
+    body = '{"data":' + row['data'] + ',"error":null,"next_cursor":' + dumps(next_cursor) + '}\n'
+    return Response(body, media_type='application/json')
+
+async def find_user_id(telegram_id):
+    """Поиск id пользователя по telegram_id (через кеш)"""
+    with profiling.phase('ensure_user'):
+        telegram_id = str(telegram_id)
+        user_id = user_cache.get(telegram_id)
+        if user_id:
+            return user_id
+
+        result = await execute_query("SELECT id FROM users WHERE telegram_id = $1", [telegram_id])
+        if result.get('error'):
+            print('[analytics] find_user_id SELECT error:', result['error'])
+            return None
+
+        if result['data']:
+            user_id = result['data'][0]['id']
+            user_cache.set(telegram_id, user_id)
+            return user_id
+
+        return None
+
+async def page_validators(kind, user_id, limit, cursor=None):
+    """ETag и Last-Modified страницы списка по версии данных пользователя"""
+    version_column, changed_column = DATA_VERSION_COLUMNS[kind]
+    sql = f"SELECT {version_column} AS version, {changed_column} AS changed_at FROM user_activity WHERE user_id = $1"
+    result = await execute_query(sql, [user_id])
+    if result['error']:
+        print('[cache] page_validators SELECT error:', result['error'])
+        return None
+    if not result['data']:
+        return None
+    return page_validators_from_row(kind, user_id, result['data'][0], limit, cursor)
+
+def is_not_modified(request, validators):
+    """Проверка If-None-Match (приоритетно) и If-Modified-Since"""
+    etag, last_modified = validators
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(etag)
+    if_modified_since = parse_date(request.headers.get('if-modified-since'))
+    if if_modified_since is not None:
+        return not modified_since(last_modified, if_modified_since)
+    return False
+
+def conditional_response(response, validators):
+    """ETag/Last-Modified (с точностью до секунды) на ответ; клиент должен перепроверять их при каждом запросе"""
+    if validators and response.status_code in (200, 304):
+        etag, last_modified = validators
+        response.headers['ETag'] = f'W/"{etag}"'
+        if last_modified is not None:
+            response.headers['Last-Modified'] = http_date(last_modified)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def not_modified_response(validators):
+    """Ответ 304 без тела"""
+    return conditional_response(Response(status_code=304), validators)
+
+# ============================================================================
+# ПОЛЬЗОВАТЕЛИ И ВСТАВКИ
+# ============================================================================
+
+# Создание пользователя или получение существующего одним запросом
+# (см. UPSERT_USER_CTE в timeweb_api_simple.py)
+UPSERT_USER_CTE = """
+user_row (telegram_id, username, first_name, last_name) AS (
+    VALUES ($1::text, $2::text, $3::text, $4::text)
+),
+upserted AS (
+    INSERT INTO users (telegram_id, username, first_name, last_name)
+    SELECT * FROM user_row
+    ON CONFLICT (telegram_id) DO UPDATE SET
+        username = COALESCE(users.username, EXCLUDED.username),
+        first_name = COALESCE(users.first_name, EXCLUDED.first_name),
+        last_name = COALESCE(users.last_name, EXCLUDED.last_name)
+    WHERE (users.username IS NULL AND EXCLUDED.username IS NOT NULL)
+       OR (users.first_name IS NULL AND EXCLUDED.first_name IS NOT NULL)
+       OR (users.last_name IS NULL AND EXCLUDED.last_name IS NOT NULL)
+    RETURNING id
+),
+u AS (
+    SELECT id FROM upserted
+    UNION ALL
+    SELECT users.id FROM users JOIN user_row USING (telegram_id)
+    WHERE NOT EXISTS (SELECT 1 FROM upserted)
+)"""
+
+def user_params(telegram_id, user_data=None):
+    """Параметры UPSERT_USER_CTE"""
+    user_data = user_data or {}
+    return [
+        str(telegram_id),
+        user_data.get('username'),
+        user_data.get('first_name'),
+        user_data.get('last_name')
+    ]
+
+async def insert_for_user(telegram_user_id, user_data, insert_sql, params):
+    """
+    Вставка строки пользователя за один запрос (см. timeweb_api_simple.insert_for_user).
+
+    insert_sql - INSERT ... SELECT {user_id}, $2, ... {from_user} RETURNING user_id, ...;
+    параметры строки нумеруются с $2 ($1 - user_id).
+    """
+    telegram_user_id = str(telegram_user_id)
+    user_id = user_cache.get(telegram_user_id)
+
+    if user_id:
+        sql = insert_sql.format(user_id='$1::uuid', from_user='')
+        result = await execute_query(sql, [user_id] + params)
+        if not result['error']:
+            return result
+        # Пользователь мог быть удален - сбрасываем кеш и повторяем полным путем
+        user_cache.invalidate(telegram_user_id)
+
+    # В CTE параметры пользователя занимают $1-$4, параметры строки сдвигаются на 3
+    shifted = re.sub(r'\$(\d+)', lambda m: f'${int(m.group(1)) + 3}', insert_sql)
+    sql = "WITH" + UPSERT_USER_CTE + "\n" + shifted.format(user_id='u.id', from_user='FROM u')
+    result = await execute_query(sql, user_params(telegram_user_id, user_data) + params)
+    if not result['error'] and not result['data']:
+        # Параллельная вставка после снимка запроса (см. timeweb_api_simple.insert_for_user)
+        result = await execute_query(sql, user_params(telegram_user_id, user_data) + params)
+    if result['data']:
+        user_cache.set(telegram_user_id, result['data'][0]['user_id'])
+    return result
+
+async def bulk_insert(valid, results, insert_sql, row_values):
+    """
+    Вставка элементов /bulk одной транзакцией (см. timeweb_api_simple.bulk_insert).
+
+    insert_sql вставляет строки из jsonb-массива $1 (INSERT ... SELECT ... FROM
+    jsonb_array_elements($1) AS r RETURNING id, ...), row_values(item) - dict колонок.
+    """
+    if not valid:
+        return results
+
+    users = bulk_users(valid)
+    row_ids = [str(uuid.uuid4()) for _ in valid]
+
+    def rows_for(user_ids, positions):
+        return [
+            dict(row_values(valid[pos][2]), id=row_ids[pos],
+                 user_id=user_ids[valid[pos][1]], telegram_user_id=valid[pos][1])
+            for pos in positions
+        ]
+
+    inserted = {}
+    errors = {}
+    async with acquire() as conn:
+        async with conn.transaction():
+            user_ids, resolved = await resolve_user_ids_async(conn, users, user_cache)
+            positions = range(len(valid))
+            try:
+                async with conn.transaction():
+                    rows = await conn.fetch(insert_sql, rows_for(user_ids, positions))
+                inserted = {str(row['id']): row_dict(row) for row in rows}
+            except asyncpg.PostgresError as e:
+                print(f"[bulk] batch insert failed, retrying items one by one: {e}")
+
+                # Кеш мог устареть (пользователь удален) - находим всех заново
+                user_ids, resolved = await resolve_user_ids_async(conn, users)
+                for pos, row in zip(positions, rows_for(user_ids, positions)):
+                    try:
+                        async with conn.transaction():
+                            for inserted_row in await conn.fetch(insert_sql, [row]):
+                                inserted[str(inserted_row['id'])] = row_dict(inserted_row)
+                    except asyncpg.PostgresError as item_error:
+                        errors[pos] = str(item_error).strip().splitlines()[0]
+
+    for telegram_id, user_id in resolved.items():
+        user_cache.set(telegram_id, user_id)
+
+    return fill_bulk_results(valid, results, row_ids, inserted, errors)
+
+async def bulk_response(request, insert_sql, row_values, transform=None):
+    """Обработка запроса /bulk: {"data": [результат по элементам], "created", "failed"}"""
+    try:
+        valid, results = parse_bulk_items(await get_json(request, silent=True), API_CONFIG['bulk_max_items'])
+    except ValueError as e:
+        return json_response({'data': None, 'error': str(e)}, 400)
+
+    try:
+        results = await bulk_insert(valid, results, insert_sql, row_values)
+    except CONNECTION_ERRORS as e:
+        print(f"Database connection error: {e}")
+        return json_response({'data': None, 'error': 'Database connection failed'}, 500)
+    except Exception as e:
+        return json_response({'data': None, 'error': str(e)}, 500)
+
+    return json_response(bulk_summary(results, transform))
+
+# ============================================================================
+# ЭНДПОИНТЫ ДЛЯ СОВМЕСТИМОСТИ С ТЕКУЩИМ КОДОМ
+# ============================================================================
+
+STRATEGY_COLUMNS = ['id', 'name', 'description', 'fields', 'created_at', 'updated_at']
+ANALYSIS_COLUMNS = ['id', 'user_id', 'strategy_id', 'coin', 'answers', 'positive_factors',
+                    'negative_factors', 'neutral_factors', 'recommendation', 'created_at']
+
+async def list_page(request, kind, table, columns, dates):
+    """GET списка стратегий/анализов пользователя (keyset, ETag)"""
+    telegram_user_id = request.query_params.get('telegram_user_id')
+
+    if not telegram_user_id:
+        return json_response({'data': [], 'error': None})
+
+    try:
+        limit, after = parse_page_args(
+            request.query_params, API_CONFIG['default_page_size'], API_CONFIG['max_page_size'])
+    except ValueError as e:
+        return json_response({'data': [], 'error': str(e)}, 400)
+
+    user_id = await find_user_id(telegram_user_id)
+    if not user_id:
+        return json_response({'data': [], 'error': None, 'next_cursor': None})
+
+    validators = await page_validators(kind, user_id, limit, request.query_params.get('cursor'))
+    if validators and is_not_modified(request, validators):
+        return not_modified_response(validators)
+
+    # Реплика - только если на ней уже есть последние изменения пользователя
+    db = await read_pool(request, validators[1]) if validators else pool
+
+    if API_CONFIG['json_passthrough']:
+        response = await json_page_response(
+            columns, dates, f"FROM {table} WHERE user_id = $1 {{after}}", [user_id], limit, after, db
+        )
+        return conditional_response(response, validators)
+
+    sql = f"""
+    SELECT {', '.join(columns)}
+    FROM {table}
+    WHERE user_id = $1 {{after}}
+    ORDER BY created_at DESC, id DESC
+    LIMIT {{limit}}
+    """
+    result = await fetch_page(sql, [user_id], limit, after, db)
+
+    if result['error']:
+        return json_response({'data': [], 'error': result['error']}, 500)
+
+    return conditional_response(json_response(result), validators)
+
+async def get_strategies(request):
+    """Получение стратегий пользователя"""
+    return await list_page(request, 'strategies', 'strategies', STRATEGY_COLUMNS, ('created_at', 'updated_at'))
+
+async def create_strategy(request):
+    """Создание новой стратегии"""
+    data = await get_json(request)
+
+    telegram_user_id = data.get('telegram_user_id')
+    if not telegram_user_id:
+        return json_response({'data': None, 'error': 'telegram_user_id is required'}, 400)
+
+    sql = """
+    INSERT INTO strategies (user_id, telegram_user_id, name, description, fields)
+    SELECT {user_id}, $2, $3, $4, $5::jsonb {from_user}
+    RETURNING id, user_id, name, description, fields, created_at, updated_at
+    """
+
+    params = [
+        str(telegram_user_id),
+        data.get('name'),
+        data.get('description'),
+        data.get('fields', [])
+    ]
+
+    result = await insert_for_user(telegram_user_id, data.get('user_data', {}), sql, params)
+
+    if result['error']:
+        return json_response({'data': None, 'error': result['error']}, 500)
+
+    strategy = result['data'][0] if result['data'] else None
+    if strategy:
+        strategy.pop('user_id', None)
+
+    return json_response({'data': strategy, 'error': None})
+
+async def create_strategies_bulk(request):
+    """Создание нескольких стратегий одним запросом (синхронизация офлайн-очереди)"""
+    sql = """
+    INSERT INTO strategies (id, user_id, telegram_user_id, name, description, fields)
+    SELECT (r->>'id')::uuid, (r->>'user_id')::uuid, r->>'telegram_user_id',
+           r->>'name', r->>'description', r->'fields'
+    FROM jsonb_array_elements($1::jsonb) AS r
+    RETURNING id, name, description, fields, created_at, updated_at
+    """
+
+    def row_values(item):
+        return {
+            'name': item.get('name'),
+            'description': item.get('description'),
+            'fields': item.get('fields', [])
+        }
+
+    return await bulk_response(request, sql, row_values)
+
+async def update_strategy(request):
+    """Обновление стратегии"""
+    data = await get_json(request)
+
+    sql = """
+    UPDATE strategies
+    SET name = $1, description = $2, fields = $3, updated_at = NOW()
+    WHERE id = $4
+    RETURNING id, name, description, fields, created_at, updated_at
+    """
+
+    params = [
+        data.get('name'),
+        data.get('description'),
+        data.get('fields', []),
+        request.path_params['strategy_id']
+    ]
+
+    result = await execute_query(sql, params)
+
+    if result['error']:
+        return json_response({'data': None, 'error': result['error']}, 500)
+
+    return json_response({'data': result['data'][0] if result['data'] else None, 'error': None})
+
+async def delete_strategy(request):
+    """Удаление стратегии"""
+    result = await execute_query("DELETE FROM strategies WHERE id = $1",
+                                 [request.path_params['strategy_id']], fetch=False)
+
+    if result['error']:
+        return json_response({'error': result['error']}, 500)
+
+    return json_response({'error': None})
+
+async def get_analyses(request):
+    """Получение анализов пользователя"""
+    return await list_page(request, 'analyses', 'analysis_results', ANALYSIS_COLUMNS, ('created_at',))
+
+async def create_analysis(request):
+    """Создание нового анализа"""
+    data = await get_json(request)
+
+    telegram_user_id = data.get('telegram_user_id')
+    if not telegram_user_id:
+        return json_response({'data': None, 'error': 'telegram_user_id is required'}, 400)
+
+    sql = """
+    INSERT INTO analyses (user_id, telegram_user_id, strategy_id, strategy_name,
+                         coin, answers, results, recommendation)
+    SELECT {user_id}, $2, $3::uuid, $4, $5, $6::jsonb, $7::jsonb, $8 {from_user}
+    RETURNING id, user_id, strategy_id, coin, answers, results, recommendation, created_at
+    """
+
+    params = [
+        str(telegram_user_id),
+        data.get('strategy_id'),
+        data.get('strategy_name'),
+        data.get('coin'),
+        data.get('answers', []),
+        analysis_results_json(data),
+        data.get('recommendation')
+    ]
+
+    result = await insert_for_user(telegram_user_id, data.get('user_data', {}), sql, params)
+
+    if result['error']:
+        return json_response({'data': None, 'error': result['error']}, 500)
+
+    if result['data']:
+        add_analysis_factors(result['data'][0])
+
+    return json_response({'data': result['data'][0] if result['data'] else None, 'error': None})
+
+async def create_analyses_bulk(request):
+    """Создание нескольких анализов одним запросом (синхронизация офлайн-очереди)"""
+    sql = """
+    INSERT INTO analyses (id, user_id, telegram_user_id, strategy_id, strategy_name,
+                         coin, answers, results, recommendation)
+    SELECT (r->>'id')::uuid, (r->>'user_id')::uuid, r->>'telegram_user_id',
+           (r->>'strategy_id')::uuid, r->>'strategy_name', r->>'coin',
+           r->'answers', r->'results', r->>'recommendation'
+    FROM jsonb_array_elements($1::jsonb) AS r
+    RETURNING id, user_id, strategy_id, coin, answers, results, recommendation, created_at
+    """
+
+    def row_values(item):
+        return {
+            'strategy_id': item.get('strategy_id'),
+            'strategy_name': item.get('strategy_name'),
+            'coin': item.get('coin'),
+            'answers': item.get('answers', []),
+            'results': analysis_results_json(item),
+            'recommendation': item.get('recommendation')
+        }
+
+    return await bulk_response(request, sql, row_values, transform=add_analysis_factors)
+
+async def delete_analysis(request):
+    """Удаление анализа"""
+    result = await execute_query("DELETE FROM analyses WHERE id = $1",
+                                 [request.path_params['analysis_id']], fetch=False)
+
+    if result['error']:
+        return json_response({'error': result['error']}, 500)
+
+    return json_response({'error': None})
+
+async def get_users(request):
+    """Получение пользователей (для поиска по telegram_id)"""
+    telegram_id = request.query_params.get('telegram_user_id')
+
+    if not telegram_id:
+        return json_response({'data': [], 'error': None})
+
+    sql = "SELECT id, telegram_id, username, first_name, last_name, created_at FROM users WHERE telegram_id = $1"
+    result = await execute_query(sql, [telegram_id])
+
+    if result['error']:
+        return json_response({'data': [], 'error': result['error']}, 500)
+
+    return json_response(result)
+
+async def create_user(request):
+    """Создание нового пользователя"""
+    data = await get_json(request)
+
+    telegram_id = data.get('telegram_id')
+    if not telegram_id:
+        return json_response({'data': None, 'error': 'telegram_id is required'}, 400)
+    telegram_id = str(telegram_id)
+
+    create_sql = """
+    INSERT INTO users (telegram_id, username, first_name, last_name)
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT (telegram_id) DO NOTHING
+    RETURNING id, telegram_id, username, first_name, last_name, created_at
+    """
+    check_sql = "SELECT id, telegram_id, username, first_name, last_name, created_at FROM users WHERE telegram_id = $1"
+
+    try:
+        async with acquire() as conn:
+            async with conn.transaction():
+                row = (await conn.fetchrow(create_sql, telegram_id, data.get('username'),
+                                           data.get('first_name'), data.get('last_name'))
+                       or await conn.fetchrow(check_sql, telegram_id))
+    except CONNECTION_ERRORS as e:
+        print(f"Database connection error: {e}")
+        return json_response({'data': None, 'error': 'Database connection failed'}, 500)
+    except Exception as e:
+        return json_response({'data': None, 'error': str(e)}, 500)
+
+    user = row_dict(row) if row else None
+    if user:
+        user_cache.set(telegram_id, user['id'])
+
+    return json_response({'data': user, 'error': None})
+
+async def create_user_event(request):
+    """Создание события пользователя (аналитика): событие ставится в очередь и пишется пачкой"""
+    try:
+        telegram_user_id, event_type, event_data, user_data = parse_user_event(
+            await get_json(request, silent=True), API_CONFIG['event_type_max_length'])
+    except ValueError as e:
+        return json_response({'data': None, 'error': str(e)}, 400)
+
+    event = event_buffer.submit(telegram_user_id, event_type, event_data, user_data)
+
+    if event is None:
+        # Буфер переполнен (БД не успевает) - просим клиента повторить позже
+        response = json_response({'data': None, 'error': 'Event buffer is full'}, 503)
+        response.headers['Retry-After'] = str(max(1, int(event_buffer.flush_interval)))
+        return response
+
+    return json_response({'data': event, 'error': None}, 202)
+
+# Счетчики пользователя из user_activity (см. timeweb_api_simple.get_user_stats)
+USER_STATS_SQL = """
+SELECT strategies_count AS strategies, analyses_count AS analyses FROM user_activity WHERE user_id = $1::uuid
+"""
+
+USER_STATS_BY_TELEGRAM_ID_SQL = """
+SELECT u.id AS user_id, ua.strategies_count AS strategies, ua.analyses_count AS analyses
+FROM users u
+LEFT JOIN user_activity ua ON ua.user_id = u.id
+WHERE u.telegram_id = $1
+"""
+
+async def get_user_stats(request):
+    """Получение статистики пользователя (одно чтение user_activity по ключу)"""
+    telegram_user_id = request.path_params['telegram_user_id']
+    user_id = user_cache.get(telegram_user_id)
+    if user_id:
+        result = await execute_query(USER_STATS_SQL, [user_id], db=await read_pool(request))
+    else:
+        result = await execute_query(USER_STATS_BY_TELEGRAM_ID_SQL, [telegram_user_id], db=await read_pool(request))
+        if result['data']:
+            user_cache.set(telegram_user_id, result['data'][0]['user_id'])
+
+    if result['error']:
+        return json_response({'data': {'strategies': 0, 'analyses': 0}, 'error': result['error']})
+
+    row = result['data'][0] if result['data'] else {}
+    stats = {'strategies': row.get('strategies') or 0, 'analyses': row.get('analyses') or 0}
+    return json_response({'data': stats, 'error': None})
+
+# ============================================================================
+# СЛУЖЕБНЫЕ ЭНДПОИНТЫ
+# ============================================================================
+
+async def health_check(request):
+    """Проверка здоровья API (состояние из фоновой проверки, без запроса к БД)"""
+    status = health.status()
+    body = {
+        'status': status['status'],
+        'reasons': status['reasons'],
+        'timestamp': datetime.now().isoformat(),
+        'database': 'connected' if health.ready(status) else 'disconnected',
+        'db': status['database'],
+        'pool': status['pool'],
+        'user_cache': user_cache.stats(),
+        'events': event_buffer.stats()
+    }
+    if not health.ready(status):
+        body['error'] = 'Database connection failed'
+        return json_response(body, 500)
+    return json_response(body)
+
+async def health_live(request):
+    """Liveness: воркер отвечает (БД не проверяется)"""
+    return json_response(health.live())
+
+async def health_ready(request):
+    """Readiness: 503, если БД недоступна по последним фоновым проверкам"""
+    status = health.status()
+    return json_response(status, 200 if health.ready(status) else 503)
+
+async def api_info(request):
+    """Информация об API"""
+    return json_response(api_info_data())
+
+async def api_metrics(request):
+    """Метрики в формате Prometheus"""
+    body, content_type = metrics.render()
+    if body is None:
+        return Response('metrics are disabled or prometheus_client is not installed\n',
+                        status_code=503, media_type='text/plain')
+    return Response(body, headers={'Content-Type': content_type})
+
+async def admin_stats(request):
+    """Статистика для админ-панели"""
+    try:
+        return json_response(await admin_counters.get())
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+async def admin_stats_reconcile(request):
+    """Сверка счетчиков с точным пересчетом"""
+    try:
+        return json_response({'data': await admin_counters.reconcile(), 'error': None})
+    except Exception as e:
+        return json_response({'data': None, 'error': str(e)}, 500)
+
+async def admin_users_by_date(request):
+    """Пользователи по датам (для графика) - из дневных итогов daily_rollups"""
+    try:
+        start_date = request.query_params.get('start_date')
+        end_date = request.query_params.get('end_date')
+
+        sql = """
+            SELECT day as date, strategy_users as users_count
+            FROM daily_rollups
+            WHERE strategy_users > 0
+        """
+
+        params = []
+        if start_date and end_date:
+            sql += " AND day BETWEEN $1::text::date AND $2::text::date"
+            params = [start_date, end_date]
+
+        sql += " ORDER BY day"
+
+        return await stream_query(sql, params, db=await read_pool(request))
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+async def admin_daily(request):
+    """Дневные итоги: новые и активные пользователи, стратегии, анализы, события"""
+    try:
+        start_date = request.query_params.get('start_date')
+        end_date = request.query_params.get('end_date')
+
+        sql = """
+            SELECT day, new_users, active_users, strategy_users, strategies_created,
+                   analyses_created, events, events_by_type
+            FROM daily_rollups
+        """
+
+        params = []
+        if start_date and end_date:
+            sql += " WHERE day BETWEEN $1::text::date AND $2::text::date"
+            params = [start_date, end_date]
+
+        sql += " ORDER BY day"
+
+        return await stream_query(sql, params, db=await read_pool(request))
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+async def admin_cohorts(request):
+    """Недельные когорты: удержание по неделе регистрации"""
+    try:
+        weeks = int(request.query_params.get('weeks', rollups.DEFAULT_COHORT_WEEKS))
+        if weeks < 1:
+            raise ValueError('weeks must be positive')
+    except ValueError as e:
+        return json_response({'error': f"Invalid weeks: {e}"}, 400)
+
+    result = await execute_query(rollups.COHORTS_ASYNC_SQL, [rollups.cohorts_since(weeks)],
+                                 db=await read_pool(request))
+    if result['error']:
+        return json_response({'data': None, 'error': result['error']}, 500)
+    return json_response({'data': rollups.cohort_table(result['data']), 'error': None})
+
+async def admin_rollups_refresh(request):
+    """Пересчет дневных итогов (хвост или ?from=YYYY-MM-DD); обычно - по cron"""
+    try:
+        from_day = rollups.parse_day(request.query_params.get('from'))
+    except ValueError as e:
+        return json_response({'error': f"Invalid from: {e}"}, 400)
+
+    result = await execute_query(rollups.REFRESH_ASYNC_SQL, [from_day])
+    if result['error']:
+        return json_response({'data': None, 'error': result['error']}, 500)
+    # Пустой результат - пересчет уже идет в другой сессии
+    return json_response({'data': result['data'][0] if result['data'] else None, 'error': None})
+
+async def admin_users_list(request):
+    """Список всех пользователей с детальной информацией"""
+    try:
+        user_type = request.query_params.get('type', 'all')  # all, active
+        sort = request.query_params.get('sort', 'created_at')
+
+        if sort not in USER_LIST_SORTS:
+            return json_response({'error': f"Unknown sort: {sort}"}, 400)
+        sort_expr, parse_value = USER_LIST_SORTS[sort]
+
+        # Без limit отдается весь список (потоком), с limit - страница и next_cursor
+        try:
+            limit = request.query_params.get('limit')
+            limit = int(limit) if limit else None
+            if limit is not None and limit < 1:
+                raise ValueError('limit must be positive')
+            if limit is not None:
+                limit = min(limit, API_CONFIG['max_page_size'])
+            cursor = request.query_params.get('cursor')
+            after = decode_cursor(cursor, parse_value) if cursor else None
+        except ValueError as e:
+            return json_response({'error': str(e)}, 400)
+
+        conditions = []
+        params = []
+        if user_type == 'active':
+            conditions.append("ua.strategies_count > 0")
+        if after:
+            conditions.append(f"({sort_expr}, ua.user_id) < ($1, $2::uuid)")
+            params += [after[0], after[1]]
+
+        sql = f"""
+            SELECT
+                u.id,
+                u.telegram_id,
+                u.username,
+                u.first_name,
+                u.last_name,
+                u.created_at,
+                ua.strategies_count,
+                ua.analyses_count,
+                ua.last_activity
+            FROM user_activity ua
+            JOIN users u ON u.id = ua.user_id
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY {sort_expr} DESC, ua.user_id DESC
+        """
+        if limit:
+            params.append(limit + 1)
+            sql += f" LIMIT ${len(params)}"
+
+        def cursor_fn(row):
+            return encode_cursor(row[sort] if row[sort] is not None else EPOCH, row['id'])
+
+        return await stream_query(sql, params, limit=limit, cursor_fn=cursor_fn, db=await read_pool(request))
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+async def admin_user_details(request):
+    """Детальная информация о стратегиях или анализах пользователя"""
+    try:
+        user_id = request.query_params.get('user_id')
+        detail_type = request.query_params.get('type')  # strategies, analyses
+
+        if not user_id or not detail_type:
+            return json_response({'error': 'Missing user_id or type parameter'}, 400)
+
+        if detail_type == 'strategies':
+            columns = ['id', 'name', 'description', 'fields', 'created_at']
+            sql = """
+                SELECT id, name, description, fields, created_at
+                FROM strategies
+                WHERE user_id = $1::uuid
+            """
+        else:  # analyses
+            columns = ['id', 'created_at', 'recommendation', 'positive_factors',
+                       'negative_factors', 'neutral_factors', 'strategy_name']
+            sql = """
+                SELECT
+                    a.id,
+                    a.created_at,
+                    a.recommendation,
+                    a.positive_factors,
+                    a.negative_factors,
+                    a.neutral_factors,
+                    s.name as strategy_name
+                FROM analyses a
+                LEFT JOIN strategies s ON a.strategy_id = s.id
+                WHERE a.user_id = $1::uuid
+            """
+
+        if API_CONFIG['json_passthrough']:
+            return await stream_query(row_json_sql(sql, columns, ('created_at',), 'ORDER BY t.created_at DESC'),
+                                      [user_id], raw=True, db=await read_pool(request))
+        return await stream_query(sql + " ORDER BY created_at DESC", [user_id], db=await read_pool(request))
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+async def admin_check_duplicates(request):
+    """Проверка дубликатов пользователей и потерянных стратегий"""
+    try:
+        username = request.query_params.get('username')
+
+        if username:
+            sql = """
+                SELECT
+                    u.id,
+                    u.telegram_id,
+                    u.username,
+                    u.first_name,
+                    u.created_at,
+                    COALESCE(ua.strategies_count, 0) as strategies_count,
+                    COALESCE(ua.analyses_count, 0) as analyses_count
+                FROM users u
+                LEFT JOIN user_activity ua ON ua.user_id = u.id
+                WHERE u.username = $1
+                ORDER BY u.created_at DESC
+            """
+            result = await execute_query(sql, [username], db=await read_pool(request))
+        else:
+            sql = """
+                SELECT
+                    username,
+                    COUNT(*) as count,
+                    STRING_AGG(telegram_id::TEXT, ', ') as telegram_ids
+                FROM users
+                WHERE username IS NOT NULL AND username != ''
+                GROUP BY username
+                HAVING COUNT(*) > 1
+                ORDER BY count DESC
+            """
+            result = await execute_query(sql, [], db=await read_pool(request))
+
+        return json_response({'data': result['data'] if result['data'] else []})
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+async def admin_user_cache_stats(request):
+    """Статистика кеша пользователей"""
+    return json_response({'data': user_cache.stats(), 'error': None})
+
+async def admin_user_cache_invalidate(request):
+    """Сброс кеша пользователей (одной записи или целиком)"""
+    data = await get_json(request, silent=True) or {}
+    telegram_id = data.get('telegram_id') or request.query_params.get('telegram_id')
+    removed = user_cache.invalidate(telegram_id)
+    return json_response({'data': {'removed': removed}, 'error': None})
+
+async def admin_replicas_stats(request):
+    """Состояние реплик и распределение чтений"""
+    return json_response({'data': dict(router.stats(), policies=read_policies), 'error': None})
+
+async def admin_slow_queries(request):
+    """Медленные запросы воркера: по отпечаткам SQL и последние"""
+    return json_response({'data': slow_log.stats(), 'error': None})
+
+async def admin_profiles(request):
+    """Профили запросов (X-Profile), сохраненные в этом воркере"""
+    return json_response({'data': {'enabled': profiler.enabled, 'profiles': profiler.list()}, 'error': None})
+
+async def admin_profile(request):
+    """Профиль запроса; ?format=folded - стеки для flamegraph/speedscope"""
+    profile = profiler.get(request.path_params['profile_id'])
+    if profile is None:
+        return json_response({'data': None, 'error': 'Profile not found'}, 404)
+    if request.query_params.get('format') == 'folded':
+        return Response(profile['folded'], media_type='text/plain')
+    return json_response({'data': profile, 'error': None})
+
+async def admin_rate_limits(request):
+    """Лимиты запросов воркера и число отклоненных запросов"""
+    return json_response({'data': limiter.stats(), 'error': None})
+
+async def admin_events_stats(request):
+    """Статистика очереди событий аналитики"""
+    return json_response({'data': event_buffer.stats(), 'error': None})
+
+async def admin_events_flush(request):
+    """Немедленная запись накопленных событий"""
+    try:
+        return json_response({'data': {'flushed': await event_buffer.flush()}, 'error': None})
+    except Exception as e:
+        return json_response({'data': None, 'error': str(e)}, 500)
+
+# ============================================================================
+# ПРИЛОЖЕНИЕ
+# ============================================================================
+
+@asynccontextmanager
+async def lifespan(app):
+    """Пул, счетчики, очередь событий и проверка здоровья на время жизни воркера"""
+    global pool, router, admin_counters, event_buffer, health
+    pool = await create_pool()
+    # Реплики подключаются лениво (min_size=0): недоступная реплика не мешает старту
+    replicas = {replica_name(config): await create_pool(config, min_size=0)
+                for config in replica_configs_from_env(DB_CONFIG)}
+    router = AsyncReplicaRouter(pool, replicas, connect_errors=CONNECTION_ERRORS,
+                                timeout=POOL_CONFIG['timeout'], **router_config_from_env())
+    admin_counters = AsyncAdminCounters(pool)
+    event_buffer = AsyncEventBuffer(pool, user_cache, **events_config_from_env())
+    health = AsyncHealthMonitor(pool, timeout=POOL_CONFIG['timeout'], **health_config_from_env())
+    await health.start()
+    await router.start()
+    print(f"[async] pool ready: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}")
+    try:
+        yield
+    finally:
+        await router.stop()
+        await health.stop()
+        await event_buffer.stop()
+        for replica in replicas.values():
+            await replica.close()
+        await pool.close()
+
+routes = [
+    Route('/api/strategies', get_strategies, methods=['GET']),
+    Route('/api/strategies', create_strategy, methods=['POST']),
+    Route('/api/strategies/bulk', create_strategies_bulk, methods=['POST']),
+    Route('/api/strategies/{strategy_id}', update_strategy, methods=['PUT']),
+    Route('/api/strategies/{strategy_id}', delete_strategy, methods=['DELETE']),
+    Route('/api/analysis_results', get_analyses, methods=['GET']),
+    Route('/api/analysis_results', create_analysis, methods=['POST']),
+    Route('/api/analysis_results/bulk', create_analyses_bulk, methods=['POST']),
+    Route('/api/analysis_results/{analysis_id}', delete_analysis, methods=['DELETE']),
+    Route('/api/users', get_users, methods=['GET']),
+    Route('/api/users', create_user, methods=['POST']),
+    Route('/api/user_events', create_user_event, methods=['POST']),
+    Route('/api/users/stats/{telegram_user_id}', get_user_stats),
+    Route('/api/health', health_check),
+    Route('/api/health/live', health_live),
+    Route('/api/health/ready', health_ready),
+    Route('/api/info', api_info),
+    Route('/api/metrics', api_metrics),
+    Route('/api/admin/stats', admin_stats),
+    Route('/api/admin/stats/reconcile', admin_stats_reconcile, methods=['POST']),
+    Route('/api/admin/users_by_date', admin_users_by_date),
+    Route('/api/admin/daily', admin_daily),
+    Route('/api/admin/cohorts', admin_cohorts),
+    Route('/api/admin/rollups/refresh', admin_rollups_refresh, methods=['POST']),
+    Route('/api/admin/users_list', admin_users_list),
+    Route('/api/admin/user_details', admin_user_details),
+    Route('/api/admin/check_duplicates', admin_check_duplicates),
+    Route('/api/admin/user_cache', admin_user_cache_stats, methods=['GET']),
+    Route('/api/admin/user_cache/invalidate', admin_user_cache_invalidate, methods=['POST']),
+    Route('/api/admin/replicas', admin_replicas_stats, methods=['GET']),
+    Route('/api/admin/slow_queries', admin_slow_queries, methods=['GET']),
+    Route('/api/admin/profiles', admin_profiles, methods=['GET']),
+    Route('/api/admin/profiles/{profile_id}', admin_profile, methods=['GET']),
+    Route('/api/admin/rate_limits', admin_rate_limits, methods=['GET']),
+    Route('/api/admin/events', admin_events_stats, methods=['GET']),
+    Route('/api/admin/events/flush', admin_events_flush, methods=['POST']),
+]
+
+# Эндпоинты записи запоминают пользователя для read-your-writes,
+# все эндпоинты - свое имя для метрик запросов к БД и проходят rate_limit
+routes = [
+    Route(route.path, track_endpoint(rate_limit.limit_endpoint(
+        limiter,
+        remember_writes(route.endpoint) if route.name in STICKY_WRITE_ENDPOINTS else route.endpoint,
+        json_response
+    )), methods=route.methods)
+    for route in routes
+]
+
+def build_middleware():
+    """Метрики, журнал медленных запросов, CORS как у flask_cors и gzip с настройками response_layer"""
+    middleware = [Middleware(MetricsMiddleware, metrics=metrics),
+                  Middleware(profiling.ProfilingMiddleware, slow_log=slow_log, profiler=profiler),
+                  Middleware(CORSMiddleware, allow_origins=CORS_ORIGINS, allow_methods=['*'], allow_headers=['*'])]
+    settings = response_layer.response_config_from_env()
+    if settings['compress']:
+        middleware.append(Middleware(GZipMiddleware, minimum_size=settings['min_size'],
+                                     compresslevel=settings['gzip_level']))
+    return middleware
+
+app = Starlette(routes=routes, middleware=build_middleware(), lifespan=lifespan)
+
+# ============================================================================
+# ЗАПУСК ПРИЛОЖЕНИЯ
+# ============================================================================
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("🚀 Starting TradeAnalyzer async API server...")
+    print(f"📊 Database: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}")
+    uvicorn.run(app, host='0.0.0.0', port=5000)
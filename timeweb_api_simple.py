@@ -4,7 +4,7 @@
 Совместимость с текущим кодом приложения
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, has_request_context, request, jsonify, stream_with_context
 from flask_cors import CORS
 import psycopg2
 import psycopg2.extras
@@ -12,11 +12,40 @@ import os
 import json
 from datetime import datetime
 import uuid
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
+from api_common import (
+    DATA_VERSION_COLUMNS, EPOCH, NO_DB_ENDPOINTS, RATE_CLASSES, READ_POLICIES, STICKY_WRITE_ENDPOINTS,
+    USER_LIST_SORTS, add_analysis_factors, analysis_results_json, api_config_from_env, api_info_data,
+    bulk_summary, bulk_users, decode_cursor, encode_cursor, fill_bulk_results, json_object_sql,
+    modified_since, page_validators_from_row, parse_bulk_items, parse_page_args, parse_user_event,
+    row_json_sql, written_telegram_ids
+)
+from db_pool import ConnectionPool, PoolError, pool_config_from_env
+from db_router import (
+    PRIMARY, ReplicaRouter, read_policies_from_env, replica_configs_from_env, replica_name,
+    router_config_from_env
+)
+import profiling
+import rate_limit
+import response_layer
+import rollups
+from metrics import Metrics, init_app as init_metrics, metrics_config_from_env
+from user_cache import UserIdCache, resolve_user_ids, user_cache_config_from_env
+from json_stream import JsonRowStream, stream_config_from_env
+from stats_counters import AdminCounters
+from events_ingest import create_event_buffer
+from health import HealthMonitor, health_config_from_env
+from statements import StatementRegistry, statements_config_from_env
+
 # Загрузка переменных окружения
 load_dotenv()
 
+# Списки и /bulk: размер страниц, JSON из PostgreSQL, предел элементов
+API_CONFIG = api_config_from_env()
+STREAM_CONFIG = stream_config_from_env()
+
 app = Flask(__name__)
 CORS(app, origins=[
     'https://moscowfactory-tech.github.io',
@@ -24,6 +53,21 @@ CORS(app, origins=[
     'http://127.0.0.1:8000'
 ])
 
+# Быстрый JSON и сжатие ответов (response_layer.py)
+response_layer.init_app(app)
+
+# Метрики Prometheus для /api/metrics (metrics.py)
+metrics = init_metrics(app, Metrics(**metrics_config_from_env()))
+
+# Журнал медленных запросов и профилирование по X-Profile (profiling.py)
+slow_log = profiling.SlowLog(**profiling.slow_log_config_from_env())
+profiler = profiling.RequestProfiler(**profiling.profiler_config_from_env())
+profiling.init_app(app, slow_log, profiler)
+
+# Ограничение частоты запросов и сброс нагрузки: 429/503 с Retry-After (rate_limit.py)
+limiter = rate_limit.init_app(app, rate_limit.RateLimiter(RATE_CLASSES, NO_DB_ENDPOINTS,
+                                                          **rate_limit.rate_limit_config_from_env()))
+
 # Конфигурация БД
 DB_CONFIG = {
     'host': os.getenv('DB_HOST', 'localhost'),
@@ -33,71 +77,410 @@ DB_CONFIG = {
     'password': os.getenv('DB_PASSWORD', 'SECURE_PASSWORD_2024!')
 }
 
-def get_db_connection():
-    """Создание подключения к БД"""
+# Пул соединений (общий для всех потоков воркера)
+pool = ConnectionPool(DB_CONFIG, **pool_config_from_env())
+metrics.instrument_pool(pool, 'primary')
+profiling.instrument_pool(pool)
+
+# Реплики для чтения (DB_REPLICAS) и выбор пула по политике эндпоинта (db_router.py)
+replica_pools = {replica_name(config): ConnectionPool(config, **pool_config_from_env())
+                 for config in replica_configs_from_env(DB_CONFIG)}
+for name, replica_pool in replica_pools.items():
+    metrics.instrument_pool(replica_pool, name)
+    profiling.instrument_pool(replica_pool)
+router = ReplicaRouter(pool, replica_pools, **router_config_from_env())
+read_policies = read_policies_from_env(READ_POLICIES)
+
+# Кеш telegram_id -> users.id (на воркер)
+user_cache = UserIdCache(**user_cache_config_from_env())
+
+# Итоги для /api/admin/stats (поддерживаются триггерами в БД)
+admin_counters = AdminCounters(pool)
+
+# Очередь событий аналитики (запись пачками в фоновом потоке)
+event_buffer = create_event_buffer(pool, user_cache)
+
+# Состояние БД и пула для /api/health* - проверяется фоновым потоком (health.py)
+health = HealthMonitor(pool, **health_config_from_env())
+
+# Горячие запросы подготавливаются один раз на соединение пула (statements.py)
+statements = StatementRegistry(**statements_config_from_env())
+
+def read_pool(written_at=None):
+    """
+    Пул для чтения в текущем запросе по политике эндпоинта (read_policies).
+    
+    written_at - время последнего изменения читаемых данных (changed_at из
+    user_activity): реплика выбирается, только если она уже их получила.
+    """
+    policy = read_policies.get(request.endpoint, PRIMARY) if request.method in ('GET', 'HEAD') else PRIMARY
+    key = (request.view_args or {}).get('telegram_user_id') or request.args.get('telegram_user_id')
+    return router.route(policy, key, written_at)
+
+@app.after_request
+def remember_user_writes(response):
+    """После записи чтения пользователя временно идут в primary (read-your-writes)"""
+    if request.endpoint in STICKY_WRITE_ENDPOINTS and response.status_code < 400:
+        for telegram_id in written_telegram_ids(request.get_json(silent=True)):
+            router.mark_write(telegram_id)
+    return response
+
+def query_name():
+    """Имя запроса в метриках для execute_query: эндпоинт текущего запроса"""
+    if has_request_context() and request.endpoint:
+        return request.endpoint
+    return 'query'
+
+@contextmanager
+def timed_query(name, sql=None, params=None):
+    """Запрос к БД в метриках и журнале медленных запросов"""
+    with metrics.query_timer(name), slow_log.query(name, sql, params):
+        yield
+
+def execute_query(sql, params=None, fetch=True, db=None, name=None):
+    """Выполнение SQL запроса (db - пул, по умолчанию primary; name - имя в метриках)"""
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
+        with (db or pool).connection() as conn:
+            with timed_query(name or query_name(), sql, params):
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    cur.execute(sql, params or [])
+                    
+                    if fetch:
+                        rows = cur.fetchall()
+                        result = [dict(row) for row in rows]
+                    else:
+                        result = []
+                        
+                conn.commit()
+            return {'data': result, 'error': None}
+            
+    except PoolError as e:
+        print(f"Database connection error: {e}")
+        return {'data': None, 'error': 'Database connection failed'}
     except Exception as e:
+        # Откат транзакции выполняет пул при возврате соединения
+        return {'data': None, 'error': str(e)}
+
+def execute_statement(name, params=None, fetch=True, db=None):
+    """Выполнение запроса из реестра statements (результат как у execute_query)"""
+    try:
+        with (db or pool).connection() as conn:
+            with timed_query(name, statements.get(name).sql, params):
+                rows = statements.fetchall(conn, name, params or [], psycopg2.extras.RealDictCursor)
+                conn.commit()
+            result = [dict(row) for row in rows] if fetch else []
+            return {'data': result, 'error': None}
+    except PoolError as e:
         print(f"Database connection error: {e}")
-        return None
+        return {'data': None, 'error': 'Database connection failed'}
+    except Exception as e:
+        return {'data': None, 'error': str(e)}
+
+class UnitOfWork:
+    """Несколько запросов на одном соединении в одной транзакции"""
+    
+    def __init__(self, conn):
+        self.conn = conn
+    
+    def execute(self, sql, params=None, fetch=True):
+        """Выполнение запроса внутри транзакции"""
+        with slow_log.query(query_name(), sql, params):
+            with self.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute(sql, params or [])
+                if fetch:
+                    return [dict(row) for row in cur.fetchall()]
+                return []
+
+@contextmanager
+def unit_of_work():
+    """Транзакция: COMMIT по выходу из блока, ROLLBACK при исключении"""
+    with pool.connection() as conn:
+        with metrics.query_timer(query_name()):
+            yield UnitOfWork(conn)
+            conn.commit()
 
-def execute_query(sql, params=None, fetch=True):
-    """Выполнение SQL запроса"""
-    conn = get_db_connection()
-    if not conn:
+def execute_transaction(work):
+    """Выполнение work(uow) в одной транзакции, результат в формате execute_query"""
+    try:
+        with unit_of_work() as uow:
+            result = work(uow)
+        return {'data': result, 'error': None}
+    except PoolError as e:
+        print(f"Database connection error: {e}")
         return {'data': None, 'error': 'Database connection failed'}
+    except Exception as e:
+        return {'data': None, 'error': str(e)}
+
+def stream_query(sql, params=None, limit=None, cursor_fn=None, raw=False, db=None):
+    """Потоковый ответ {"data": [...]} из серверного курсора (для больших списков)"""
+    stream = JsonRowStream(db or pool, sql, params, dumps=app.json.dumps, batch_size=STREAM_CONFIG['batch_size'],
+                           limit=limit, cursor_fn=cursor_fn, raw=raw)
+    # В метриках - время до первой пачки строк (дальше идет передача ответа)
+    with timed_query(query_name(), sql, params):
+        stream.open()
+    response = Response(stream_with_context(stream), mimetype='application/json')
+    # Соединение возвращается и если тело не читалось (HEAD, обрыв до первого куска)
+    response.call_on_close(stream.close)
+    return response
+
+# ============================================================================
+# JSON НА СТОРОНЕ POSTGRESQL
+# ============================================================================
+
+# Условие keyset-пагинации (сортировка created_at DESC, id DESC)
+KEYSET_AFTER_SQL = 'AND (created_at, id) < (%s, %s)'
+
+def page_json_sql(columns, dates, from_sql):
+    """
+    Страница, собранная в JSON в PostgreSQL: from_sql - FROM ... WHERE ...,
+    параметры после параметров from_sql - limit + 1 и четыре раза limit.
+    """
+    select = ', '.join(dict.fromkeys(columns + ['created_at', 'id']))
+    
+    # limit + 1 строк: лишняя означает, что есть следующая страница
+    return f"""
+    WITH page AS (
+        SELECT {select}, row_number() OVER (ORDER BY created_at DESC, id DESC) AS rn
+        {from_sql}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    )
+    SELECT
+        '[' || COALESCE(string_agg({json_object_sql(columns, dates)}::text, ',' ORDER BY rn)
+                        FILTER (WHERE rn <= %s), '') || ']' AS data,
+        MAX(created_at) FILTER (WHERE rn = %s) AS last_created_at,
+        (array_agg(id) FILTER (WHERE rn = %s))[1] AS last_id,
+        COUNT(*) > %s AS has_more
+    FROM page
+    """
+
+def register_page_statements(kind, table, columns, dates):
+    """
+    Запросы страницы списка пользователя: {kind}_page и {kind}_page_json
+    (первая страница) и они же с суффиксом _after (следующие страницы по курсору)
+    """
+    for suffix, after, after_types in (('', '', []), ('_after', KEYSET_AFTER_SQL, ['timestamptz', 'uuid'])):
+        statements.register(f'{kind}_page{suffix}', f"""
+            SELECT {', '.join(columns)}
+            FROM {table}
+            WHERE user_id = %s {after}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, ['uuid'] + after_types + ['integer'])
+        statements.register(
+            f'{kind}_page_json{suffix}',
+            page_json_sql(columns, dates, f"FROM {table} WHERE user_id = %s {after}"),
+            ['uuid'] + after_types + ['integer'] * 5
+        )
+
+def fetch_page_json(kind, params, limit, after=None, db=None):
+    """
+    Страница keyset-пагинации, собранная в JSON в PostgreSQL ({kind}_page_json).
     
+    Возвращает тело ответа в формате fetch_page ({"data", "error", "next_cursor"})
+    строкой - строки списка не превращаются в объекты Python.
+    """
+    name = f'{kind}_page_json'
+    if after:
+        name += '_after'
+        params = params + [after[0], after[1]]
+    
+    with (db or pool).connection() as conn:
+        with timed_query(name, statements.get(name).sql, params):
+            [(data, last_created_at, last_id, has_more)] = statements.fetchall(
+                conn, name, params + [limit + 1, limit, limit, limit, limit]
+            )
+            conn.commit()
+    
+    next_cursor = encode_cursor(last_created_at, last_id) if has_more else None
+    return '{"data":' + data + ',"error":null,"next_cursor":' + app.json.dumps(next_cursor) + '}\n'
+
+def json_page_response(kind, params, limit, after=None, db=None):
+    """Ответ со страницей из fetch_page_json; ошибки - как у fetch_page"""
     try:
+        body = fetch_page_json(kind, params, limit, after, db)
+    except PoolError as e:
+        print(f"Database connection error: {e}")
+        error = 'Database connection failed'
+    except Exception as e:
+        error = str(e)
+    else:
+        return Response(body, mimetype='application/json')
+    
+    response = jsonify({'data': [], 'error': error})
+    response.status_code = 500
+    return response
+
+# Создание пользователя или получение существующего одним запросом.
+# Существующая строка обновляется, только если дозаполняются пустые поля
+# (иначе каждый промах кеша переписывал бы строку и updated_at); id
+# существующего берется из users в том же запросе. Это CTE: его можно
+# подставить в начало INSERT ... SELECT u.id ... FROM u.
+UPSERT_USER_CTE = """
+user_row (telegram_id, username, first_name, last_name) AS (
+    VALUES (%s::text, %s::text, %s::text, %s::text)
+),
+upserted AS (
+    INSERT INTO users (telegram_id, username, first_name, last_name)
+    SELECT * FROM user_row
+    ON CONFLICT (telegram_id) DO UPDATE SET
+        username = COALESCE(users.username, EXCLUDED.username),
+        first_name = COALESCE(users.first_name, EXCLUDED.first_name),
+        last_name = COALESCE(users.last_name, EXCLUDED.last_name)
+    WHERE (users.username IS NULL AND EXCLUDED.username IS NOT NULL)
+       OR (users.first_name IS NULL AND EXCLUDED.first_name IS NOT NULL)
+       OR (users.last_name IS NULL AND EXCLUDED.last_name IS NOT NULL)
+    RETURNING id
+),
+u AS (
+    SELECT id FROM upserted
+    UNION ALL
+    SELECT users.id FROM users JOIN user_row USING (telegram_id)
+    WHERE NOT EXISTS (SELECT 1 FROM upserted)
+)"""
+
+UPSERT_USER_SQL = "WITH" + UPSERT_USER_CTE + "\nSELECT id FROM u"
+
+statements.register('upsert_user', UPSERT_USER_SQL, ['text', 'text', 'text', 'text'])
+
+def user_params(telegram_id, user_data=None):
+    """Параметры UPSERT_USER_SQL"""
+    user_data = user_data or {}
+    return [
+        str(telegram_id),
+        user_data.get('username'),
+        user_data.get('first_name'),
+        user_data.get('last_name')
+    ]
+
+def register_insert_statements(name, insert_sql, param_types):
+    """
+    Два запроса вставки для insert_for_user.
+    
+    insert_sql - INSERT ... SELECT {user_id}, ... {from_user} RETURNING user_id, ...
+    name - с user_id из кеша, {name}_upsert_user - с созданием/поиском
+    пользователя в CTE того же запроса.
+    """
+    statements.register(name, insert_sql.format(user_id='%s', from_user=''), ['uuid'] + param_types)
+    statements.register(
+        f'{name}_upsert_user',
+        "WITH" + UPSERT_USER_CTE + "\n" + insert_sql.format(user_id='u.id', from_user='FROM u'),
+        ['text', 'text', 'text', 'text'] + param_types
+    )
+
+def insert_for_user(telegram_user_id, user_data, name, params):
+    """
+    Вставка строки пользователя за один запрос (запросы register_insert_statements).
+    
+    Если user_id есть в кеше - выполняется только INSERT, иначе пользователь
+    создается/находится в CTE того же запроса.
+    """
+    telegram_user_id = str(telegram_user_id)
+    user_id = user_cache.get(telegram_user_id)
+    
+    if user_id:
+        result = execute_statement(name, [user_id] + params)
+        if not result['error']:
+            return result
+        # Пользователь мог быть удален - сбрасываем кеш и повторяем полным путем
+        user_cache.invalidate(telegram_user_id)
+    
+    result = execute_statement(f'{name}_upsert_user', user_params(telegram_user_id, user_data) + params)
+    if not result['error'] and not result['data']:
+        # Пользователя параллельно вставил другой запрос уже после снимка
+        # этого: id не виден ни в RETURNING, ни в users - повторяем
+        result = execute_statement(f'{name}_upsert_user', user_params(telegram_user_id, user_data) + params)
+    if result['data']:
+        user_cache.set(telegram_user_id, result['data'][0]['user_id'])
+    return result
+
+def bulk_insert(valid, results, insert_sql, row_values):
+    """
+    Вставка элементов /bulk одной транзакцией.
+    
+    insert_sql - INSERT ... (id, user_id, telegram_user_id, ...) VALUES %s RETURNING id, ...
+    row_values(item) - значения остальных колонок.
+    Все пользователи находятся/создаются одним UPSERT, все строки вставляются
+    одним multi-row INSERT. Если пачка не прошла, элементы вставляются по
+    одному под SAVEPOINT, чтобы ошибка одного не отменяла остальные.
+    """
+    if not valid:
+        return results
+    
+    users = bulk_users(valid)
+    
+    # id генерируем сами: так строки RETURNING сопоставляются с элементами
+    # независимо от порядка, в котором их вернет PostgreSQL
+    row_ids = [str(uuid.uuid4()) for _ in valid]
+    
+    def rows_for(user_ids, positions):
+        return [
+            (row_ids[pos], user_ids[valid[pos][1]], valid[pos][1]) + tuple(row_values(valid[pos][2]))
+            for pos in positions
+        ]
+    
+    inserted = {}
+    errors = {}
+    with pool.connection() as conn, timed_query(query_name(), insert_sql):
+        user_ids, resolved = resolve_user_ids(conn, users, user_cache)
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-            cur.execute(sql, params or [])
-            
-            if fetch:
-                rows = cur.fetchall()
-                result = [dict(row) for row in rows]
-            else:
-                result = []
+            positions = range(len(valid))
+            cur.execute("SAVEPOINT bulk_insert")
+            try:
+                rows = psycopg2.extras.execute_values(
+                    cur, insert_sql, rows_for(user_ids, positions),
+                    page_size=len(valid), fetch=True
+                )
+                inserted = {str(row['id']): dict(row) for row in rows}
+            except psycopg2.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT bulk_insert")
+                print(f"[bulk] batch insert failed, retrying items one by one: {e}")
                 
-            conn.commit()
-            return {'data': result, 'error': None}
-            
+                # Кеш мог устареть (пользователь удален) - находим всех заново
+                user_ids, resolved = resolve_user_ids(conn, users)
+                for pos, row in zip(positions, rows_for(user_ids, positions)):
+                    cur.execute("SAVEPOINT bulk_item")
+                    try:
+                        for inserted_row in psycopg2.extras.execute_values(cur, insert_sql, [row], fetch=True):
+                            inserted[str(inserted_row['id'])] = dict(inserted_row)
+                        cur.execute("RELEASE SAVEPOINT bulk_item")
+                    except psycopg2.Error as item_error:
+                        cur.execute("ROLLBACK TO SAVEPOINT bulk_item")
+                        errors[pos] = str(item_error).strip().splitlines()[0]
+        conn.commit()
+    
+    for telegram_id, user_id in resolved.items():
+        user_cache.set(telegram_id, user_id)
+    
+    return fill_bulk_results(valid, results, row_ids, inserted, errors)
+
+def bulk_response(insert_sql, row_values, transform=None):
+    """Обработка запроса /bulk: {"data": [результат по элементам], "created", "failed"}"""
+    try:
+        valid, results = parse_bulk_items(request.get_json(silent=True), API_CONFIG['bulk_max_items'])
+    except ValueError as e:
+        return jsonify({'data': None, 'error': str(e)}), 400
+    
+    try:
+        results = bulk_insert(valid, results, insert_sql, row_values)
+    except PoolError as e:
+        print(f"Database connection error: {e}")
+        return jsonify({'data': None, 'error': 'Database connection failed'}), 500
     except Exception as e:
-        conn.rollback()
-        return {'data': None, 'error': str(e)}
-    finally:
-        conn.close()
+        return jsonify({'data': None, 'error': str(e)}), 500
+    
+    return jsonify(bulk_summary(results, transform))
 
 # ============================================================================
 # ЭНДПОИНТЫ ДЛЯ СОВМЕСТИМОСТИ С ТЕКУЩИМ КОДОМ
 # ============================================================================
 
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    """Проверка работоспособности API"""
-    try:
-        # Проверяем подключение к БД
-        conn = get_db_connection()
-        if conn:
-            conn.close()
-            return jsonify({
-                'status': 'ok',
-                'message': 'API is running',
-                'database': 'connected',
-                'timestamp': datetime.now().isoformat()
-            }), 200
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': 'Database connection failed',
-                'database': 'disconnected',
-                'timestamp': datetime.now().isoformat()
-            }), 503
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e),
-            'timestamp': datetime.now().isoformat()
-        }), 500
+# Страница стратегий пользователя (keyset по created_at, id)
+register_page_statements(
+    'strategies', 'strategies',
+    ['id', 'name', 'description', 'fields', 'created_at', 'updated_at'],
+    ('created_at', 'updated_at')
+)
 
 @app.route('/api/strategies', methods=['GET'])
 def get_strategies():
@@ -107,29 +490,43 @@ def get_strategies():
     if not telegram_user_id:
         return jsonify({'data': [], 'error': None})
     
+    try:
+        limit, after = parse_page_args(
+            request.args, API_CONFIG['default_page_size'], API_CONFIG['max_page_size'])
+    except ValueError as e:
+        return jsonify({'data': [], 'error': str(e)}), 400
+    
     # Сначала найдем пользователя
-    user_sql = "SELECT id FROM users WHERE telegram_id = %s"
-    user_result = execute_query(user_sql, [telegram_user_id])
+    user_id = find_user_id(telegram_user_id)
+    if not user_id:
+        return jsonify({'data': [], 'error': None, 'next_cursor': None})
     
-    if user_result['error'] or not user_result['data']:
-        return jsonify({'data': [], 'error': None})
+    # Версия данных пользователя: если клиент уже видел ее - отвечаем 304,
+    # не читая и не сериализуя стратегии
+    validators = page_validators('strategies', user_id, limit, request.args.get('cursor'))
+    if validators and is_not_modified(validators):
+        return not_modified_response(validators)
     
-    user_id = user_result['data'][0]['id']
+    # Реплика - только если на ней уже есть последние изменения пользователя
+    db = read_pool(validators[1]) if validators else pool
     
-    # Получаем стратегии пользователя
-    sql = """
-    SELECT id, name, description, fields, created_at, updated_at
-    FROM strategies 
-    WHERE user_id = %s 
-    ORDER BY created_at DESC
-    """
+    if API_CONFIG['json_passthrough']:
+        response = json_page_response('strategies', [user_id], limit, after, db)
+        return conditional_response(response, validators)
     
-    result = execute_query(sql, [user_id])
+    result = fetch_page('strategies', [user_id], limit, after, db)
     
     if result['error']:
         return jsonify({'data': [], 'error': result['error']}), 500
     
-    return jsonify(result)
+    return conditional_response(jsonify(result), validators)
+
+# Создание стратегии (пользователь создается/находится в том же запросе)
+register_insert_statements('insert_strategy', """
+    INSERT INTO strategies (user_id, telegram_user_id, name, description, fields)
+    SELECT {user_id}, %s, %s, %s, %s {from_user}
+    RETURNING id, user_id, name, description, fields, created_at, updated_at
+""", ['text', 'text', 'text', 'jsonb'])
 
 @app.route('/api/strategies', methods=['POST'])
 def create_strategy():
@@ -140,32 +537,41 @@ def create_strategy():
     if not telegram_user_id:
         return jsonify({'data': None, 'error': 'telegram_user_id is required'}), 400
     
-    # Создаем или находим пользователя
-    user_id = ensure_user_exists(telegram_user_id, data.get('user_data', {}))
-    if not user_id:
-        return jsonify({'data': None, 'error': 'Failed to create user'}), 500
-    
-    # Создаем стратегию
-    sql = """
-    INSERT INTO strategies (user_id, telegram_user_id, name, description, fields)
-    VALUES (%s, %s, %s, %s, %s)
-    RETURNING id, name, description, fields, created_at, updated_at
-    """
-    
     params = [
-        user_id,
         telegram_user_id,
         data.get('name'),
         data.get('description'),
         psycopg2.extras.Json(data.get('fields', []))
     ]
     
-    result = execute_query(sql, params)
+    result = insert_for_user(telegram_user_id, data.get('user_data', {}), 'insert_strategy', params)
     
     if result['error']:
         return jsonify({'data': None, 'error': result['error']}), 500
     
-    return jsonify({'data': result['data'][0] if result['data'] else None, 'error': None})
+    strategy = result['data'][0] if result['data'] else None
+    if strategy:
+        strategy.pop('user_id', None)
+    
+    return jsonify({'data': strategy, 'error': None})
+
+@app.route('/api/strategies/bulk', methods=['POST'])
+def create_strategies_bulk():
+    """Создание нескольких стратегий одним запросом (синхронизация офлайн-очереди)"""
+    sql = """
+    INSERT INTO strategies (id, user_id, telegram_user_id, name, description, fields)
+    VALUES %s
+    RETURNING id, name, description, fields, created_at, updated_at
+    """
+    
+    def row_values(item):
+        return (
+            item.get('name'),
+            item.get('description'),
+            psycopg2.extras.Json(item.get('fields', []))
+        )
+    
+    return bulk_response(sql, row_values)
 
 @app.route('/api/strategies/<strategy_id>', methods=['PUT'])
 def update_strategy(strategy_id):
@@ -204,6 +610,15 @@ def delete_strategy(strategy_id):
     
     return jsonify({'error': None})
 
+# Страница анализов пользователя через представление для совместимости
+# (keyset по created_at, id)
+register_page_statements(
+    'analyses', 'analysis_results',
+    ['id', 'user_id', 'strategy_id', 'coin', 'answers', 'positive_factors',
+     'negative_factors', 'neutral_factors', 'recommendation', 'created_at'],
+    ('created_at',)
+)
+
 @app.route('/api/analysis_results', methods=['GET'])
 def get_analyses():
     """Получение анализов пользователя"""
@@ -212,31 +627,42 @@ def get_analyses():
     if not telegram_user_id:
         return jsonify({'data': [], 'error': None})
     
+    try:
+        limit, after = parse_page_args(
+            request.args, API_CONFIG['default_page_size'], API_CONFIG['max_page_size'])
+    except ValueError as e:
+        return jsonify({'data': [], 'error': str(e)}), 400
+    
     # Находим пользователя
-    user_sql = "SELECT id FROM users WHERE telegram_id = %s"
-    user_result = execute_query(user_sql, [telegram_user_id])
+    user_id = find_user_id(telegram_user_id)
+    if not user_id:
+        return jsonify({'data': [], 'error': None, 'next_cursor': None})
     
-    if user_result['error'] or not user_result['data']:
-        return jsonify({'data': [], 'error': None})
+    validators = page_validators('analyses', user_id, limit, request.args.get('cursor'))
+    if validators and is_not_modified(validators):
+        return not_modified_response(validators)
     
-    user_id = user_result['data'][0]['id']
+    # Реплика - только если на ней уже есть последние изменения пользователя
+    db = read_pool(validators[1]) if validators else pool
     
-    # Получаем анализы через представление для совместимости
-    sql = """
-    SELECT id, user_id, strategy_id, coin, answers, 
-           positive_factors, negative_factors, neutral_factors,
-           recommendation, created_at
-    FROM analysis_results 
-    WHERE user_id = %s 
-    ORDER BY created_at DESC
-    """
+    if API_CONFIG['json_passthrough']:
+        response = json_page_response('analyses', [user_id], limit, after, db)
+        return conditional_response(response, validators)
     
-    result = execute_query(sql, [user_id])
+    result = fetch_page('analyses', [user_id], limit, after, db)
     
     if result['error']:
         return jsonify({'data': [], 'error': result['error']}), 500
     
-    return jsonify(result)
+    return conditional_response(jsonify(result), validators)
+
+# Создание анализа (пользователь создается/находится в том же запросе)
+register_insert_statements('insert_analysis', """
+    INSERT INTO analyses (user_id, telegram_user_id, strategy_id, strategy_name, 
+                         coin, answers, results, recommendation)
+    SELECT {user_id}, %s, %s, %s, %s, %s, %s, %s {from_user}
+    RETURNING id, user_id, strategy_id, coin, answers, results, recommendation, created_at
+""", ['text', 'uuid', 'text', 'text', 'jsonb', 'jsonb', 'text'])
 
 @app.route('/api/analysis_results', methods=['POST'])
 def create_analysis():
@@ -247,28 +673,10 @@ def create_analysis():
     if not telegram_user_id:
         return jsonify({'data': None, 'error': 'telegram_user_id is required'}), 400
     
-    # Создаем или находим пользователя
-    user_id = ensure_user_exists(telegram_user_id, data.get('user_data', {}))
-    if not user_id:
-        return jsonify({'data': None, 'error': 'Failed to create user'}), 500
-    
     # Подготавливаем данные результатов
-    results = {
-        'positive': data.get('positive_factors', []),
-        'negative': data.get('negative_factors', []),
-        'neutral': data.get('neutral_factors', [])
-    }
-    
-    # Создаем анализ
-    sql = """
-    INSERT INTO analyses (user_id, telegram_user_id, strategy_id, strategy_name, 
-                         coin, answers, results, recommendation)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-    RETURNING id, user_id, strategy_id, coin, answers, results, recommendation, created_at
-    """
+    results = analysis_results_json(data)
     
     params = [
-        user_id,
         telegram_user_id,
         data.get('strategy_id'),
         data.get('strategy_name'),
@@ -278,20 +686,39 @@ def create_analysis():
         data.get('recommendation')
     ]
     
-    result = execute_query(sql, params)
+    result = insert_for_user(telegram_user_id, data.get('user_data', {}), 'insert_analysis', params)
     
     if result['error']:
         return jsonify({'data': None, 'error': result['error']}), 500
     
     # Преобразуем для совместимости
     if result['data']:
-        analysis = result['data'][0]
-        analysis['positive_factors'] = results['positive']
-        analysis['negative_factors'] = results['negative']
-        analysis['neutral_factors'] = results['neutral']
+        add_analysis_factors(result['data'][0])
     
     return jsonify({'data': result['data'][0] if result['data'] else None, 'error': None})
 
+@app.route('/api/analysis_results/bulk', methods=['POST'])
+def create_analyses_bulk():
+    """Создание нескольких анализов одним запросом (синхронизация офлайн-очереди)"""
+    sql = """
+    INSERT INTO analyses (id, user_id, telegram_user_id, strategy_id, strategy_name,
+                         coin, answers, results, recommendation)
+    VALUES %s
+    RETURNING id, user_id, strategy_id, coin, answers, results, recommendation, created_at
+    """
+    
+    def row_values(item):
+        return (
+            item.get('strategy_id'),
+            item.get('strategy_name'),
+            item.get('coin'),
+            psycopg2.extras.Json(item.get('answers', [])),
+            psycopg2.extras.Json(analysis_results_json(item)),
+            item.get('recommendation')
+        )
+    
+    return bulk_response(sql, row_values, transform=add_analysis_factors)
+
 @app.route('/api/analysis_results/<analysis_id>', methods=['DELETE'])
 def delete_analysis(analysis_id):
     """Удаление анализа"""
@@ -328,20 +755,14 @@ def create_user():
     if not telegram_id:
         return jsonify({'data': None, 'error': 'telegram_id is required'}), 400
     
-    # Проверяем существование
-    check_sql = "SELECT id, telegram_id, username, first_name, last_name, created_at FROM users WHERE telegram_id = %s"
-    result = execute_query(check_sql, [telegram_id])
-    
-    if result['data']:
-        # Пользователь уже существует
-        return jsonify({'data': result['data'][0], 'error': None})
-    
-    # Создаем нового пользователя
+    # Создаем пользователя, а если он уже есть - читаем его в той же транзакции
     create_sql = """
     INSERT INTO users (telegram_id, username, first_name, last_name)
     VALUES (%s, %s, %s, %s)
+    ON CONFLICT (telegram_id) DO NOTHING
     RETURNING id, telegram_id, username, first_name, last_name, created_at
     """
+    check_sql = "SELECT id, telegram_id, username, first_name, last_name, created_at FROM users WHERE telegram_id = %s"
     
     params = [
         telegram_id,
@@ -350,65 +771,68 @@ def create_user():
         data.get('last_name')
     ]
     
-    result = execute_query(create_sql, params)
+    def work(uow):
+        return uow.execute(create_sql, params) or uow.execute(check_sql, [telegram_id])
+    
+    result = execute_transaction(work)
     
     if result['error']:
         return jsonify({'data': None, 'error': result['error']}), 500
     
+    if result['data']:
+        user_cache.set(telegram_id, result['data'][0]['id'])
+    
     return jsonify({'data': result['data'][0] if result['data'] else None, 'error': None})
 
 @app.route('/api/user_events', methods=['POST'])
 def create_user_event():
-    """Создание события пользователя (аналитика)"""
-    data = request.get_json()
+    """Создание события пользователя (аналитика): событие ставится в очередь и пишется пачкой"""
     try:
-        print("[analytics] /api/user_events payload:", data)
-    except Exception:
-        pass
-    
-    telegram_user_id = data.get('telegram_user_id')
-    event_type = data.get('event_type')
+        telegram_user_id, event_type, event_data, user_data = parse_user_event(
+            request.get_json(silent=True), API_CONFIG['event_type_max_length'])
+    except ValueError as e:
+        return jsonify({'data': None, 'error': str(e)}), 400
     
-    if not telegram_user_id or not event_type:
-        return jsonify({'data': None, 'error': 'telegram_user_id and event_type are required'}), 400
+    event = event_buffer.submit(telegram_user_id, event_type, event_data, user_data)
     
-    # Находим пользователя
-    user_data = data.get('user_data') or {}
-    user_id = ensure_user_exists(telegram_user_id, user_data)
-    if not user_id:
-        return jsonify({'data': None, 'error': 'Failed to create user'}), 500
+    if event is None:
+        # Буфер переполнен (БД не успевает) - просим клиента повторить позже
+        response = jsonify({'data': None, 'error': 'Event buffer is full'})
+        response.headers['Retry-After'] = str(max(1, int(event_buffer.flush_interval)))
+        return response, 503
     
-    # Создаем событие
-    sql = """
-    INSERT INTO user_events (user_id, telegram_user_id, event_type, event_data)
-    VALUES (%s, %s, %s, %s)
-    RETURNING id, event_type, created_at
-    """
-    
-    params = [
-        user_id,
-        telegram_user_id,
-        event_type,
-        psycopg2.extras.Json(data.get('event_data', {}))
-    ]
-    
-    result = execute_query(sql, params)
-    
-    if result['error']:
-        return jsonify({'data': None, 'error': result['error']}), 500
-    
-    return jsonify({'data': result['data'][0] if result['data'] else None, 'error': None})
+    return jsonify({'data': event, 'error': None}), 202
+
+# Счетчики пользователя поддерживаются триггерами user_activity
+# (timeweb-user-activity.sql) - без COUNT(*) по strategies и analyses
+statements.register(
+    'user_stats',
+    "SELECT strategies_count AS strategies, analyses_count AS analyses FROM user_activity WHERE user_id = %s",
+    ['uuid']
+)
+statements.register('user_stats_by_telegram_id', """
+    SELECT u.id AS user_id, ua.strategies_count AS strategies, ua.analyses_count AS analyses
+    FROM users u
+    LEFT JOIN user_activity ua ON ua.user_id = u.id
+    WHERE u.telegram_id = %s
+""", ['text'])
 
 @app.route('/api/users/stats/<telegram_user_id>')
 def get_user_stats(telegram_user_id):
-    """Получение статистики пользователя"""
-    sql = "SELECT get_user_stats(%s) as stats"
-    result = execute_query(sql, [telegram_user_id])
+    """Получение статистики пользователя (одно чтение user_activity по ключу)"""
+    user_id = user_cache.get(telegram_user_id)
+    if user_id:
+        result = execute_statement('user_stats', [user_id], db=read_pool())
+    else:
+        result = execute_statement('user_stats_by_telegram_id', [telegram_user_id], db=read_pool())
+        if result['data']:
+            user_cache.set(telegram_user_id, result['data'][0]['user_id'])
     
     if result['error']:
         return jsonify({'data': {'strategies': 0, 'analyses': 0}, 'error': result['error']})
     
-    stats = result['data'][0]['stats'] if result['data'] else {'strategies': 0, 'analyses': 0}
+    row = result['data'][0] if result['data'] else {}
+    stats = {'strategies': row.get('strategies') or 0, 'analyses': row.get('analyses') or 0}
     return jsonify({'data': stats, 'error': None})
 
 # ============================================================================
@@ -425,187 +849,319 @@ def ensure_user_exists(telegram_id, user_data=None):
         print(f"[analytics] ensure_user_exists: telegram_id={telegram_id} (type={type(telegram_id).__name__})")
     except Exception:
         pass
-    # Проверяем существование
-    check_sql = "SELECT id FROM users WHERE telegram_id = %s"
-    result = execute_query(check_sql, [telegram_id])
-    if result.get('error'):
-        print('[analytics] ensure_user_exists SELECT error:', result['error'])
-    
-    if result['data']:
-        return result['data'][0]['id']
+    with profiling.phase('ensure_user'):
+        # Проверяем кеш
+        user_id = user_cache.get(telegram_id)
+        if user_id:
+            return user_id
+        
+        # Создаем пользователя или получаем существующего одним запросом
+        result = execute_statement('upsert_user', user_params(telegram_id, user_data))
+        if not result.get('error') and not result['data']:
+            # Параллельная вставка после снимка запроса (см. insert_for_user)
+            result = execute_statement('upsert_user', user_params(telegram_id, user_data))
+        if result.get('error'):
+            print('[analytics] ensure_user_exists UPSERT error:', result['error'])
+        
+        if result['data']:
+            user_id = result['data'][0]['id']
+            user_cache.set(telegram_id, user_id)
+            return user_id
+        
+        return None
+
+def fetch_page(kind, params, limit, after=None, db=None):
+    """
+    Одна страница keyset-пагинации (запросы register_page_statements).
     
-    # Создаем нового пользователя
-    create_sql = """
-    INSERT INTO users (telegram_id, username, first_name, last_name)
-    VALUES (%s, %s, %s, %s)
-    RETURNING id
+    Возвращает результат execute_query с next_cursor (None на последней странице).
     """
+    name = f'{kind}_page'
+    if after:
+        name += '_after'
+        params = params + [after[0], after[1]]
     
-    # Гарантируем, что user_data - словарь
-    user_data = user_data or {}
-    params = [
-        telegram_id,
-        user_data.get('username'),
-        user_data.get('first_name'),
-        user_data.get('last_name')
-    ]
+    # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+    result = execute_statement(name, params + [limit + 1], db=db)
+    if result['error']:
+        return result
+    
+    rows = result['data']
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
     
-    result = execute_query(create_sql, params)
+    return {'data': rows, 'error': None, 'next_cursor': next_cursor}
+
+statements.register('find_user_id', "SELECT id FROM users WHERE telegram_id = %s", ['text'])
+
+def find_user_id(telegram_id):
+    """Поиск id пользователя по telegram_id (через кеш)"""
+    telegram_id = str(telegram_id)
+    user_id = user_cache.get(telegram_id)
+    if user_id:
+        return user_id
+    
+    result = execute_statement('find_user_id', [telegram_id])
     if result.get('error'):
-        print('[analytics] ensure_user_exists INSERT error:', result['error'])
+        print('[analytics] find_user_id SELECT error:', result['error'])
+        return None
     
     if result['data']:
-        return result['data'][0]['id']
+        user_id = result['data'][0]['id']
+        user_cache.set(telegram_id, user_id)
+        return user_id
     
     return None
 
+for kind, (version_column, changed_column) in DATA_VERSION_COLUMNS.items():
+    statements.register(
+        f'{kind}_version',
+        f"SELECT {version_column} AS version, {changed_column} AS changed_at FROM user_activity WHERE user_id = %s",
+        ['uuid']
+    )
+
+def page_validators(kind, user_id, limit, cursor=None):
+    """
+    ETag и Last-Modified страницы списка по версии данных пользователя.
+    
+    Один запрос по первичному ключу user_activity, строки списка не читаются.
+    Возвращает (etag, last_modified) или None, если версия недоступна.
+    """
+    result = execute_statement(f'{kind}_version', [user_id])
+    if result['error']:
+        print('[cache] page_validators SELECT error:', result['error'])
+        return None
+    if not result['data']:
+        return None
+    
+    return page_validators_from_row(kind, user_id, result['data'][0], limit, cursor)
+
+def is_not_modified(validators):
+    """Проверка If-None-Match (приоритетно) и If-Modified-Since"""
+    etag, last_modified = validators
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since is not None:
+        return not modified_since(last_modified, request.if_modified_since)
+    return False
+
+def conditional_response(response, validators):
+    """ETag/Last-Modified (с точностью до секунды) на ответ; клиент должен перепроверять их при каждом запросе"""
+    if validators and response.status_code in (200, 304):
+        etag, last_modified = validators
+        response.set_etag(etag, weak=True)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def not_modified_response(validators):
+    """Ответ 304 без тела"""
+    return conditional_response(Response(status=304), validators)
+
 # ============================================================================
 # СЛУЖЕБНЫЕ ЭНДПОИНТЫ
 # ============================================================================
 
 @app.route('/api/health')
 def health_check():
-    """Проверка здоровья API"""
-    try:
-        conn = get_db_connection()
-        if conn:
-            conn.close()
-            return jsonify({
-                'status': 'healthy',
-                'timestamp': datetime.now().isoformat(),
-                'database': 'connected'
-            })
-        else:
-            return jsonify({
-                'status': 'unhealthy',
-                'error': 'Database connection failed'
-            }), 500
-    except Exception as e:
-        return jsonify({
-            'status': 'unhealthy',
-            'error': str(e)
-        }), 500
+    """Проверка здоровья API (состояние из фоновой проверки, без запроса к БД)"""
+    status = health.status()
+    body = {
+        'status': status['status'],
+        'reasons': status['reasons'],
+        'timestamp': datetime.now().isoformat(),
+        'database': 'connected' if health.ready(status) else 'disconnected',
+        'db': status['database'],
+        'pool': status['pool'],
+        'user_cache': user_cache.stats(),
+        'events': event_buffer.stats()
+    }
+    if not health.ready(status):
+        body['error'] = 'Database connection failed'
+        return jsonify(body), 500
+    return jsonify(body)
+
+@app.route('/api/health/live')
+def health_live():
+    """Liveness: воркер отвечает (БД не проверяется)"""
+    return jsonify(health.live())
+
+@app.route('/api/health/ready')
+def health_ready():
+    """Readiness: 503, если БД недоступна по последним фоновым проверкам"""
+    status = health.status()
+    return jsonify(status), 200 if health.ready(status) else 503
 
 @app.route('/api/info')
 def api_info():
     """Информация об API"""
-    return jsonify({
-        'name': 'TradeAnalyzer API',
-        'version': '1.0.0',
-        'description': 'API для работы с торговыми стратегиями и анализами',
-        'endpoints': {
-            'GET /api/strategies': 'Получение стратегий пользователя',
-            'POST /api/strategies': 'Создание новой стратегии',
-            'PUT /api/strategies/<id>': 'Обновление стратегии',
-            'DELETE /api/strategies/<id>': 'Удаление стратегии',
-            'GET /api/analysis_results': 'Получение анализов пользователя',
-            'POST /api/analysis_results': 'Создание нового анализа',
-            'DELETE /api/analysis_results/<id>': 'Удаление анализа',
-            'GET /api/users/stats/<telegram_id>': 'Статистика пользователя',
-            'GET /api/health': 'Проверка здоровья API'
-        }
-    })
+    return jsonify(api_info_data())
+
+@app.route('/api/metrics')
+def api_metrics():
+    """Метрики в формате Prometheus (со всех воркеров gunicorn)"""
+    body, content_type = metrics.render()
+    if body is None:
+        return Response('metrics are disabled or prometheus_client is not installed\n',
+                        status=503, mimetype='text/plain')
+    return Response(body, content_type=content_type)
 
 @app.route('/api/admin/stats')
 def admin_stats():
     """Статистика для админ-панели"""
     try:
-        # Всего пользователей
-        users_result = execute_query("SELECT COUNT(*) as count FROM users", [])
-        users_count = users_result['data'][0]['count'] if users_result['data'] else 0
+        # Пользователи, стратегии, анализы и пользователи с хотя бы 1 стратегией
+        return jsonify(admin_counters.get())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/stats/reconcile', methods=['POST'])
+def admin_stats_reconcile():
+    """Сверка счетчиков с точным пересчетом"""
+    try:
+        return jsonify({'data': admin_counters.reconcile(), 'error': None})
+    except Exception as e:
+        return jsonify({'data': None, 'error': str(e)}), 500
+
+@app.route('/api/admin/users_by_date')
+def admin_users_by_date():
+    """Пользователи по датам (для графика) - из дневных итогов daily_rollups"""
+    try:
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
         
-        # Всего стратегий
-        strategies_result = execute_query("SELECT COUNT(*) as count FROM strategies", [])
-        strategies_count = strategies_result['data'][0]['count'] if strategies_result['data'] else 0
+        sql = """
+            SELECT day as date, strategy_users as users_count
+            FROM daily_rollups
+            WHERE strategy_users > 0
+        """
         
-        # Всего анализов
-        analyses_result = execute_query("SELECT COUNT(*) as count FROM analyses", [])
-        analyses_count = analyses_result['data'][0]['count'] if analyses_result['data'] else 0
+        params = []
+        if start_date and end_date:
+            sql += " AND day BETWEEN %s AND %s"
+            params = [start_date, end_date]
         
-        # Пользователи с хотя бы 1 стратегией
-        active_users_result = execute_query("""
-            SELECT COUNT(DISTINCT user_id) as count 
-            FROM strategies
-        """, [])
-        active_users_count = active_users_result['data'][0]['count'] if active_users_result['data'] else 0
+        sql += " ORDER BY day"
         
-        return jsonify({
-            'users': users_count,
-            'strategies': strategies_count,
-            'analyses': analyses_count,
-            'active_users': active_users_count
-        })
+        return stream_query(sql, params, db=read_pool())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/admin/users_by_date')
-def admin_users_by_date():
-    """Пользователи по датам (для графика)"""
+@app.route('/api/admin/daily')
+def admin_daily():
+    """Дневные итоги: новые и активные пользователи, стратегии, анализы, события"""
     try:
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
         sql = """
-            SELECT 
-                DATE(s.created_at) as date,
-                COUNT(DISTINCT s.user_id) as users_count
-            FROM strategies s
+            SELECT day, new_users, active_users, strategy_users, strategies_created,
+                   analyses_created, events, events_by_type
+            FROM daily_rollups
         """
         
         params = []
         if start_date and end_date:
-            sql += " WHERE DATE(s.created_at) BETWEEN %s AND %s"
+            sql += " WHERE day BETWEEN %s AND %s"
             params = [start_date, end_date]
         
-        sql += " GROUP BY DATE(s.created_at) ORDER BY date"
+        sql += " ORDER BY day"
         
-        result = execute_query(sql, params)
-        return jsonify({'data': result['data'] if result['data'] else []})
+        return stream_query(sql, params, db=read_pool())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/cohorts')
+def admin_cohorts():
+    """Недельные когорты: удержание по неделе регистрации"""
+    try:
+        weeks = int(request.args.get('weeks', rollups.DEFAULT_COHORT_WEEKS))
+        if weeks < 1:
+            raise ValueError('weeks must be positive')
+    except ValueError as e:
+        return jsonify({'error': f"Invalid weeks: {e}"}), 400
+    
+    result = execute_query(rollups.COHORTS_SQL, {'since': rollups.cohorts_since(weeks)}, db=read_pool())
+    if result['error']:
+        return jsonify({'data': None, 'error': result['error']}), 500
+    return jsonify({'data': rollups.cohort_table(result['data']), 'error': None})
+
+@app.route('/api/admin/rollups/refresh', methods=['POST'])
+def admin_rollups_refresh():
+    """Пересчет дневных итогов (хвост или ?from=YYYY-MM-DD); обычно - по cron"""
+    try:
+        from_day = rollups.parse_day(request.args.get('from'))
+    except ValueError as e:
+        return jsonify({'error': f"Invalid from: {e}"}), 400
+    
+    result = execute_query(rollups.REFRESH_SQL, [from_day])
+    if result['error']:
+        return jsonify({'data': None, 'error': result['error']}), 500
+    # Пустой результат - пересчет уже идет в другой сессии
+    return jsonify({'data': result['data'][0] if result['data'] else None, 'error': None})
+
 @app.route('/api/admin/users_list')
 def admin_users_list():
     """Список всех пользователей с детальной информацией"""
     try:
         user_type = request.args.get('type', 'all')  # all, active
+        sort = request.args.get('sort', 'created_at')  # created_at, last_activity, strategies_count, analyses_count
+        
+        if sort not in USER_LIST_SORTS:
+            return jsonify({'error': f"Unknown sort: {sort}"}), 400
+        sort_expr, parse_value = USER_LIST_SORTS[sort]
+        
+        # Без limit отдается весь список (потоком), с limit - страница и next_cursor
+        try:
+            limit = request.args.get('limit')
+            limit = int(limit) if limit else None
+            if limit is not None and limit < 1:
+                raise ValueError('limit must be positive')
+            if limit is not None:
+                limit = min(limit, API_CONFIG['max_page_size'])
+            cursor = request.args.get('cursor')
+            after = decode_cursor(cursor, parse_value) if cursor else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
+        conditions = []
+        params = []
         if user_type == 'active':
             # Только пользователи с хотя бы 1 стратегией
-            sql = """
-                SELECT DISTINCT
-                    u.id,
-                    u.telegram_id,
-                    u.username,
-                    u.first_name,
-                    u.last_name,
-                    u.created_at,
-                    (SELECT COUNT(*) FROM strategies WHERE user_id = u.id) as strategies_count,
-                    (SELECT COUNT(*) FROM analyses WHERE user_id = u.id) as analyses_count,
-                    (SELECT MAX(created_at) FROM strategies WHERE user_id = u.id) as last_activity
-                FROM users u
-                INNER JOIN strategies s ON u.id = s.user_id
-                ORDER BY u.created_at DESC
-            """
-        else:
-            # Все пользователи
-            sql = """
-                SELECT 
-                    u.id,
-                    u.telegram_id,
-                    u.username,
-                    u.first_name,
-                    u.last_name,
-                    u.created_at,
-                    (SELECT COUNT(*) FROM strategies WHERE user_id = u.id) as strategies_count,
-                    (SELECT COUNT(*) FROM analyses WHERE user_id = u.id) as analyses_count,
-                    (SELECT MAX(created_at) FROM strategies WHERE user_id = u.id) as last_activity
-                FROM users u
-                ORDER BY u.created_at DESC
-            """
+            conditions.append("ua.strategies_count > 0")
+        if after:
+            conditions.append(f"({sort_expr}, ua.user_id) < (%s, %s)")
+            params += [after[0], after[1]]
         
-        result = execute_query(sql, [])
-        return jsonify({'data': result['data'] if result['data'] else []})
+        # Счетчики берутся из user_activity (поддерживается триггерами),
+        # порядок - по индексу выбранной сортировки
+        sql = f"""
+            SELECT 
+                u.id,
+                u.telegram_id,
+                u.username,
+                u.first_name,
+                u.last_name,
+                u.created_at,
+                ua.strategies_count,
+                ua.analyses_count,
+                ua.last_activity
+            FROM user_activity ua
+            JOIN users u ON u.id = ua.user_id
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY {sort_expr} DESC, ua.user_id DESC
+        """
+        if limit:
+            sql += " LIMIT %s"
+            params.append(limit + 1)
+        
+        def cursor_fn(row):
+            return encode_cursor(row[sort] if row[sort] is not None else EPOCH, row['id'])
+        
+        return stream_query(sql, params, limit=limit, cursor_fn=cursor_fn, db=read_pool())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -620,13 +1176,15 @@ def admin_user_details():
             return jsonify({'error': 'Missing user_id or type parameter'}), 400
         
         if detail_type == 'strategies':
+            columns = ['id', 'name', 'description', 'fields', 'created_at']
             sql = """
                 SELECT id, name, description, fields, created_at
                 FROM strategies
                 WHERE user_id = %s
-                ORDER BY created_at DESC
             """
         else:  # analyses
+            columns = ['id', 'created_at', 'recommendation', 'positive_factors',
+                       'negative_factors', 'neutral_factors', 'strategy_name']
             sql = """
                 SELECT 
                     a.id,
@@ -639,11 +1197,12 @@ def admin_user_details():
                 FROM analyses a
                 LEFT JOIN strategies s ON a.strategy_id = s.id
                 WHERE a.user_id = %s
-                ORDER BY a.created_at DESC
             """
         
-        result = execute_query(sql, [user_id])
-        return jsonify({'data': result['data'] if result['data'] else []})
+        if API_CONFIG['json_passthrough']:
+            return stream_query(row_json_sql(sql, columns, ('created_at',), 'ORDER BY t.created_at DESC'),
+                                [user_id], raw=True, db=read_pool())
+        return stream_query(sql + " ORDER BY created_at DESC", [user_id], db=read_pool())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -662,13 +1221,14 @@ def admin_check_duplicates():
                     u.username,
                     u.first_name,
                     u.created_at,
-                    (SELECT COUNT(*) FROM strategies WHERE user_id = u.id) as strategies_count,
-                    (SELECT COUNT(*) FROM analyses WHERE user_id = u.id) as analyses_count
+                    COALESCE(ua.strategies_count, 0) as strategies_count,
+                    COALESCE(ua.analyses_count, 0) as analyses_count
                 FROM users u
+                LEFT JOIN user_activity ua ON ua.user_id = u.id
                 WHERE u.username = %s
                 ORDER BY u.created_at DESC
             """
-            result = execute_query(sql, [username])
+            result = execute_query(sql, [username], db=read_pool())
         else:
             # Все дубликаты (пользователи с одинаковым username)
             sql = """
@@ -682,12 +1242,79 @@ def admin_check_duplicates():
                 HAVING COUNT(*) > 1
                 ORDER BY count DESC
             """
-            result = execute_query(sql, [])
+            result = execute_query(sql, [], db=read_pool())
         
         return jsonify({'data': result['data'] if result['data'] else []})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/user_cache', methods=['GET'])
+def admin_user_cache_stats():
+    """Статистика кеша пользователей"""
+    return jsonify({'data': user_cache.stats(), 'error': None})
+
+@app.route('/api/admin/user_cache/invalidate', methods=['POST'])
+def admin_user_cache_invalidate():
+    """Сброс кеша пользователей (одной записи или целиком)"""
+    data = request.get_json(silent=True) or {}
+    telegram_id = data.get('telegram_id') or request.args.get('telegram_id')
+    removed = user_cache.invalidate(telegram_id)
+    return jsonify({'data': {'removed': removed}, 'error': None})
+
+@app.route('/api/admin/statements', methods=['GET'])
+def admin_statements_stats():
+    """Счетчики подготовленных запросов (самые затратные - первыми)"""
+    return jsonify({'data': statements.stats(), 'error': None})
+
+@app.route('/api/admin/statements/reset', methods=['POST'])
+def admin_statements_reset():
+    """Обнуление счетчиков подготовленных запросов"""
+    statements.reset()
+    return jsonify({'data': statements.stats(), 'error': None})
+
+@app.route('/api/admin/replicas', methods=['GET'])
+def admin_replicas_stats():
+    """Состояние реплик и распределение чтений"""
+    return jsonify({'data': dict(router.stats(), policies=read_policies), 'error': None})
+
+@app.route('/api/admin/slow_queries', methods=['GET'])
+def admin_slow_queries():
+    """Медленные запросы воркера: по отпечаткам SQL и последние"""
+    return jsonify({'data': slow_log.stats(), 'error': None})
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def admin_profiles():
+    """Профили запросов (X-Profile), сохраненные в этом воркере"""
+    return jsonify({'data': {'enabled': profiler.enabled, 'profiles': profiler.list()}, 'error': None})
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def admin_profile(profile_id):
+    """Профиль запроса; ?format=folded - стеки для flamegraph/speedscope"""
+    profile = profiler.get(profile_id)
+    if profile is None:
+        return jsonify({'data': None, 'error': 'Profile not found'}), 404
+    if request.args.get('format') == 'folded':
+        return Response(profile['folded'], mimetype='text/plain')
+    return jsonify({'data': profile, 'error': None})
+
+@app.route('/api/admin/rate_limits', methods=['GET'])
+def admin_rate_limits():
+    """Лимиты запросов воркера и число отклоненных запросов"""
+    return jsonify({'data': limiter.stats(), 'error': None})
+
+@app.route('/api/admin/events', methods=['GET'])
+def admin_events_stats():
+    """Статистика очереди событий аналитики"""
+    return jsonify({'data': event_buffer.stats(), 'error': None})
+
+@app.route('/api/admin/events/flush', methods=['POST'])
+def admin_events_flush():
+    """Немедленная запись накопленных событий"""
+    try:
+        return jsonify({'data': {'flushed': event_buffer.flush()}, 'error': None})
+    except Exception as e:
+        return jsonify({'data': None, 'error': str(e)}), 500
+
 # ============================================================================
 # ЗАПУСК ПРИЛОЖЕНИЯ
 # ============================================================================
@@ -696,13 +1323,12 @@ if __name__ == '__main__':
     print("🚀 Starting TradeAnalyzer API server...")
     print(f"📊 Database: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}")
     
-    # Проверяем подключение к БД при запуске
-    conn = get_db_connection()
-    if conn:
+    # Проверяем подключение к БД при запуске и прогреваем пул
+    try:
+        pool.fill()
         print("✅ Database connection successful")
-        conn.close()
-    else:
-        print("❌ Database connection failed")
+    except PoolError as e:
+        print(f"❌ Database connection failed: {e}")
         exit(1)
     
     # Запуск в режиме разработки
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Кеш соответствия telegram_id -> users.id в памяти процесса
+Ограничен по размеру (LRU) и по времени жизни записей (TTL)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2.extras
+
+
+def user_cache_config_from_env():
+    """Параметры кеша из переменных окружения"""
+    return {
+        'max_size': int(os.getenv('USER_CACHE_SIZE', '10000')),
+        'ttl': float(os.getenv('USER_CACHE_TTL', '600')),
+    }
+
+
+# Создание/поиск нескольких пользователей одним запросом.
+# Существующая строка обновляется, только если заполняются пустые поля
+# (иначе каждый промах кеша переписывал строку и триггер updated_at);
+# id остальных существующих берется из users в том же запросе.
+UPSERT_USERS_SQL = """
+WITH user_rows (telegram_id, username, first_name, last_name) AS (
+    VALUES %s
+),
+upserted AS (
+    INSERT INTO users (telegram_id, username, first_name, last_name)
+    SELECT * FROM user_rows ORDER BY telegram_id
+    ON CONFLICT (telegram_id) DO UPDATE SET
+        username = COALESCE(users.username, EXCLUDED.username),
+        first_name = COALESCE(users.first_name, EXCLUDED.first_name),
+        last_name = COALESCE(users.last_name, EXCLUDED.last_name)
+    WHERE (users.username IS NULL AND EXCLUDED.username IS NOT NULL)
+       OR (users.first_name IS NULL AND EXCLUDED.first_name IS NOT NULL)
+       OR (users.last_name IS NULL AND EXCLUDED.last_name IS NOT NULL)
+    RETURNING telegram_id, id
+)
+SELECT telegram_id, id FROM upserted
+UNION ALL
+SELECT users.telegram_id, users.id FROM users JOIN user_rows USING (telegram_id)
+WHERE users.telegram_id NOT IN (SELECT telegram_id FROM upserted)
+"""
+
+
+# То же для asyncpg: строки передаются массивами и разворачиваются unnest
+UPSERT_USERS_UNNEST_SQL = """
+WITH user_rows (telegram_id, username, first_name, last_name) AS (
+    SELECT * FROM unnest($1::text[], $2::text[], $3::text[], $4::text[])
+),
+upserted AS (
+    INSERT INTO users (telegram_id, username, first_name, last_name)
+    SELECT * FROM user_rows ORDER BY telegram_id
+    ON CONFLICT (telegram_id) DO UPDATE SET
+        username = COALESCE(users.username, EXCLUDED.username),
+        first_name = COALESCE(users.first_name, EXCLUDED.first_name),
+        last_name = COALESCE(users.last_name, EXCLUDED.last_name)
+    WHERE (users.username IS NULL AND EXCLUDED.username IS NOT NULL)
+       OR (users.first_name IS NULL AND EXCLUDED.first_name IS NOT NULL)
+       OR (users.last_name IS NULL AND EXCLUDED.last_name IS NOT NULL)
+    RETURNING telegram_id, id
+)
+SELECT telegram_id, id FROM upserted
+UNION ALL
+SELECT users.telegram_id, users.id FROM users JOIN user_rows USING (telegram_id)
+WHERE users.telegram_id NOT IN (SELECT telegram_id FROM upserted)
+"""
+
+
+def _split_cached(users, cache):
+    # (найденные в кеше {telegram_id: user_id}, строки UPSERT для остальных).
+    # Сортировка по telegram_id - одинаковый порядок блокировок во всех воркерах
+    user_ids = {}
+    missing = {}
+    for telegram_id, user_data in users.items():
+        telegram_id = str(telegram_id)
+        user_id = cache.get(telegram_id) if cache is not None else None
+        if user_id:
+            user_ids[telegram_id] = user_id
+        else:
+            missing[telegram_id] = user_data or {}
+
+    rows = [
+        (telegram_id, data.get('username'), data.get('first_name'), data.get('last_name'))
+        for telegram_id, data in sorted(missing.items())
+    ]
+    return user_ids, rows
+
+
+def _unresolved(rows, resolved):
+    # Строки UPSERT, для которых запрос не вернул id
+    return [row for row in rows if row[0] not in resolved]
+
+
+def resolve_user_ids(conn, users, cache=None):
+    """
+    user_id для набора пользователей {telegram_id: user_data}.
+
+    Найденные в кеше берутся из него, остальные создаются/находятся одним
+    UPSERT на соединении conn (в его текущей транзакции). Возвращает пару
+    (все user_id, только полученные из БД) - последние стоит положить в кеш
+    после COMMIT.
+    """
+    user_ids, rows = _split_cached(users, cache)
+
+    resolved = {}
+    with conn.cursor() as cur:
+        # Второй проход - строки, которые параллельный запрос вставил уже
+        # после снимка первого: их нет ни в RETURNING, ни в SELECT из users
+        for _ in range(2):
+            if not rows:
+                break
+            for telegram_id, user_id in psycopg2.extras.execute_values(
+                    cur, UPSERT_USERS_SQL, rows, page_size=len(rows), fetch=True):
+                resolved[telegram_id] = str(user_id)
+            rows = _unresolved(rows, resolved)
+    user_ids.update(resolved)
+
+    return user_ids, resolved
+
+
+async def resolve_user_ids_async(conn, users, cache=None):
+    """resolve_user_ids для соединения asyncpg (timeweb_api_async.py)"""
+    user_ids, rows = _split_cached(users, cache)
+
+    resolved = {}
+    for _ in range(2):  # второй проход - как в resolve_user_ids
+        if not rows:
+            break
+        for record in await conn.fetch(UPSERT_USERS_UNNEST_SQL, *(list(column) for column in zip(*rows))):
+            resolved[record['telegram_id']] = str(record['id'])
+        rows = _unresolved(rows, resolved)
+    user_ids.update(resolved)
+
+    return user_ids, resolved
+
+
+class UserIdCache:
+    """Потокобезопасный LRU/TTL кеш telegram_id -> user_id"""
+
+    def __init__(self, max_size=10000, ttl=600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()   # telegram_id -> (user_id, expires_at)
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def get(self, telegram_id):
+        """user_id из кеша или None"""
+        key = str(telegram_id)
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self._counters['misses'] += 1
+                return None
+            user_id, expires_at = item
+            if expires_at <= now:
+                del self._items[key]
+                self._counters['expired'] += 1
+                self._counters['misses'] += 1
+                return None
+            self._items.move_to_end(key)
+            self._counters['hits'] += 1
+            return user_id
+
+    def set(self, telegram_id, user_id):
+        """Сохранение соответствия"""
+        if self.max_size <= 0 or user_id is None:
+            return
+        key = str(telegram_id)
+        with self._lock:
+            self._items[key] = (user_id, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def invalidate(self, telegram_id=None):
+        """Удаление одной записи или всего кеша (telegram_id=None)"""
+        with self._lock:
+            if telegram_id is None:
+                removed = len(self._items)
+                self._items.clear()
+            else:
+                removed = 1 if self._items.pop(str(telegram_id), None) else 0
+            self._counters['invalidations'] += removed
+            return removed
+
+    def stats(self):
+        """Статистика кеша"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._items)
+        lookups = stats['hits'] + stats['misses']
+        stats['max_size'] = self.max_size
+        stats['ttl'] = self.ttl
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats